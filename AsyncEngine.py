@@ -0,0 +1,458 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import shlex
+import time
+import traceback
+
+import aiohttp
+import asyncssh
+
+from Devices import package_name
+from PackageCache import DEFAULT_MAX_MB
+from Shell import COMMAND_TIMEOUT, PROMPT_TIMEOUT, prompt_sentinel
+from Threads import (PROGRESS_CONNECTED, PROGRESS_INSTALLED, PROGRESS_ROOT, PROGRESS_SERVICE, SCRIPT_TIMEOUT, Deployment,
+					 command_label, fingerprint_command, install_commands, is_installed, marker_command,
+					 probe_payload, root_shell, systemctl)
+
+CHUNK_SIZE = 1024 * 1024
+KEEPALIVE = 15  # Seconds between keepalives on a device connection waiting for its install
+
+
+class AsyncLimit:
+	"""Semaphore whose size can change while coroutines hold it. None means no limit."""
+	def __init__(self, size):
+		self.size = size
+		self.active = 0
+		self.cond = asyncio.Condition()
+
+	async def __aenter__(self):
+		async with self.cond:
+			await self.cond.wait_for(lambda: self.size is None or self.active < self.size)
+			self.active += 1
+
+	async def __aexit__(self, *exc_info):
+		async with self.cond:
+			self.active -= 1
+			self.cond.notify_all()
+
+	async def resize(self, size):
+		async with self.cond:
+			self.size = size
+			self.cond.notify_all()
+
+
+async def read_until(stream, expected, timeout):
+	"""Read from the stream until the expected bytes show up, it closes or the timeout expires.
+	With expected None it reads until the stream closes."""
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + timeout
+	reply = bytearray()
+	while True:
+		remaining = deadline - loop.time()
+		if remaining <= 0:
+			break
+		try:
+			data = await asyncio.wait_for(stream.read(8192), remaining)
+		except asyncio.TimeoutError:
+			break
+		if not data:
+			break
+		reply.extend(data)
+		if expected and expected in reply:
+			break
+	return reply.decode('utf-8', 'replace')
+
+
+async def run_command(process, prompt, command, timeout=COMMAND_TIMEOUT):
+	"""Run a command in an interactive shell whose prompt was set by prompt_sentinel() and
+	wait for the prompt after it. Returns its output and how many seconds it took."""
+	start = time.monotonic()
+	process.stdin.write(command.encode() + b'\n')
+	output = await read_until(process.stdout, prompt, timeout)
+	if prompt.decode() not in output:
+		raise asyncssh.Error(asyncssh.DISC_CONNECTION_LOST, f"No prompt {timeout} s after: {command}")
+	return output.split(prompt.decode(), 1)[0], time.monotonic() - start
+
+
+async def run_as_root(conn, command, password, password_prompt, timeout=COMMAND_TIMEOUT):
+	"""Run a command that asks for the root password on a terminal, like Shell.run_as_root().
+	Returns the exit status and everything the command printed after the prompt."""
+	process = await conn.create_process(command, term_type='vt100', term_size=(300, 24), encoding=None)
+	try:
+		prompt = password_prompt.decode()
+		output = await read_until(process.stdout, password_prompt, PROMPT_TIMEOUT)
+		expected = None
+		if prompt in output:
+			process.stdin.write(password.encode() + b'\n')
+			output = output.split(prompt, 1)[1]
+			expected = password_prompt  # Asked again means the password was refused
+		output += await read_until(process.stdout, expected, timeout)
+		if expected and prompt in output:
+			raise asyncssh.PermissionDenied("Root password was not accepted")
+		if not process.stdout.at_eof():
+			raise asyncssh.Error(asyncssh.DISC_CONNECTION_LOST, f"Still running after {timeout} s: {command}")
+		await process.wait_closed()
+		return process.exit_status, output
+	finally:
+		process.close()
+
+
+class AsyncDeployProbes(Deployment):
+	"""Same deployment as DeployProbesThread, run as coroutines on a single event loop thread.
+
+	Downloads go through aiohttp and transfers and installs through asyncssh, so a device
+	waiting on the network costs a coroutine rather than an OS thread. Each device is its own
+	coroutine chain (download -> transfer -> install), limited per stage like the threaded
+	engine. Jobs are updated exactly like the threaded workers update them."""
+	def __init__(self, devices, insite_ip, download_batch, sftp_batch, ssh_batch=None, max_handshakes=None,
+				 cache_mb=DEFAULT_MAX_MB, force_reinstall=False, script_install=False):
+		super().__init__(devices, insite_ip, cache_mb, force_reinstall, script_install)
+		self.batch_sizes = {"download": download_batch, "sftp": sftp_batch, "ssh": ssh_batch}
+		self.max_handshakes = max_handshakes
+		self.limits = {}
+		self.handshakes = None
+		self.connections = {}  # id(device) -> asyncssh connection shared by its transfer and install
+		self.loop = None
+		self.main_task = None
+
+	def run(self):
+		try:
+			asyncio.run(self.deploy())
+		except asyncio.CancelledError:
+			pass
+		finally:
+			self.close_logs()
+		if self.end_event.is_set():  # Stopped by user
+			return
+
+		self.log_data()
+		self.release_packages()
+		self.end_event.set()
+
+	async def deploy(self):
+		self.loop = asyncio.get_running_loop()
+		self.main_task = asyncio.current_task()
+		if self.end_event.is_set():
+			return
+
+		self.limits = {stage: AsyncLimit(size) for stage, size in self.batch_sizes.items()}
+		if self.max_handshakes:
+			self.handshakes = asyncio.Semaphore(self.max_handshakes)
+
+		connector = aiohttp.TCPConnector(ssl=False, limit=self.batch_sizes["download"])
+		async with aiohttp.ClientSession(connector=connector) as session:
+			downloads = {}
+			for job in self.download_jobs:
+				pair = (job.device.probe_type, job.device.file_type)
+				downloads[pair] = asyncio.ensure_future(self.guarded(job, self.download(session, job),
+																	 self.download_error))
+			await asyncio.gather(*(
+				self.deploy_device(job, downloads[(job.device.probe_type, job.device.file_type)])
+				for job in self.sftp_jobs
+			))
+
+	async def deploy_device(self, sftp_job, download):
+		await download  # Failed downloads mark the job as errored, which flows down the chain
+		try:
+			async with self.limits["sftp"]:
+				await self.guarded(sftp_job, self.transfer(sftp_job), self.sftp_error)
+			ssh_job = self.sftp_to_ssh[id(sftp_job)]
+			if ssh_job.skipped:
+				return
+			async with self.limits["ssh"]:
+				await self.guarded(ssh_job, self.install(ssh_job), self.ssh_error)
+		finally:
+			conn = self.connections.pop(id(sftp_job.device), None)
+			if conn is not None:
+				conn.close()
+
+	@staticmethod
+	async def guarded(job, step, on_error):
+		"""Run one stage of a job. An exception the stage does not handle itself errors the
+		job, with its traceback in the job log, instead of ending the whole run."""
+		try:
+			await step
+		except Exception as e:
+			job.add_log(f"Unexpected error: {e!r}")
+			job.add_log(traceback.format_exc())
+			on_error(job)
+
+	async def connect(self, device):
+		"""The device's connection, opened by the transfer and reused by the install."""
+		conn = self.connections.get(id(device))
+		if conn is not None and not conn.is_closed():
+			return conn
+		async with self.handshakes or contextlib.nullcontext():
+			started = time.perf_counter()
+			conn = await asyncssh.connect(device.control_ip, device.port, username=device.username,
+										  password=device.password, known_hosts=None, keepalive_interval=KEEPALIVE)
+			self.metrics.observe("ssh_connect_seconds", time.perf_counter() - started)  # Includes auth here
+		self.connections[id(device)] = conn
+		return conn
+
+	async def download(self, session, job):
+		async with self.limits["download"]:
+			job.in_progress = True
+			file = package_name(job.device)
+			job.add_log("Starting download")
+			for attempt in range(1, 4):
+				try:
+					url = f"https://{self.insite_ip}/api/-/model/probes?static-asset=true"
+					payload = probe_payload(job.device)
+					job.add_log(f"Attempt {attempt}: Requesting probe File Path")
+					started = time.perf_counter()
+					async with session.post(url, json=payload) as response:
+						job.add_log(f"Attempt {attempt}: Response status code: {response.status}")
+						if response.status != 200:
+							job.add_log(f"Attempt {attempt}: Failed to get download path. Status code: {response.status}")
+							continue
+						path = (await response.json(content_type=None)).get("path")
+					self.metrics.observe("download_request_seconds", time.perf_counter() - started)
+					job.add_log(f"Attempt {attempt}: Path retrieved: {path}")
+					if not path:
+						continue
+
+					download_url = f"https://{self.insite_ip}/probe/download/{path}"
+					cache_key = self.cache.key(self.insite_ip, payload)
+					headers = self.cache.validators(cache_key)
+					if headers:
+						job.add_log(f"Attempt {attempt}: Revalidating cached package")
+					job.add_log(f"Attempt {attempt}: Downloading file...")
+					async with session.get(download_url, headers=headers) as response:
+						job.add_log(f"Attempt {attempt}: Download response status code: {response.status}")
+						if response.status == 304:
+							self.add_package(job.device, cache_key, self.cache.hit(cache_key))
+							job.size = self.cache.lookup(cache_key)["size"] / (1024 * 1024)
+							job.add_log(f"Attempt {attempt}: Cache hit, package unchanged since the last download")
+							job.update(in_progress=False, completed=True, progress=100)
+							return
+						if response.status != 200:
+							job.add_log(f"Attempt {attempt}: Failed to download file. Status code: {response.status}")
+							continue
+						total_size = response.content_length or 0
+						job.size = total_size / (1024 * 1024)
+						job.add_log(f"Attempt {attempt}: Total file size: {job.size} MB")
+						self.cache.discard_partial(cache_key)  # Resuming is left to the threaded engine
+						temp_path = self.cache.temp_path(cache_key)
+						digest = hashlib.sha256()
+						with open(temp_path, "wb") as out:
+							downloaded_size = 0
+							start_time = time.monotonic()
+							async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+								out.write(chunk)
+								digest.update(chunk)
+								downloaded_size += len(chunk)
+								if total_size:
+									job.progress = (downloaded_size / total_size) * 100
+								elapsed_time = time.monotonic() - start_time
+								if elapsed_time > 0:
+									job.speed = downloaded_size / elapsed_time / (1024 * 1024)
+						elapsed_time = time.monotonic() - start_time
+						self.metrics.observe("download_seconds", elapsed_time)
+						if elapsed_time > 0:
+							self.metrics.observe("download_mb_per_second", downloaded_size / elapsed_time / (1024 * 1024))
+						file_path = self.cache.store(cache_key, temp_path, response.headers.get("ETag"),
+													 response.headers.get("Last-Modified"), digest.hexdigest())
+						self.add_package(job.device, cache_key, file_path)
+
+					job.add_log(f"Attempt {attempt}: File downloaded successfully")
+					job.update(in_progress=False, completed=True, progress=100)
+					return
+				except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+					job.add_log(f"Attempt {attempt}: Error in downloading {file}: {e}")
+
+			job.add_log("Failed after 3 retries")
+			self.download_error(job)
+
+	def download_error(self, job):
+		job.update(error=True, progress=100, in_progress=False, completed=False)
+		self.handle_download_error(job.device.probe_type, job.device.file_type)
+
+	def sftp_error(self, job):
+		self.handle_sftp_error(job.device)
+		job.update(error=True, progress=100, in_progress=False, completed=False)
+
+	async def probe_installed(self, conn, job):
+		"""Whether the device runs the probe from the very package being deployed."""
+		job.add_log("Checking installed probe")
+		result = await conn.run(fingerprint_command(job.device), timeout=30)
+		return is_installed(str(result.stdout), self.package_sha256(job.device))
+
+	async def already_present(self, conn, sftp, job, file_path, dest):
+		"""Whether dest already holds this exact package, by size and then by sha256sum."""
+		digest = self.package_sha256(job.device)
+		if not digest:
+			return False
+		try:
+			if (await sftp.stat(dest)).size != os.path.getsize(file_path):
+				return False
+		except asyncssh.SFTPNoSuchFile:
+			return False
+		job.add_log(f"Checking sha256 of existing {dest}")
+		result = await conn.run(f"sha256sum {shlex.quote(dest)}", timeout=60)
+		return str(result.stdout).split()[:1] == [digest]
+
+	async def transfer(self, job):
+		device = job.device
+		if job.error:  # Download failed
+			self.sftp_error(job)
+			return
+
+		try:
+			job.add_log("Connecting to device via SSH")
+			conn = await self.connect(device)
+			job.add_log("SFTP Started")
+			async with conn.start_sftp_client() as sftp:
+				file = package_name(device)
+				file_path = self.package_path(device)
+				dest = f"/home/{device.username}/{file}"
+				start_time = time.monotonic()
+				job.in_progress = True
+				if not self.force_reinstall and await self.probe_installed(conn, job):
+					job.add_log("insite-probe is already running this package, skipping transfer and install")
+					job.update(skipped="Already installed", progress=100, in_progress=False, completed=True)
+					self.handle_installed(job)
+					return
+				if await self.already_present(conn, sftp, job, file_path, dest):
+					job.add_log(f"{dest} already matches the package, skipping transfer")
+					job.skipped = "Already present"
+					job.size = job.done = os.path.getsize(file_path) / (1024 * 1024)
+					job.update(progress=100, in_progress=False, completed=True)
+					return
+
+				def sftp_progress(src, dst, transferred, total):
+					sent_mb = transferred / (1024 * 1024)
+					job.update(done=sent_mb, size=total / (1024 * 1024),
+							   progress=(transferred / total) * 100 if total > 0 else 0)
+					elapsed_time = time.monotonic() - start_time
+					if elapsed_time > 0:
+						job.speed = sent_mb / elapsed_time
+
+				job.add_log(f"Transferring {file_path} to {dest}")
+				started = time.perf_counter()
+				await sftp.put(file_path, dest, progress_handler=sftp_progress)
+				elapsed = time.perf_counter() - started
+				self.metrics.observe("sftp_transfer_seconds", elapsed)
+				if elapsed > 0:
+					self.metrics.observe("sftp_mb_per_second", os.path.getsize(file_path) / elapsed / (1024 * 1024))
+			job.add_log("Probe package SFTP to device successful")
+			job.update(in_progress=False, completed=True)
+		except (asyncssh.Error, OSError) as e:
+			job.add_log(f"SFTP failed: {str(e)}")
+			self.sftp_error(job)
+
+	@staticmethod
+	def ssh_error(job):
+		job.update(error=True, completed=True, in_progress=False, progress=100)
+
+	async def install_script(self, job, conn):
+		"""Install the probe with one generated script run as root, a single round trip."""
+		command, passw, token = self.script_command(job.device)
+		job.add_log("Running install script")
+		job.progress = PROGRESS_ROOT
+		start = time.monotonic()
+		status, output = await run_as_root(conn, command, job.device.password, passw, SCRIPT_TIMEOUT)
+		if not self.report_script(job, status, output, token, time.monotonic() - start, self.metrics):
+			self.ssh_error(job)
+			return
+		job.add_log("Probe started successfully.")
+		job.update(completed=True, in_progress=False, progress=100)
+		job.add_log("SSH connection closed")
+
+	async def install(self, job):
+		device = job.device
+		if job.error:  # Download or transfer failed
+			self.ssh_error(job)
+			return
+
+		job.update(in_progress=True, progress=0)
+		job.add_log("Starting working on SSH job")
+		started = time.perf_counter()
+		try:
+			job.add_log(f"Connecting to {device.control_ip}")
+			conn = await self.connect(device)
+			job.progress = PROGRESS_CONNECTED
+			if self.script_install:
+				await self.install_script(job, conn)
+				if not job.error:
+					self.metrics.observe("install_seconds", time.perf_counter() - started)
+				return
+			job.add_log("Executing SSH commands")
+			process = await conn.create_process(term_type='vt100', term_size=(300, 24), encoding=None)
+
+			job.add_log("Switching to root shell")
+			root_started = time.perf_counter()
+			sudo, passw = root_shell(device)
+			process.stdin.write(sudo.encode() + b'\n')
+			await read_until(process.stdout, passw, PROMPT_TIMEOUT)
+			process.stdin.write(device.password.encode() + b'\n')
+			if '#' in await read_until(process.stdout, b'#', PROMPT_TIMEOUT):
+				job.add_log("Switched to root shell")
+			else:
+				job.add_log("Could not gain root shell.")
+				self.ssh_error(job)
+				return
+			command, prompt = prompt_sentinel()
+			process.stdin.write(command.encode() + b'\n')
+			if prompt.decode() not in await read_until(process.stdout, prompt, PROMPT_TIMEOUT):
+				raise asyncssh.Error(asyncssh.DISC_CONNECTION_LOST, "The shell did not accept a new prompt")
+			self.metrics.observe("root_shell_seconds", time.perf_counter() - root_started)
+
+			async def execute(command):
+				output, elapsed = await run_command(process, prompt, command)
+				job.add_log(f"Command finished in {elapsed * 1000:.0f} ms")
+				self.metrics.observe("install_command_seconds", elapsed, command=command_label(command))
+				return output
+
+			job.progress = PROGRESS_ROOT
+			commands = install_commands(device)
+			for number, command in enumerate(commands, 1):
+				job.add_log(f"Executing command: {command}")
+				await execute(command)
+				job.progress = PROGRESS_ROOT + (PROGRESS_INSTALLED - PROGRESS_ROOT) * number / len(commands)
+
+			job.add_log("Starting probe service")
+			service_started = time.perf_counter()
+			await execute(f'{systemctl(device)} start insite-probe')
+			job.progress = PROGRESS_SERVICE
+			if 'active (running)' not in await execute(f'{systemctl(device)} --no-pager status insite-probe'):
+				job.add_log("Probe not started. Error occurred while installing it.")
+				job.add_log("This was because the deployer could not confirm the status of probe service.")
+				self.ssh_error(job)
+				return
+			self.metrics.observe("service_start_seconds", time.perf_counter() - service_started)
+			job.add_log("Probe started successfully.")
+			digest = self.package_sha256(device)
+			if digest:
+				await execute(marker_command(digest))
+
+			job.update(completed=True, in_progress=False, progress=100)
+			job.add_log("SSH connection closed")
+			self.metrics.observe("install_seconds", time.perf_counter() - started)
+		except asyncssh.PermissionDenied as err:
+			job.add_log(f"Authentication failed: {str(err)}")
+			self.ssh_error(job)
+		except (asyncssh.Error, OSError) as err:
+			job.add_log(f"SSH Error: {str(err)}")
+			self.ssh_error(job)
+
+	def set_batch_sizes(self, download_batch=None, sftp_batch=None, ssh_batch=None):
+		"""Change stage concurrency while the deployment is running."""
+		if self.loop is None:
+			return
+		for stage, size in (("download", download_batch), ("sftp", sftp_batch), ("ssh", ssh_batch)):
+			if size is not None and stage in self.limits:
+				asyncio.run_coroutine_threadsafe(self.limits[stage].resize(size), self.loop)
+
+	def stop(self, block=False):
+		"""Signal the thread to stop and optionally block until exited."""
+		self.end_event.set()
+		if self.loop is not None and self.main_task is not None:
+			try:
+				self.loop.call_soon_threadsafe(self.main_task.cancel)
+			except RuntimeError:  # Loop already closed
+				pass
+		if block is True and self.is_alive():
+			self.join()
@@ -0,0 +1,140 @@
+import contextlib
+import threading
+import time
+
+import paramiko
+
+KEEPALIVE = 15  # Seconds between keepalives on an open transport
+IDLE_TIMEOUT = 120  # Seconds an unused transport is kept before it is closed
+MAX_IDLE = 256  # Unused transports kept at most, each holds a socket and a thread
+
+
+class ConnectionPool:
+	"""Authenticated SSH transports kept open between deployment stages.
+
+	Transports are keyed by host, port and user, so a device is handshaken once per run:
+	the transfer stage connects, the install stage opens its shell channel on the same
+	transport. Unused transports are closed after idle_timeout, or oldest first once more
+	than max_idle are waiting. New handshakes go through the deployment's HandshakeGate, and
+	their connect and auth times into its RunMetrics when given."""
+	def __init__(self, gate=None, keepalive=KEEPALIVE, idle_timeout=IDLE_TIMEOUT, max_idle=MAX_IDLE, metrics=None):
+		self.gate = gate
+		self.metrics = metrics
+		self.keepalive = keepalive
+		self.idle_timeout = idle_timeout
+		self.max_idle = max_idle
+		self.entries = {}  # key -> PooledTransport
+		self.lock = threading.Lock()
+
+	@staticmethod
+	def key(device):
+		return device.control_ip, device.port, device.username
+
+	@contextlib.contextmanager
+	def connection(self, device, keep=True):
+		"""Yield an authenticated transport to device. With keep False it is closed afterwards,
+		once nobody else is using it."""
+		transport = self.acquire(device)
+		try:
+			yield transport
+		finally:
+			self.release(device, transport, keep and transport.is_active())
+
+	def acquire(self, device):
+		key = self.key(device)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None or (entry.transport is not None and not entry.transport.is_active()):
+				entry = self.entries[key] = PooledTransport()
+			entry.users += 1
+		try:
+			with entry.lock:  # A second stage for the same device waits for the first handshake
+				if entry.transport is None or not entry.transport.is_active():
+					entry.transport = self.open(device)
+		except BaseException:
+			with self.lock:
+				entry.users -= 1
+				if self.entries.get(key) is entry and entry.users == 0:
+					del self.entries[key]
+			raise
+		return entry.transport
+
+	def open(self, device):
+		transport = None
+		try:
+			with self.gate.attempt() if self.gate else contextlib.nullcontext():
+				with self.timer("ssh_connect_seconds"):
+					transport = paramiko.Transport((device.control_ip, device.port))
+					transport.start_client()
+				with self.timer("ssh_auth_seconds"):
+					transport.auth_password(device.username, device.password)
+			if not transport.is_authenticated():
+				raise paramiko.AuthenticationException("Authorization failed.")
+		except BaseException:
+			if transport is not None:
+				transport.close()
+			raise
+		transport.set_keepalive(self.keepalive)
+		return transport
+
+	def timer(self, name):
+		return self.metrics.timer(name) if self.metrics else contextlib.nullcontext()
+
+	def release(self, device, transport, keep=True):
+		key = self.key(device)
+		closing = []
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None or entry.transport is not transport:
+				closing.append(transport)  # Replaced by a fresh connection meanwhile
+			else:
+				entry.users -= 1
+				entry.last_used = time.monotonic()
+				if not keep and entry.users == 0:
+					del self.entries[key]
+					closing.append(transport)
+			closing.extend(self.evict())
+		for transport in closing:
+			transport.close()
+
+	def evict(self):
+		"""Drop idle transports past their timeout or beyond max_idle and return them for
+		closing. Lock must be held."""
+		now = time.monotonic()
+		idle = sorted((entry.last_used, key) for key, entry in self.entries.items() if entry.users == 0)
+		evicted = []
+		for count, (last_used, key) in enumerate(idle):
+			if now - last_used > self.idle_timeout or len(idle) - count > self.max_idle:
+				evicted.append(self.entries.pop(key).transport)
+		return [transport for transport in evicted if transport is not None]
+
+	def close_all(self):
+		with self.lock:
+			entries = list(self.entries.values())
+			self.entries = {}
+		for entry in entries:
+			entry.close()
+
+
+class PooledTransport:
+	def __init__(self):
+		self.transport = None
+		self.users = 0
+		self.last_used = time.monotonic()
+		self.lock = threading.Lock()
+
+	def close(self):
+		if self.transport is not None:
+			self.transport.close()
+
+
+def run_command(transport, command, timeout=60):
+	"""Run a command in its own channel. Returns its exit status and standard output."""
+	channel = transport.open_session(timeout=timeout)
+	try:
+		channel.settimeout(timeout)
+		channel.exec_command(command)
+		output = channel.makefile('rb').read().decode('utf-8', 'replace')
+		return channel.recv_exit_status(), output
+	finally:
+		channel.close()
@@ -1,7 +1,6 @@
 import threading
 import paramiko
-import time
-import time
+from Shell import PROMPT_TIMEOUT, Shell
 
 class Device:
 	def __init__(self, alias: str, control_ip: str, user, passw, probe="") -> None:
@@ -16,21 +15,6 @@ class SSHWorker(threading.Thread):
 		super().__init__()
 		self.device = device
 
-	@staticmethod
-	def read_until(channel, expected, timeout=None):
-		"""Read from the channel until the expected text is found or the timeout expires."""
-		start = time.time()
-		reply = bytearray()
-		while not channel.exit_status_ready():
-			if channel.recv_ready():
-				reply.extend(channel.recv(8192))
-				if expected and expected in reply:
-					break
-			elif timeout and time.time() - start > timeout:
-				break
-			time.sleep(0.1)
-		return reply.decode('utf-8')
-
 	def authenticate(self, transport):
 		"""Authenticate to the SSH server."""
 		try:
@@ -42,24 +26,24 @@ class SSHWorker(threading.Thread):
 		return True
 
 
-	def execute_commands(self, channel, commands):
-		"""Send a list of commands to the SSH channel."""
+	def execute_commands(self, shell, commands):
+		"""Run a list of commands in the root shell."""
 		for command in commands:
 			print(f"Executing command: {command}")
-			channel.send(command + '\n')
-			out = self.read_until(channel, b'#', 20)
+			out, elapsed = shell.run(command)
 			print(out)
+			print(f"Command finished in {elapsed * 1000:.0f} ms")
 
-	def uninstall_probe(self, channel):
+	def uninstall_probe(self, shell):
 		"""uninstall the probe on the device."""
 		commands = [
 			'rm -rf /opt/evertz/insite/probe',
 			'rm /lib/systemd/system/insite-probe.service',
 			'rm /usr/lib/systemd/system/insite-probe.service',
 			'rm -rf /bin/insite-probe',
-			'systemctl reboot'
 		]
-		self.execute_commands(channel, commands)
+		self.execute_commands(shell, commands)
+		shell.send('systemctl reboot')  # No prompt comes back from this one
 
 
 	def run(self):
@@ -73,23 +57,25 @@ class SSHWorker(threading.Thread):
 			channel = transport.open_session()
 			channel.get_pty(term='vt100', width=300, height=24)
 			channel.invoke_shell()
+			shell = Shell(channel)
 
 			# Gain root access
 			if self.device.probe_type == "debian":
-				sudo = 'su\n'
+				sudo = 'su'
 				passw = b'Password:'
 			else:
-				sudo = 'sudo -s\n'
+				sudo = 'sudo -s'
 				passw = b'[sudo] password for'
 
-			channel.send(sudo)
-			self.read_until(channel, passw, 5)
-			channel.send(self.device.password + '\n')
-			out = self.read_until(channel, b'#', 5)
+			shell.send(sudo)
+			shell.read_until(passw, PROMPT_TIMEOUT)
+			shell.send(self.device.password)
+			out = shell.read_until(b'#', PROMPT_TIMEOUT)
 			if not '#' in out:
 				return
+			shell.start()
 
-			self.uninstall_probe(channel)
+			self.uninstall_probe(shell)
 			transport.close()
 		except paramiko.SSHException as err:
 			pass
@@ -0,0 +1,191 @@
+import wx
+import wx.grid
+from typing import List
+from Devices import (ALIAS, CONTROL_IP, DEPLOY, DEVICE_COLUMNS, FILE_TYPE, FILE_TYPES, PROBE_TYPE, PROBE_TYPES, Device,
+                     DeviceEdits)
+
+
+class DevicePopup(wx.Dialog):
+    def __init__(self, parent: wx.Window, device_type: str, devices: List[Device], focus: int = None) -> None:
+        super().__init__(parent, title=f"Devices for {device_type}", size=(700, 400), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.parent = parent
+        self.wxconfig = parent.wxconfig
+        self.device_type: str = device_type
+        self.devices: List[Device] = devices
+        self.cmb_bx_tuples = []
+
+        self.main_sizer: wx.BoxSizer = wx.BoxSizer(wx.VERTICAL)
+
+        top_grid= wx.GridBagSizer()
+        self.username_label_all: wx.StaticText = wx.StaticText(self, label="User:")
+        self.username_text_all: wx.TextCtrl = wx.TextCtrl(self, size=(90, -1), value=self.wxconfig.Read('/deviceUser', defaultVal=""))
+        self.password_label_all: wx.StaticText = wx.StaticText(self, label="Password:")
+        self.password_text_all: wx.TextCtrl = wx.TextCtrl(self, size=(90, -1),  value=self.wxconfig.Read('/devicePass', defaultVal=""))
+        self.probe_type = wx.ComboBox(self, choices=list(PROBE_TYPES.keys()), style=wx.CB_READONLY)
+        self.probe_type.SetSelection(0)
+        self.probe_type.Bind(wx.EVT_COMBOBOX, self.on_probe_type_changed)
+        self.file_type = wx.ComboBox(self, choices=list(FILE_TYPES.keys()), style=wx.CB_READONLY)
+        self.file_type.SetSelection(0)
+        self.file_type.Bind(wx.EVT_COMBOBOX, self.on_file_type_changed)
+        self.cmb_bx_tuples.append((self.probe_type, self.file_type))
+        self.apply_all_button: wx.Button = wx.Button(self, label="Apply All")
+        top_grid.Add(self.probe_type, pos=(0, 0), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.file_type, pos=(0, 1), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.username_label_all, pos=(0, 2), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.username_text_all, pos=(0, 3), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.password_label_all, pos=(0, 4), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.password_text_all, pos=(0, 5), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        top_grid.Add(self.apply_all_button, pos=(0, 6), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+
+        # Virtual grid: cells are drawn from self.edits, editors only exist while a cell is edited
+        self.edits = DeviceEdits(devices)
+        self.table = DeviceTable(self.edits)
+        self.grid = wx.grid.Grid(self)
+        self.grid.SetTable(self.table, takeOwnership=True)
+        self.grid.SetRowLabelSize(0)
+        self.grid.SetSelectionMode(wx.grid.Grid.SelectRows)
+        for col, width in enumerate([60, 150, 110, 100, 80, 100, 100]):
+            self.grid.SetColSize(col, width)
+        self.grid.DisableDragRowSize()
+        if focus is not None:  # First device matching the list's search
+            self.grid.GoToCell(focus, ALIAS)
+            self.grid.SelectRow(focus)
+
+        self.main_sizer.Add(top_grid, 0, wx.ALL | wx.CENTER, 5)
+        self.main_sizer.Add(self.grid, 1, wx.EXPAND | wx.ALL, 20)
+
+        self.save_button: wx.Button = wx.Button(self, label="Save")
+        self.cancel_button: wx.Button = wx.Button(self, label="Cancel")
+        self.button_sizer: wx.BoxSizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.button_sizer.Add(self.save_button, 0, wx.ALL, 5)
+        self.button_sizer.Add(self.cancel_button, 0, wx.ALL, 5)
+        self.main_sizer.Add(self.button_sizer, 0, wx.ALIGN_CENTER)
+
+        self.SetSizer(self.main_sizer)
+
+        self.save_button.Bind(wx.EVT_BUTTON, self.on_save)
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel)
+        self.apply_all_button.Bind(wx.EVT_BUTTON, self.on_apply_all)
+        self.grid.Bind(wx.grid.EVT_GRID_CELL_LEFT_CLICK, self.on_cell_click)
+
+    def on_cell_click(self, event: wx.grid.GridEvent) -> None:
+        """Tick and untick Deploy with a single click."""
+        if event.GetCol() != DEPLOY:
+            event.Skip()
+            return
+        row = event.GetRow()
+        self.edits.set(row, DEPLOY, not self.edits.deploy[row])
+        self.grid.RefreshBlock(row, 0, row, len(DEVICE_COLUMNS) - 1)
+
+    def on_save(self, event: wx.Event) -> None:
+        if self.grid.IsCellEditControlEnabled():
+            self.grid.SaveEditControlValue()
+        problems = [f"{self.devices[row].alias}: {self.edits.problem(row)}" for row in range(len(self.edits))
+                    if self.edits.deploy[row] and self.edits.problem(row)]
+        if problems:
+            more = f"\n... and {len(problems) - 10} more" if len(problems) > 10 else ""
+            wx.MessageBox("Fix these devices or untick them before saving:\n" + "\n".join(problems[:10]) + more,
+                          "Devices", wx.OK | wx.ICON_WARNING, self)
+            return
+        configured = self.edits.save()
+        self.parent.mark_configured(self.device_type, configured, len(self.devices))
+        self.Close()
+
+    def on_cancel(self, event: wx.Event) -> None:
+        self.Close()
+
+    def on_apply_all(self, event: wx.Event) -> None:
+        probe_type = self.probe_type.GetStringSelection()
+        file_type = self.file_type.GetStringSelection()
+        username: str = self.username_text_all.GetValue()
+        password: str = self.password_text_all.GetValue()
+        self.wxconfig.Write("/deviceUser", username)
+        self.wxconfig.Write("/devicePass", password)
+        if self.grid.IsCellEditControlEnabled():
+            self.grid.DisableCellEditControl()
+        self.edits.apply_all(probe_type, file_type, username, password)
+        self.grid.ForceRefresh()
+
+    def on_probe_type_changed(self, event):
+        # Find which probe ComboBox triggered the event
+        for probe_cb, file_cb in self.cmb_bx_tuples:
+            if event.GetEventObject() == probe_cb:
+                selected_probe = probe_cb.GetValue() #centos
+                selected_file = file_cb.GetValue()   # tar
+                valid_file_types = PROBE_TYPES.get(selected_probe)
+                file_cb.Clear()
+                file_cb.AppendItems(valid_file_types)
+                file_cb.SetStringSelection(selected_file)
+                break
+
+    def on_file_type_changed(self, event):
+        # Find which file ComboBox triggered the event
+        for probe_cb, file_cb in self.cmb_bx_tuples:
+            if event.GetEventObject() == file_cb:
+                selected_probe = probe_cb.GetValue()
+                selected_file = file_cb.GetValue()
+                valid_probes = [probe for probe, files in PROBE_TYPES.items() if selected_file in files]
+                probe_cb.Clear()
+                probe_cb.AppendItems(valid_probes)
+                probe_cb.SetStringSelection(selected_probe)
+                break
+
+
+class DeviceTable(wx.grid.GridTableBase):
+    """Grid table over DeviceEdits. Values and editors come from the edits on demand, so only
+    the visible rows are ever drawn and a row costs no native widgets."""
+    def __init__(self, edits: DeviceEdits) -> None:
+        super().__init__()
+        self.edits = edits
+        self.attrs = {}
+
+    def GetNumberRows(self) -> int:
+        return len(self.edits)
+
+    def GetNumberCols(self) -> int:
+        return len(DEVICE_COLUMNS)
+
+    def GetColLabelValue(self, col: int) -> str:
+        return DEVICE_COLUMNS[col]
+
+    def IsEmptyCell(self, row: int, col: int) -> bool:
+        return False
+
+    def GetTypeName(self, row: int, col: int) -> str:
+        return wx.grid.GRID_VALUE_BOOL if col == DEPLOY else wx.grid.GRID_VALUE_STRING
+
+    def GetValue(self, row: int, col: int) -> str:
+        value = self.edits.get(row, col)
+        if col == DEPLOY:
+            return "1" if value else ""
+        return value
+
+    def SetValue(self, row: int, col: int, value) -> None:
+        if col == DEPLOY:
+            value = value in (True, "1")
+        if self.edits.set(row, col, value):
+            self.GetView().RefreshBlock(row, 0, row, len(DEVICE_COLUMNS) - 1)  # File type and tint may follow
+
+    def GetAttr(self, row: int, col: int, kind):
+        """One shared attribute per column, and per probe type for the file type column, so its
+        choices are the file types that probe comes in. Ticked rows that cannot deploy are tinted."""
+        faulty = self.edits.deploy[row] and self.edits.problem(row) is not None
+        key = (col, self.edits.probe_types[row] if col == FILE_TYPE else None, faulty)
+        attr = self.attrs.get(key)
+        if attr is None:
+            attr = wx.grid.GridCellAttr()
+            if col == DEPLOY:  # Toggled by DevicePopup.on_cell_click, no editor
+                attr.SetRenderer(wx.grid.GridCellBoolRenderer())
+                attr.SetAlignment(wx.ALIGN_CENTER, wx.ALIGN_CENTER)
+                attr.SetReadOnly(True)
+            elif col in (ALIAS, CONTROL_IP):
+                attr.SetReadOnly(True)
+            elif col == PROBE_TYPE:
+                attr.SetEditor(wx.grid.GridCellChoiceEditor(list(PROBE_TYPES.keys())))
+            elif col == FILE_TYPE:
+                attr.SetEditor(wx.grid.GridCellChoiceEditor(PROBE_TYPES.get(key[1], [])))
+            if faulty:
+                attr.SetBackgroundColour(wx.Colour(255, 228, 225))
+            self.attrs[key] = attr
+        attr.IncRef()
+        return attr
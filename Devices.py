@@ -0,0 +1,208 @@
+import array
+import bisect
+from collections import Counter
+from typing import Dict, List, Optional
+
+PROBE_TYPES = { "ubuntu": ["TAR", "DEB"], "debian": ["TAR", "DEB"], "centos": ["TAR"], "fedora": ["TAR"], "opensuse": ["TAR"], "suse": ["TAR"]}
+FILE_TYPES = {"TAR": ["centos","ubuntu","debian","fedora","opensuse","suse"], "DEB":["ubuntu","debian"]}
+
+class Device:
+    def __init__(self, alias: str, control_ip: str) -> None:
+        self.alias: str = alias
+        self.control_ip: str = control_ip
+        self.port: int = 22
+        self.username: str = ''
+        self.password: str = ''
+        self.probe_type: str = 'ubuntu'  # Set to ubuntu by default
+        self.file_type = 'tar'           # Set to tar by default
+        self.deploy = False              # Used to keep track of devices that have been configured or not
+
+    def __str__(self) -> str:
+        return f"Device(alias={self.alias}, ip={self.control_ip}, username={self.username}, password={self.password})"
+
+
+def package_name(device: Device) -> str:
+    """File name of a device's probe package, in the deployer's cache and on the device."""
+    return f"{device.probe_type}.{device.file_type.lower()}"
+
+
+DEVICE_COLUMNS = ["Deploy", "Alias", "Control IP", "Probe Type", "File Type", "Username", "Password"]
+DEPLOY, ALIAS, CONTROL_IP, PROBE_TYPE, FILE_TYPE, USERNAME, PASSWORD = range(len(DEVICE_COLUMNS))
+EDITABLE = {DEPLOY: "deploy", PROBE_TYPE: "probe_types", FILE_TYPE: "file_types", USERNAME: "usernames", PASSWORD: "passwords"}
+
+
+class DeviceEdits:
+    """Unsaved settings of a list of devices, one list per column, as the device popup's grid
+    shows and edits them. Nothing reaches the devices before save()."""
+    def __init__(self, devices: List[Device]) -> None:
+        self.devices = devices
+        self.deploy = [device.deploy for device in devices]
+        self.probe_types = [device.probe_type for device in devices]
+        self.file_types = [device.file_type.upper() for device in devices]
+        self.usernames = [device.username for device in devices]
+        self.passwords = [device.password for device in devices]
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def get(self, row: int, col: int):
+        if col == ALIAS:
+            return self.devices[row].alias
+        if col == CONTROL_IP:
+            return self.devices[row].control_ip
+        return getattr(self, EDITABLE[col])[row]
+
+    def set(self, row: int, col: int, value) -> bool:
+        """Change one cell. Probe and file types must be known and fit each other; a probe type
+        that does not take the current file type falls back to its first one. Returns whether
+        the value was taken."""
+        if col == DEPLOY:
+            self.deploy[row] = bool(value)
+        elif col == PROBE_TYPE:
+            if value not in PROBE_TYPES:
+                return False
+            self.probe_types[row] = value
+            if self.file_types[row] not in PROBE_TYPES[value]:
+                self.file_types[row] = PROBE_TYPES[value][0]
+        elif col == FILE_TYPE:
+            if value not in self.file_types_for(row):
+                return False
+            self.file_types[row] = value
+        elif col in EDITABLE:
+            getattr(self, EDITABLE[col])[row] = value
+        else:
+            return False
+        return True
+
+    def file_types_for(self, row: int) -> List[str]:
+        return PROBE_TYPES.get(self.probe_types[row], [])
+
+    def problem(self, row: int):
+        """Why the row could not be deployed as it is, or None."""
+        if self.probe_types[row] not in PROBE_TYPES:
+            return f"Unknown probe type '{self.probe_types[row]}'"
+        if self.file_types[row] not in self.file_types_for(row):
+            return f"{self.probe_types[row]} has no {self.file_types[row] or 'file type'} package"
+        if not self.usernames[row]:
+            return "No username"
+        return None
+
+    def apply_all(self, probe_type: str, file_type: str, username: str, password: str) -> None:
+        """Select every device with the same settings."""
+        count = len(self.devices)
+        self.deploy = [True] * count
+        self.probe_types = [probe_type] * count
+        self.file_types = [file_type] * count
+        self.usernames = [username] * count
+        self.passwords = [password] * count
+
+    def save(self) -> int:
+        """Write the edits to the devices. Returns how many are selected for deployment."""
+        for row, device in enumerate(self.devices):
+            device.deploy = self.deploy[row]
+            device.probe_type = self.probe_types[row]
+            device.file_type = self.file_types[row]
+            device.username = self.usernames[row]
+            device.password = self.passwords[row]
+        return sum(self.deploy)
+
+
+class DeviceIndex:
+    """The device list's rows, one per device type, with a name -> row index and a search over
+    every device's alias, control IP and type.
+
+    The search keeps, for each three-character substring, the devices whose text contains it.
+    A query of three or more characters only checks the devices listed under its rarest
+    substring, so the box stays quick on fleets of tens of thousands. Shorter queries scan."""
+    def __init__(self, device_types: Dict[str, List[Device]]) -> None:
+        self.device_types = device_types
+        self.names = list(device_types)
+        self.row_of = {name: row for row, name in enumerate(self.names)}
+        self.configured = [sum(device.deploy for device in device_types[name]) for name in self.names]
+        self.starts = []  # Row -> index of the row's first device in texts
+        self.types = array.array('I')  # Device -> its row
+        self.texts = []  # Device -> lower-cased alias, control IP and type
+        self.trigrams: Dict[str, array.array] = {}
+        for row, name in enumerate(self.names):
+            self.starts.append(len(self.texts))
+            for device in device_types[name]:
+                self.add(row, (device.alias, device.control_ip, name))
+        self.query = ""
+        self.matches: Optional[Counter] = None  # Row -> matching devices, while searching
+        self.matched = []  # Matching devices in texts order
+        self.visible = list(range(len(self.names)))
+
+    def add(self, row: int, fields) -> None:
+        number = len(self.texts)
+        fields = [(field or "").lower() for field in fields]
+        self.texts.append("\n".join(fields))
+        self.types.append(row)
+        grams = {field[i:i + 3] for field in fields for i in range(len(field) - 2)}
+        for gram in grams:
+            posting = self.trigrams.get(gram)
+            if posting is None:
+                posting = self.trigrams[gram] = array.array('I')
+            posting.append(number)
+
+    def __len__(self) -> int:
+        return len(self.visible)
+
+    def name(self, position: int) -> str:
+        return self.names[self.visible[position]]
+
+    def value(self, position: int, col: int) -> str:
+        row = self.visible[position]
+        total = len(self.device_types[self.names[row]])
+        if col == 0:
+            return self.names[row]
+        if col == 1:
+            return str(total) if self.matches is None else f"{self.matches[row]} of {total} match"
+        return f"{self.configured[row]} out of {total}"
+
+    def candidates(self, query: str):
+        if len(query) < 3:
+            return range(len(self.texts))
+        postings = []
+        for i in range(len(query) - 2):
+            posting = self.trigrams.get(query[i:i + 3])
+            if posting is None:
+                return ()
+            postings.append(posting)
+        return min(postings, key=len)
+
+    def search(self, query: str) -> None:
+        """Show only the device types with a device matching query, or all when it is empty."""
+        self.query = query = query.strip().lower()
+        if not query:
+            self.matches = None
+            self.matched = []
+            self.visible = list(range(len(self.names)))
+            return
+        texts = self.texts
+        self.matched = [number for number in self.candidates(query) if query in texts[number]]
+        self.matches = Counter(map(self.types.__getitem__, self.matched))
+        self.visible = sorted(self.matches)
+
+    def first_match(self, name: str) -> Optional[int]:
+        """Position among its type's devices of the first one matching the search, if any."""
+        row = self.row_of[name]
+        if not self.matches or row not in self.matches:
+            return None
+        return self.matched[bisect.bisect_left(self.matched, self.starts[row])] - self.starts[row]
+
+    def position(self, name: str) -> Optional[int]:
+        """Where the device type is listed, or None when it is filtered out or unknown."""
+        row = self.row_of.get(name)
+        if row is None:
+            return None
+        if self.matches is None:
+            return row
+        return bisect.bisect_left(self.visible, row) if row in self.matches else None
+
+    def mark_configured(self, name: str, configured: int) -> Optional[int]:
+        """Record how many of a type's devices are set to deploy. Returns the position to redraw."""
+        row = self.row_of.get(name)
+        if row is None:
+            return None
+        self.configured[row] = configured
+        return self.position(name)
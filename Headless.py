@@ -0,0 +1,250 @@
+"""Deploy probes without the GUI, from an inventory file.
+
+    python Headless.py inventory.csv --insite 10.0.0.5 --insite-user admin [--ssh-batch 200]
+
+The inventory is CSV, JSON or YAML. Every device has an alias, an ip (or control_ip), a
+probe_type and a file_type, plus either a username and password or a credential naming
+them. A credential is looked up in the --credentials file (JSON or YAML, name -> username
+and password) and then in the environment as <NAME>_USERNAME and <NAME>_PASSWORD. JSON
+and YAML inventories are a list of devices or a mapping with a "devices" list.
+
+Progress goes to stdout, one line per interval. The exit status is 0 when every device
+got its probe or already had it, 1 when some failed, 2 when the inventory or arguments are
+unusable and 130 when interrupted. wx is never imported.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+from Devices import FILE_TYPES, PROBE_TYPES, Device
+from Jobs import COMPLETED, ERROR
+from PackageCache import DEFAULT_MAX_MB
+import utils
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+class InventoryError(Exception):
+    """The inventory cannot be deployed as it is."""
+
+
+def read_structured(path: str):
+    """Load a JSON or YAML file. YAML needs PyYAML, which the GUI does not."""
+    with open(path, encoding="utf-8") as file:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise InventoryError("YAML files need PyYAML installed (pip install pyyaml)")
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def read_rows(path: str) -> List[dict]:
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as file:
+            return [{key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+                    for row in csv.DictReader(file)]
+    data = read_structured(path)
+    if isinstance(data, dict):
+        data = data.get("devices")
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise InventoryError(f"{path}: expected a list of devices or a mapping with a 'devices' list")
+    return [{str(key).lower(): value for key, value in row.items()} for row in data]
+
+
+def credential(name: str, credentials: Dict[str, dict]):
+    """Username and password a credential reference stands for."""
+    if name in credentials:
+        entry = credentials[name]
+        return str(entry.get("username", "")), str(entry.get("password", ""))
+    prefix = name.upper().replace("-", "_")
+    username = os.environ.get(f"{prefix}_USERNAME")
+    password = os.environ.get(f"{prefix}_PASSWORD")
+    if username is None or password is None:
+        raise InventoryError(f"Credential '{name}' is neither in the credentials file nor in "
+                             f"{prefix}_USERNAME/{prefix}_PASSWORD")
+    return username, password
+
+
+def load_inventory(path: str, credentials: Dict[str, dict]) -> List[Device]:
+    """Devices of an inventory file, configured to deploy. Every problem is reported at once."""
+    devices = []
+    problems = []
+    for number, row in enumerate(read_rows(path), 1):
+        alias = str(row.get("alias") or "")
+        ip = str(row.get("ip") or row.get("control_ip") or "")
+        probe_type = str(row.get("probe_type") or "").lower()
+        file_type = str(row.get("file_type") or "").upper()
+        where = f"Device {number} ({alias or ip or 'no alias'})"
+        if not utils.is_valid_ip(ip):
+            problems.append(f"{where}: invalid IP '{ip}'")
+            continue
+        if probe_type not in PROBE_TYPES:
+            problems.append(f"{where}: unknown probe type '{probe_type}', expected one of {', '.join(PROBE_TYPES)}")
+            continue
+        if file_type not in FILE_TYPES or file_type not in PROBE_TYPES[probe_type]:
+            problems.append(f"{where}: {probe_type} has no {file_type or 'file type'} package")
+            continue
+        try:
+            if row.get("credential"):
+                username, password = credential(str(row["credential"]), credentials)
+            else:
+                username, password = str(row.get("username") or ""), str(row.get("password") or "")
+        except InventoryError as e:
+            problems.append(f"{where}: {e}")
+            continue
+        if not username:
+            problems.append(f"{where}: no username or credential")
+            continue
+        port = str(row.get("port") or 22)
+        if not utils.is_valid_port(port):
+            problems.append(f"{where}: invalid port '{port}'")
+            continue
+        device = Device(alias or ip, ip)
+        device.port = int(port)
+        device.probe_type, device.file_type = probe_type, file_type
+        device.username, device.password = username, password
+        device.deploy = True
+        devices.append(device)
+    if problems:
+        raise InventoryError("\n".join(problems))
+    if not devices:
+        raise InventoryError(f"{path}: no devices")
+    return devices
+
+
+def stage_counts(snapshot, jobs):
+    """Finished, failed and skipped jobs of one stage in a snapshot."""
+    flags = snapshot.flags
+    done = failed = skipped = 0
+    for job in jobs:
+        state = flags[job.index]
+        if state & ERROR:
+            failed += 1
+        elif state & COMPLETED:
+            done += 1
+            skipped += job.index in snapshot.skipped
+    return done, failed, skipped
+
+
+def progress_line(deployment, elapsed: float) -> str:
+    snapshot = deployment.snapshot()
+    parts = []
+    for name, jobs in (("download", deployment.download_jobs), ("transfer", deployment.sftp_jobs),
+                       ("install", deployment.ssh_jobs)):
+        done, failed, skipped = stage_counts(snapshot, jobs)
+        part = f"{name} {done + failed}/{len(jobs)}"
+        if failed or skipped:
+            part += f" ({failed} failed, {skipped} skipped)"
+        parts.append(part)
+    return f"[{elapsed:7.1f}s] " + "  ".join(parts)
+
+
+def report(deployment, elapsed: float) -> int:
+    """Print the failed devices and a summary. Returns the exit status."""
+    snapshot = deployment.snapshot()
+    failed = [job for job in deployment.ssh_jobs if snapshot.flags[job.index] & ERROR
+              or not snapshot.flags[job.index] & COMPLETED]
+    for job in failed:
+        logs = job.get_logs()
+        reason = logs[-1] if logs else "did not finish"
+        print(f"FAILED {job.device.alias} ({job.device.control_ip}): {reason}")
+    installed, _, skipped = stage_counts(snapshot, deployment.ssh_jobs)
+    print(f"{installed - skipped} installed, {skipped} already installed, {len(failed)} failed "
+          f"of {len(deployment.ssh_jobs)} devices in {elapsed:.1f} s")
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def make_deployment(args, devices, client):
+    if args.engine == "asyncio":
+        import AsyncEngine
+        return AsyncEngine.AsyncDeployProbes(devices, args.insite, args.download_batch, args.sftp_batch,
+                                             args.ssh_batch, args.max_handshakes, args.cache_mb,
+                                             args.force_reinstall, args.script_install)
+    import Threads
+    return Threads.DeployProbesThread(devices, args.insite, args.download_batch, args.sftp_batch, args.ssh_batch,
+                                      args.max_handshakes, args.adaptive_ssh, args.cache_mb, args.segments, client,
+                                      args.force_reinstall, args.site_relay,
+                                      sftp_buffer_size=args.sftp_buffer_kb * 1024, sftp_channels=args.sftp_channels,
+                                      script_install=args.script_install)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deploy Magnum Analytics probes from an inventory file, without the GUI.")
+    parser.add_argument("inventory", help="CSV, JSON or YAML file of devices")
+    parser.add_argument("--insite", required=True, help="Magnum Analytics (Insite) IP")
+    parser.add_argument("--insite-user", default=os.environ.get("INSITE_USERNAME", ""),
+                        help="Insite login, default $INSITE_USERNAME; the password comes from $INSITE_PASSWORD")
+    parser.add_argument("--credentials", help="JSON or YAML file of credential name -> username, password")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--download-batch", type=int, default=2)
+    parser.add_argument("--sftp-batch", type=int, default=3)
+    parser.add_argument("--ssh-batch", type=int, default=20)
+    parser.add_argument("--max-handshakes", type=int, default=10, help="SSH handshakes in flight at once")
+    parser.add_argument("--adaptive-ssh", action="store_true", help="adapt the install batch to failures")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_MAX_MB, help="package cache size")
+    parser.add_argument("--segments", type=int, default=1, help="parallel range requests per download")
+    parser.add_argument("--sftp-buffer-kb", type=int, default=1024)
+    parser.add_argument("--sftp-channels", type=int, default=1)
+    parser.add_argument("--force-reinstall", action="store_true")
+    parser.add_argument("--site-relay", action="store_true", help="relay packages between devices of a site")
+    parser.add_argument("--script-install", action="store_true", help="install with one root script per device")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--check", action="store_true", help="only validate the inventory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    started = time.perf_counter()
+    args = parse_args(argv)
+    try:
+        credentials = read_structured(args.credentials) if args.credentials else {}
+        devices = load_inventory(args.inventory, credentials)
+    except (InventoryError, OSError, ValueError) as e:
+        print(f"Inventory not usable:\n{e}", file=sys.stderr)
+        return EXIT_USAGE
+    if not utils.is_valid_ip(args.insite):
+        print(f"Insite IP is not valid: {args.insite}", file=sys.stderr)
+        return EXIT_USAGE
+    print(f"{len(devices)} devices read from {args.inventory} in {time.perf_counter() - started:.2f} s")
+    if args.check:
+        return EXIT_OK
+
+    client = None
+    if args.insite_user:
+        import requests
+        from InsiteClient import InsiteClient, InsiteError
+        client = InsiteClient(args.insite)
+        try:
+            client.login(args.insite_user, os.environ.get("INSITE_PASSWORD", ""))
+        except (InsiteError, requests.RequestException, ValueError) as e:
+            print(f"Insite login failed: {e}", file=sys.stderr)
+            return EXIT_FAILED
+
+    deployment = make_deployment(args, devices, client)
+    deployment.start()
+    try:
+        while deployment.is_alive():
+            deployment.join(args.interval)
+            print(progress_line(deployment, time.perf_counter() - started), flush=True)
+    except KeyboardInterrupt:
+        print("Interrupted, stopping the deployment...", file=sys.stderr)
+        deployment.stop(block=True)
+        report(deployment, time.perf_counter() - started)
+        return EXIT_INTERRUPTED
+    finally:
+        if client is not None:
+            client.close()
+    return report(deployment, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import codecs
+import json
+import re
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+API_PORT = 50443
+TIMEOUT = (5, 30)  # Connect, read (between bytes of a streamed download)
+STREAM_CHUNK = 65536
+
+
+class InsiteError(Exception):
+	"""Insite answered, but not with what was asked for."""
+
+
+class InsiteClient:
+	"""Keep-alive session against one Insite server, shared by the device fetch and the
+	package downloads so they reuse TCP/TLS connections and the login cookies.
+
+	pool_size is how many idle connections are kept per host; it should cover every
+	download that can run at once. The session is shared between worker threads. The API
+	is on api_port, or on host's own port when api_port is None."""
+	def __init__(self, host, pool_size=10, timeout=TIMEOUT, api_port=API_PORT):
+		self.host = host
+		self.api_port = api_port
+		self.timeout = timeout
+		self.pool_size = 0
+		self.session = requests.Session()
+		self.resize(pool_size)
+
+	def resize(self, pool_size):
+		"""Grow the connection pool. It is never shrunk, which would drop idle connections."""
+		if pool_size <= self.pool_size:
+			return
+		self.pool_size = pool_size
+		old = self.session.adapters.get("https://")
+		self.session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=pool_size))
+		if old is not None:
+			old.close()  # Idle connections close now, those in use when they are released
+
+	def api_url(self, path):
+		port = f":{self.api_port}" if self.api_port else ""
+		return f"https://{self.host}{port}/api/-/{path}"
+
+	def login(self, username, password):
+		response = self.session.post(self.api_url("login"), json={"username": username, "password": password},
+									 verify=False, timeout=self.timeout)
+		if response.json().get("status") != "ok":
+			raise InsiteError("Incorrect Username/Password")
+
+	def device_identity_stream(self, validators=None):
+		"""Streaming GET of the device identity settings: every device Insite knows about.
+
+		validators are the ETag and Last-Modified of an earlier answer, from
+		response_validators(). When nothing changed since, Insite answers 304 Not Modified
+		without a body. Use as a context manager so the connection goes back to the pool."""
+		headers = {}
+		etag, modified = validators or (None, None)
+		if etag:
+			headers["If-None-Match"] = etag
+		if modified:
+			headers["If-Modified-Since"] = modified
+		response = self.session.get(self.api_url("settings/device-identity"), headers=headers, stream=True,
+									verify=False, timeout=self.timeout)
+		if response.status_code != 304 and not response.ok:
+			response.close()
+			response.raise_for_status()
+		return response
+
+	def probe_path(self, payload):
+		"""Have Insite build the probe package for payload. Returns its download path."""
+		response = self.session.post(f"https://{self.host}/api/-/model/probes?static-asset=true", json=payload,
+									 verify=False, timeout=self.timeout)
+		if response.status_code != 200:
+			raise InsiteError(f"Failed to get download path. Status code: {response.status_code}")
+		path = response.json().get("path")
+		if not path:
+			raise InsiteError("Insite did not return a download path")
+		return path
+
+	def download_url(self, path):
+		return f"https://{self.host}/probe/download/{path}"
+
+	def download(self, path, headers=None):
+		"""Streaming GET of a probe package. Use as a context manager so the connection
+		goes back to the pool."""
+		return self.session.get(self.download_url(path), headers=headers, stream=True, verify=False,
+								timeout=self.timeout)
+
+	def close(self):
+		self.session.close()
+
+
+def response_validators(response):
+	"""ETag and Last-Modified of a response, to make the next request for it conditional."""
+	return response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+class JsonArrayStream:
+	"""The items of one array in a JSON document, parsed as the document's bytes arrive.
+
+	The array is the value of the first "key" member in the document. Each item is decoded
+	once it is complete, so the first ones are ready long before the last bytes are in and
+	the whole document is never held at once. parse_seconds is the time spent decoding,
+	as opposed to waiting for data."""
+	def __init__(self, chunks, key):
+		self.chunks = chunks
+		self.key = key
+		self.start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+		self.decoder = json.JSONDecoder()
+		self.parse_seconds = 0.0
+
+	def __iter__(self):
+		utf8 = codecs.getincrementaldecoder("utf-8")()
+		buffer = ""
+		position = None  # Where the next item starts, once inside the array
+		done = False
+		for chunk in self.chunks:
+			started = time.perf_counter()
+			buffer += utf8.decode(chunk)
+			if position is None:
+				match = self.start.search(buffer)
+				if match is None:
+					buffer = buffer[-256:]  # Keep enough to find the key across chunks
+					self.parse_seconds += time.perf_counter() - started
+					continue
+				position = match.end()
+			items = []
+			while True:
+				while position < len(buffer) and buffer[position] in " \t\r\n,":
+					position += 1
+				if position == len(buffer):
+					break
+				if buffer[position] == "]":
+					done = True
+					break
+				try:
+					item, position = self.decoder.raw_decode(buffer, position)
+				except json.JSONDecodeError:
+					break  # Incomplete, wait for more
+				items.append(item)
+			buffer = buffer[position:]
+			position = 0
+			self.parse_seconds += time.perf_counter() - started
+			yield from items
+			if done:
+				return
+		if position is None:
+			raise ValueError(f'No "{self.key}" array in the response')
+		raise ValueError("The response ended inside the array")
@@ -0,0 +1,196 @@
+import array
+import collections
+import threading
+
+ERROR = 1
+COMPLETED = 2
+IN_PROGRESS = 4
+FLAGS = {"error": ERROR, "completed": COMPLETED, "in_progress": IN_PROGRESS}
+NUMBERS = ("size", "done", "progress", "speed")  # MB, MB, percent, MB/s
+LOG_LINES = 200  # Log lines a job keeps in memory, the run log has them all
+
+JobState = collections.namedtuple("JobState", ["device", *FLAGS, *NUMBERS, "skipped"])
+
+
+class JobStore:
+	"""State of every job in a deployment, kept in columns rather than one object per job.
+
+	Flags share one byte per job and the numbers are packed in arrays of doubles, so a large
+	fleet costs a few dozen bytes per job plus its log. Every write takes the store's lock,
+	which lets snapshot() copy all jobs at once and never see half of a Job.update().
+
+	A view that redraws only what changed registers a set with watch(); every job written
+	afterwards is added to it, and snapshot(changed) hands the set's contents over.
+
+	Each job keeps its last LOG_LINES log lines. With a run_log set, every line is also
+	handed to it, so the full log is on disk while memory stays flat."""
+	def __init__(self, log_lines=LOG_LINES):
+		self.lock = threading.Lock()
+		self.log_lines = log_lines
+		self.run_log = None  # RunLog that gets every log line
+		self.devices = []
+		self.stages = []
+		self.flags = array.array('B')
+		self.numbers = {name: array.array('d') for name in NUMBERS}
+		self.skipped = {}  # index -> why the job had nothing to do, shown instead of "Completed"
+		self.logs = {}  # index -> last log lines, created with the first line
+		self.jobs = []
+		self.watchers = []  # Sets collecting the indexes of written jobs
+
+	def __len__(self):
+		return len(self.jobs)
+
+	def add(self, device, stage=None):
+		"""Add a pending job for device and return it."""
+		with self.lock:
+			job = Job(self, len(self.jobs))
+			self.devices.append(device)
+			self.stages.append(stage)
+			self.flags.append(0)
+			for column in self.numbers.values():
+				column.append(0)
+			self.jobs.append(job)
+		return job
+
+	def watch(self):
+		"""Start collecting the index of every job written from now on. Returns the set to
+		pass to snapshot(); unwatch() it when done."""
+		changed = set()
+		with self.lock:
+			self.watchers.append(changed)
+		return changed
+
+	def unwatch(self, changed):
+		with self.lock:
+			self.watchers = [watcher for watcher in self.watchers if watcher is not changed]
+
+	def set(self, index, name, value):
+		"""Write one field of a job. Lock must be held."""
+		for watcher in self.watchers:
+			watcher.add(index)
+		if name in FLAGS:
+			if value:
+				self.flags[index] |= FLAGS[name]
+			else:
+				self.flags[index] &= ~FLAGS[name]
+		elif name == "skipped":
+			if value:
+				self.skipped[index] = value
+			else:
+				self.skipped.pop(index, None)
+		else:
+			self.numbers[name][index] = value
+
+	def add_log(self, index, message):
+		"""Append to a job's in-memory log, dropping its oldest line past log_lines. Lock must be held."""
+		lines = self.logs.get(index)
+		if lines is None:
+			lines = self.logs[index] = []
+		elif len(lines) >= self.log_lines:
+			del lines[0]
+		lines.append(message)
+
+	def snapshot(self, changed=None):
+		"""Consistent copy of every job's state, taken in one go. With a set from watch(), the
+		snapshot's changed holds the jobs written since the previous such call."""
+		with self.lock:
+			snapshot = JobSnapshot(self.devices[:], self.flags[:],
+								   {name: column[:] for name, column in self.numbers.items()}, dict(self.skipped))
+			if changed is not None:
+				snapshot.changed = set(changed)
+				changed.clear()
+		return snapshot
+
+
+class JobSnapshot:
+	"""Job states as they were when JobStore.snapshot() was called, indexed like the store.
+	Columns can be read directly, snapshot.progress[job.index], or a whole JobState taken."""
+	__slots__ = ("devices", "flags", "size", "done", "progress", "speed", "skipped", "changed")
+
+	def __init__(self, devices, flags, numbers, skipped):
+		self.devices = devices
+		self.flags = flags
+		self.size = numbers["size"]
+		self.done = numbers["done"]
+		self.progress = numbers["progress"]
+		self.speed = numbers["speed"]
+		self.skipped = skipped
+		self.changed = None  # Indexes written since the previous snapshot, when asked for
+
+	def __len__(self):
+		return len(self.devices)
+
+	def __getitem__(self, index):
+		flags = self.flags[index]
+		return JobState(self.devices[index], bool(flags & ERROR), bool(flags & COMPLETED), bool(flags & IN_PROGRESS),
+						self.size[index], self.done[index], self.progress[index], self.speed[index],
+						self.skipped.get(index))
+
+
+def flag_field(name):
+	bit = FLAGS[name]
+
+	def get_flag(job):
+		return bool(job.store.flags[job.index] & bit)
+
+	def set_flag(job, value):
+		with job.store.lock:
+			job.store.set(job.index, name, value)
+	return property(get_flag, set_flag)
+
+
+def number_field(name):
+	def get_number(job):
+		return job.store.numbers[name][job.index]
+
+	def set_number(job, value):
+		with job.store.lock:
+			job.store.set(job.index, name, value)
+	return property(get_number, set_number)
+
+
+class Job:
+	"""One row of a JobStore. Fields read and write the store's columns, so a Job is only a
+	reference and an index. Use update() when several fields change together."""
+	__slots__ = ("store", "index")
+
+	def __init__(self, store, index):
+		self.store = store
+		self.index = index
+
+	error = flag_field("error")
+	completed = flag_field("completed")
+	in_progress = flag_field("in_progress")
+	size = number_field("size")
+	done = number_field("done")  # Store the downloaded/transferred portion
+	progress = number_field("progress")  # Percentage of completed job
+	speed = number_field("speed")
+
+	@property
+	def device(self):
+		return self.store.devices[self.index]
+
+	@property
+	def skipped(self):
+		return self.store.skipped.get(self.index)
+
+	@skipped.setter
+	def skipped(self, value):
+		with self.store.lock:
+			self.store.set(self.index, "skipped", value)
+
+	def update(self, **fields):
+		"""Set several fields at once; a snapshot sees either none or all of them."""
+		with self.store.lock:
+			for name, value in fields.items():
+				self.store.set(self.index, name, value)
+
+	def get_logs(self):
+		with self.store.lock:
+			return self.store.logs.get(self.index, [])[:]
+
+	def add_log(self, message):
+		with self.store.lock:
+			self.store.add_log(self.index, message)
+		if self.store.run_log is not None:
+			self.store.run_log.write(self.index, message)
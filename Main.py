@@ -1,7 +1,6 @@
 import os
 import sys
 import wx
-import wx.adv
 from Panel import Panel
 
 
@@ -33,6 +32,7 @@ class MainFrame(wx.Frame):
         self.SetStatusText("Welcome :)",0)
 
     def on_about(self, event):
+        import wx.adv
         info = wx.adv.AboutDialogInfo()
         info.SetName('Magnum Analytics Probe Deployer')
         info.SetDescription(
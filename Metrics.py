@@ -0,0 +1,91 @@
+import array
+import contextlib
+import json
+import threading
+import time
+
+PREFIX = "probe_deployer_"
+QUANTILES = (0.5, 0.95, 0.99)
+HELP = {
+	"download_request_seconds": "Time for Insite to return a probe package path",
+	"download_seconds": "Time to download a probe package",
+	"download_mb_per_second": "Probe package download rate",
+	"ssh_connect_seconds": "TCP connect and SSH handshake with a device",
+	"ssh_auth_seconds": "SSH password authentication on a device",
+	"sftp_transfer_seconds": "Time to transfer the probe package to a device",
+	"sftp_mb_per_second": "Probe package transfer rate to a device",
+	"root_shell_seconds": "Time to gain a root shell on a device",
+	"install_command_seconds": "Time of one install command in the root shell, by command",
+	"service_start_seconds": "Time to start the probe service and confirm it runs",
+	"install_seconds": "Time of a device's whole install stage",
+}
+
+
+def quantile(ordered, q):
+	"""Nearest-rank quantile of sorted values."""
+	return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+
+class RunMetrics:
+	"""Latencies and rates of one deployment, kept as raw samples and summarised at the end.
+
+	Every sample is kept, a double each, so the quantiles are exact; a 10k device run
+	records a few hundred thousand at most. timer() only records blocks that finish without
+	an exception, so failures and timeouts do not pass for slow successes."""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.samples = {}  # (name, sorted label items) -> array of values
+
+	def observe(self, name, value, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			values = self.samples.get(key)
+			if values is None:
+				values = self.samples[key] = array.array('d')
+			values.append(value)
+
+	@contextlib.contextmanager
+	def timer(self, name, **labels):
+		start = time.perf_counter()
+		yield
+		self.observe(name, time.perf_counter() - start, **labels)
+
+	def summary(self):
+		"""Count, sum, extremes and QUANTILES of every series, in name order."""
+		with self.lock:
+			series = {key: sorted(values) for key, values in self.samples.items()}
+		result = []
+		for (name, labels), ordered in sorted(series.items()):
+			entry = {"name": name, "labels": dict(labels), "count": len(ordered), "sum": sum(ordered),
+					 "min": ordered[0], "max": ordered[-1]}
+			for q in QUANTILES:
+				entry[f"p{int(q * 100)}"] = quantile(ordered, q)
+			result.append(entry)
+		return result
+
+	def prometheus(self, summary=None):
+		"""The summary in Prometheus text exposition format, one summary metric per name."""
+		lines = []
+		described = set()
+		for entry in summary if summary is not None else self.summary():
+			name = PREFIX + entry["name"]
+			if name not in described:
+				described.add(name)
+				lines.append(f"# HELP {name} {HELP.get(entry['name'], entry['name'])}")
+				lines.append(f"# TYPE {name} summary")
+			labels = [f'{key}="{value}"' for key, value in entry["labels"].items()]
+			for q in QUANTILES:
+				quantile_labels = ",".join(labels + [f'quantile="{q}"'])
+				lines.append(f"{name}{{{quantile_labels}}} {entry[f'p{int(q * 100)}']:.6g}")
+			suffix = f"{{{','.join(labels)}}}" if labels else ""
+			lines.append(f"{name}_sum{suffix} {entry['sum']:.6g}")
+			lines.append(f"{name}_count{suffix} {entry['count']}")
+		return "\n".join(lines) + "\n"
+
+	def write(self, base_path):
+		"""Write base_path.metrics.json and base_path.prom."""
+		summary = self.summary()
+		with open(f"{base_path}.metrics.json", "w") as file:
+			json.dump(summary, file, indent=1)
+		with open(f"{base_path}.prom", "w") as file:
+			file.write(self.prometheus(summary))
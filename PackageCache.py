@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = "probe_cache"
+DEFAULT_MAX_MB = 2048
+
+
+class PackageCache:
+	"""Persistent on-disk cache of probe packages.
+
+	Entries are keyed by Insite host and the full probe request payload and remember the
+	server's validators (ETag, Last-Modified) and the package's sha256, so a re-deploy can
+	revalidate with a conditional request instead of downloading again. The cache is bounded
+	by max_bytes; least recently used entries are evicted first, except those pinned by the
+	running deployment."""
+	def __init__(self, directory=CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.index_path = os.path.join(directory, "index.json")
+		self.lock = threading.Lock()
+		self.pinned = {}  # key -> number of users in this process
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		self.entries = self.load()
+
+	@staticmethod
+	def key(host, payload):
+		blob = json.dumps({"host": host, "payload": payload}, sort_keys=True)
+		return hashlib.sha256(blob.encode()).hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.directory, f"{key}.pkg")
+
+	def temp_path(self, key):
+		return os.path.join(self.directory, f"{key}.part")
+
+	def partial(self, key):
+		"""Size of an interrupted download of key and the validator it was fetched under."""
+		temp = self.temp_path(key)
+		try:
+			with open(f"{temp}.json") as f:
+				validator = json.load(f).get("validator")
+			return os.path.getsize(temp), validator
+		except (OSError, ValueError):
+			return 0, None
+
+	def begin_partial(self, key, validator):
+		"""Record the validator a download is being written under so a retry can resume it."""
+		with open(f"{self.temp_path(key)}.json", "w") as f:
+			json.dump({"validator": validator}, f)
+
+	def discard_partial(self, key):
+		for path in (self.temp_path(key), f"{self.temp_path(key)}.json"):
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def load(self):
+		try:
+			with open(self.index_path) as f:
+				entries = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		# Drop entries whose file went missing or was truncated behind our back
+		return {key: entry for key, entry in entries.items()
+				if os.path.isfile(self.path(key)) and os.path.getsize(self.path(key)) == entry.get("size")}
+
+	def save(self):
+		"""Write the index atomically. Must be called with the lock held."""
+		temp = f"{self.index_path}.tmp"
+		with open(temp, "w") as f:
+			json.dump(self.entries, f)
+		os.replace(temp, self.index_path)
+
+	def lookup(self, key):
+		"""Return a copy of the entry for key, or None."""
+		with self.lock:
+			entry = self.entries.get(key)
+			return dict(entry) if entry else None
+
+	def validators(self, key):
+		"""Conditional request headers for a cached entry."""
+		entry = self.lookup(key)
+		headers = {}
+		if entry:
+			if entry.get("etag"):
+				headers["If-None-Match"] = entry["etag"]
+			if entry.get("last_modified"):
+				headers["If-Modified-Since"] = entry["last_modified"]
+		return headers
+
+	def hit(self, key):
+		"""The server confirmed the cached package is current. Pins it and returns its path."""
+		with self.lock:
+			self.entries[key]["last_used"] = time.time()
+			self.pinned[key] = self.pinned.get(key, 0) + 1
+			self.save()
+		return self.path(key)
+
+	def store(self, key, temp_path, etag=None, last_modified=None, sha256=None):
+		"""Move a finished download into the cache. Pins it and returns its path."""
+		path = self.path(key)
+		with self.lock:
+			os.replace(temp_path, path)
+			try:
+				os.remove(f"{temp_path}.json")
+			except OSError:
+				pass
+			self.entries[key] = {
+				"etag": etag,
+				"last_modified": last_modified,
+				"sha256": sha256,
+				"size": os.path.getsize(path),
+				"last_used": time.time(),
+			}
+			self.pinned[key] = self.pinned.get(key, 0) + 1
+			self.evict()
+			self.save()
+		return path
+
+	def release(self, key):
+		"""The deployment is done with the package; it may be evicted again."""
+		with self.lock:
+			count = self.pinned.get(key, 0) - 1
+			if count > 0:
+				self.pinned[key] = count
+			else:
+				self.pinned.pop(key, None)
+			self.evict()
+			self.save()
+
+	def evict(self):
+		"""Remove least recently used, unpinned entries until under max_bytes. Lock must be held."""
+		total = sum(entry["size"] for entry in self.entries.values())
+		for key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+			if total <= self.max_bytes:
+				break
+			if key in self.pinned:
+				continue
+			total -= self.entries.pop(key)["size"]
+			try:
+				os.remove(self.path(key))
+			except OSError:
+				pass
@@ -1,12 +1,14 @@
 import wx
 import threading
 import os
+import time
 from typing import Dict, List
 import Widgets
-import Threads
 import utils
-import requests
-from Widgets import TaskListDialog
+from PackageCache import DEFAULT_MAX_MB
+
+ENGINES = ["Threads", "Asyncio"]
+LIST_UPDATE_INTERVAL = 0.5  # Seconds between device list updates while the inventory streams in
 
 
 class Panel(wx.Panel):
@@ -15,7 +17,9 @@ class Panel(wx.Panel):
         self.parent= parent
         self.wxconfig = wx.Config("ProbeDeployer")
         self.fetched_insite_ip = ""      # Stores the IP of fetched Insite IP
+        self.insite_client = None        # Logged in InsiteClient, shared with deployments
         self.device_types: Dict[str, List[Widgets.Device]] = {}
+        self.identity_validators = None  # Insite IP, and ETag and Last-Modified of its device inventory
         self.deploy_thread = None
         self.animation_counter = 0
 
@@ -45,6 +49,46 @@ class Panel(wx.Panel):
 
         sftp_batch_label = wx.StaticText(self, label="Transfer Batch Size:")
         self.sftp_batch_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/sftpBatch', defaultVal="3"), size=(60, -1), min=1)
+        ssh_batch_label = wx.StaticText(self, label="Install Batch Size:")
+        self.ssh_batch_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/sshBatch', defaultVal="20"), size=(60, -1), min=1, max=10000)
+
+        handshake_label = wx.StaticText(self, label="Max Connection Attempts:")
+        self.handshake_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/maxHandshakes', defaultVal="10"), size=(60, -1), min=1, max=1000)
+
+        self.adaptive_ssh = wx.CheckBox(self, label="Adaptive Install Batch")
+        self.adaptive_ssh.SetValue(self.wxconfig.ReadBool('/adaptiveSsh', defaultVal=False))
+
+        cache_label = wx.StaticText(self, label="Package Cache (MB):")
+        self.cache_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/cacheMB', defaultVal=str(DEFAULT_MAX_MB)), size=(70, -1), min=0, max=1000000)
+
+        segments_label = wx.StaticText(self, label="Download Connections:")
+        self.segments_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/downloadSegments', defaultVal="1"), size=(60, -1), min=1, max=16)
+
+        sftp_buffer_label = wx.StaticText(self, label="Transfer Buffer (KB):")
+        self.sftp_buffer_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/sftpBufferKB', defaultVal="1024"), size=(70, -1), min=32, max=65536)
+        sftp_channels_label = wx.StaticText(self, label="Transfer Channels:")
+        self.sftp_channels_input = wx.SpinCtrl(self, value=self.wxconfig.Read('/sftpChannels', defaultVal="1"), size=(60, -1), min=1, max=8)
+
+        self.force_reinstall = wx.CheckBox(self, label="Force Reinstall")
+        self.force_reinstall.SetValue(self.wxconfig.ReadBool('/forceReinstall', defaultVal=False))
+
+        self.site_relay = wx.CheckBox(self, label="Site Relay")
+        self.site_relay.SetToolTip("Send each package once per /24 and let a device there copy it to its neighbours. "
+                                   "The neighbours' SSH passwords are staged briefly on that device to log in "
+                                   "to them, without host key checking.")
+        self.site_relay.SetValue(self.wxconfig.ReadBool('/siteRelay', defaultVal=False))
+
+        self.script_install = wx.CheckBox(self, label="Single-Script Install")
+        self.script_install.SetToolTip("Install with one generated script run as root instead of typing each command into a shell")
+        self.script_install.SetValue(self.wxconfig.ReadBool('/scriptInstall', defaultVal=False))
+
+        engine_label = wx.StaticText(self, label="Engine:")
+        self.engine = wx.ComboBox(self, choices=ENGINES, style=wx.CB_READONLY)
+        self.engine.SetStringSelection(self.wxconfig.Read('/engine', defaultVal=ENGINES[0]))
+
+        self.down_batch_input.Bind(wx.EVT_SPINCTRL, self.on_batch_changed)
+        self.sftp_batch_input.Bind(wx.EVT_SPINCTRL, self.on_batch_changed)
+        self.ssh_batch_input.Bind(wx.EVT_SPINCTRL, self.on_batch_changed)
 
         self.list: Widgets.DeviceListView = Widgets.DeviceListView(self)
         self.main_vbox: wx.BoxSizer = wx.BoxSizer(wx.VERTICAL)
@@ -68,8 +112,26 @@ class Panel(wx.Panel):
         self.grid2.Add(self.down_batch_input, pos=(0, 1), flag=input_flag, border=15)
         self.grid2.Add(sftp_batch_label, pos=(0, 2), flag=label_flag, border=5)
         self.grid2.Add(self.sftp_batch_input, pos=(0, 3), flag=input_flag, border=15)
-        self.grid2.Add(self.deploy, pos=(0, 4), flag=button_flag, border=15)
-        self.grid2.Add(self.tasks, pos=(0, 5), flag=button_flag, border=15)
+        self.grid2.Add(ssh_batch_label, pos=(0, 4), flag=label_flag, border=5)
+        self.grid2.Add(self.ssh_batch_input, pos=(0, 5), flag=input_flag, border=15)
+        self.grid2.Add(handshake_label, pos=(1, 0), flag=label_flag, border=5)
+        self.grid2.Add(self.handshake_input, pos=(1, 1), flag=input_flag, border=15)
+        self.grid2.Add(self.adaptive_ssh, pos=(1, 2), span=(1, 2), flag=input_flag, border=15)
+        self.grid2.Add(engine_label, pos=(1, 4), flag=label_flag, border=5)
+        self.grid2.Add(self.engine, pos=(1, 5), flag=input_flag, border=15)
+        self.grid2.Add(cache_label, pos=(2, 0), flag=label_flag, border=5)
+        self.grid2.Add(self.cache_input, pos=(2, 1), flag=input_flag, border=15)
+        self.grid2.Add(segments_label, pos=(2, 2), flag=label_flag, border=5)
+        self.grid2.Add(self.segments_input, pos=(2, 3), flag=input_flag, border=15)
+        self.grid2.Add(self.force_reinstall, pos=(2, 4), span=(1, 2), flag=input_flag, border=15)
+        self.grid2.Add(sftp_buffer_label, pos=(3, 0), flag=label_flag, border=5)
+        self.grid2.Add(self.sftp_buffer_input, pos=(3, 1), flag=input_flag, border=15)
+        self.grid2.Add(sftp_channels_label, pos=(3, 2), flag=label_flag, border=5)
+        self.grid2.Add(self.sftp_channels_input, pos=(3, 3), flag=input_flag, border=15)
+        self.grid2.Add(self.site_relay, pos=(3, 4), span=(1, 2), flag=input_flag, border=15)
+        self.grid2.Add(self.deploy, pos=(4, 2), flag=button_flag, border=15)
+        self.grid2.Add(self.tasks, pos=(4, 3), flag=button_flag, border=15)
+        self.grid2.Add(self.script_install, pos=(4, 4), span=(1, 2), flag=input_flag, border=15)
 
         vbox: wx.BoxSizer = wx.BoxSizer(wx.VERTICAL)
         vbox.Add(self.grid1, 0, wx.ALIGN_CENTER | wx.TOP, 5)
@@ -123,25 +185,79 @@ class Panel(wx.Panel):
 
         download_batch_size = self.down_batch_input.GetValue()
         sftp_batch_size = self.sftp_batch_input.GetValue()
+        ssh_batch_size = self.ssh_batch_input.GetValue()
+        max_handshakes = self.handshake_input.GetValue()
+        adaptive_ssh = self.adaptive_ssh.GetValue()
+        cache_mb = self.cache_input.GetValue()
+        download_segments = self.segments_input.GetValue()
+        force_reinstall = self.force_reinstall.GetValue()
+        site_relay = self.site_relay.GetValue()
+        script_install = self.script_install.GetValue()
+        sftp_buffer_kb = self.sftp_buffer_input.GetValue()
+        sftp_channels = self.sftp_channels_input.GetValue()
         self.wxconfig.Write("/downloadBatch", str(download_batch_size))
         self.wxconfig.Write("/sftpBatch", str(sftp_batch_size))
-        self.deploy_thread = Threads.DeployProbesThread(devices, self.fetched_insite_ip, download_batch_size, sftp_batch_size)
+        self.wxconfig.Write("/sshBatch", str(ssh_batch_size))
+        self.wxconfig.Write("/maxHandshakes", str(max_handshakes))
+        self.wxconfig.WriteBool("/adaptiveSsh", adaptive_ssh)
+        self.wxconfig.Write("/cacheMB", str(cache_mb))
+        self.wxconfig.Write("/downloadSegments", str(download_segments))
+        self.wxconfig.WriteBool("/forceReinstall", force_reinstall)
+        self.wxconfig.WriteBool("/siteRelay", site_relay)
+        self.wxconfig.WriteBool("/scriptInstall", script_install)
+        self.wxconfig.Write("/sftpBufferKB", str(sftp_buffer_kb))
+        self.wxconfig.Write("/sftpChannels", str(sftp_channels))
+        self.wxconfig.Write("/engine", self.engine.GetStringSelection())
+        if self.engine.GetStringSelection() == "Asyncio":
+            try:
+                import AsyncEngine
+            except ImportError as e:
+                self.error_alert(f"The asyncio engine needs asyncssh and aiohttp installed ({e}).")
+                return
+            self.deploy_thread = AsyncEngine.AsyncDeployProbes(devices, self.fetched_insite_ip, download_batch_size,
+                                                               sftp_batch_size, ssh_batch_size, max_handshakes, cache_mb,
+                                                               force_reinstall, script_install)
+        else:
+            import Threads
+            self.deploy_thread = Threads.DeployProbesThread(devices, self.fetched_insite_ip, download_batch_size,
+                                                            sftp_batch_size, ssh_batch_size, max_handshakes, adaptive_ssh,
+                                                            cache_mb, download_segments, self.insite_client,
+                                                            force_reinstall, site_relay,
+                                                            sftp_buffer_size=sftp_buffer_kb * 1024,
+                                                            sftp_channels=sftp_channels,
+                                                            script_install=script_install)
         self.deploy_thread.start()
         self.list.Disable()
         self.timer.Start(300)
 
+    def on_batch_changed(self, event: wx.Event) -> None:
+        """Batch sizes can be changed while a deployment is running."""
+        if self.deploy_thread is not None:
+            self.deploy_thread.set_batch_sizes(self.down_batch_input.GetValue(), self.sftp_batch_input.GetValue(),
+                                               self.ssh_batch_input.GetValue())
+
     def on_task(self, event):
         if not self.deploy_thread or not self.deploy_thread.is_alive():
             self.error_alert("No tasks available. Please try deploying first.")
             return
 
-        TaskListDialog(self, self.deploy_thread).ShowModal()
+        from TaskList import TaskListDialog
+        dialog = TaskListDialog(self, self.deploy_thread)
+        dialog.ShowModal()
+        dialog.Destroy()  # Its list stops refreshing and unwatches the job store
 
     def on_fetch(self, event: wx.Event) -> None:
         """Starts a background thread to fetch data."""
+        if self.deploy_thread is not None:  # It uses the logged in client a new fetch would replace
+            self.error_alert("Wait for the deployment to finish before fetching again.")
+            return
         threading.Thread(target=self._fetch_data).start()
 
     def _fetch_data(self) -> None:
+        # Loaded on first fetch, off the UI thread, to keep them out of startup
+        import requests
+        from InsiteClient import STREAM_CHUNK, InsiteClient, InsiteError, JsonArrayStream, response_validators
+
         ip: str = self.insite_ip.GetValue()
         user: str = self.user_input.GetValue()
         password: str = self.pass_input.GetValue()
@@ -154,44 +270,67 @@ class Panel(wx.Panel):
         self.wxconfig.Write("/insitePass", password)
         self.fetched_insite_ip = ip
 
-        login_url: str = f"https://{ip}:50443/api/-/login"
-        login_payload: dict = {
-            'username': user,
-            'password': password
-        }
-
+        client = InsiteClient(ip)
         try:
-            login_response: requests.Response = requests.post(login_url, json=login_payload, verify=False, timeout=5)
-            response_json: dict = login_response.json()
-
-            if response_json.get("status") != "ok":
-                wx.CallAfter(self.error_alert, "Incorrect Username/Password")
-                return
+            client.login(user, password)
+        except InsiteError as e:
+            wx.CallAfter(self.error_alert, str(e))
+            return
+        except (requests.RequestException, ValueError) as e:
+            wx.CallAfter(self.error_alert, f"Failed to connect: {str(e)}")
+            return
+        if self.insite_client is not None:  # No deployment is using it, see on_fetch
+            self.insite_client.close()
+        self.insite_client = client  # Deployments reuse the logged in session and its connections
 
-            # Proceed to fetch device identity settings
-            url: str = f"https://{ip}:50443/api/-/settings/device-identity"
-            response: requests.Response = requests.get(url, verify=False)
-            data: dict = response.json()
-
-            self.device_types = {}
-            for device in data['devices']:
-                identification: dict = device['identification']
-                alias: str = identification.get('alias')
-                control_ips: List[str] = identification.get('control-ips', [])
-                if len(control_ips) == 0:
-                    continue
-                control_ip = control_ips[0]
-                device_type: str = identification.get('device-type')
-                if utils.is_valid_ip(control_ip):
-                    if device_type not in self.device_types:
-                        self.device_types[device_type] = [Widgets.Device(alias, control_ip)]
-                    else:
-                        self.device_types[device_type].append(Widgets.Device(alias, control_ip))
-            self.device_types = {k: self.device_types[k] for k in sorted(self.device_types, key=str.lower)}
+        validators = None
+        if self.device_types and self.identity_validators and self.identity_validators[0] == ip:
+            validators = self.identity_validators[1]
+        try:
+            # Proceed to fetch device identity settings, listing devices as they arrive
+            started = time.perf_counter()
+            with client.device_identity_stream(validators) as response:
+                if response.status_code == 304:
+                    wx.CallAfter(self.set_status_text, f"Device inventory unchanged, checked in "
+                                                       f"{(time.perf_counter() - started) * 1000:.0f} ms.")
+                    return
+                devices = JsonArrayStream(response.iter_content(STREAM_CHUNK), "devices")
+                device_types: Dict[str, List[Widgets.Device]] = {}
+                count = 0
+                first = None
+                shown = time.perf_counter()
+                for device in devices:
+                    if first is None:
+                        first = time.perf_counter() - started
+                    identification: dict = device['identification']
+                    alias: str = identification.get('alias')
+                    control_ips: List[str] = identification.get('control-ips', [])
+                    if len(control_ips) == 0:
+                        continue
+                    control_ip = control_ips[0]
+                    device_type: str = identification.get('device-type')
+                    if utils.is_valid_ip(control_ip):
+                        if device_type not in device_types:
+                            device_types[device_type] = [Widgets.Device(alias, control_ip)]
+                        else:
+                            device_types[device_type].append(Widgets.Device(alias, control_ip))
+                        count += 1
+                    if time.perf_counter() - shown >= LIST_UPDATE_INTERVAL:
+                        partial = {k: list(device_types[k]) for k in sorted(device_types, key=str.lower)}
+                        wx.CallAfter(self.list.add_devices, partial)
+                        wx.CallAfter(self.set_status_text, f"Fetching devices... {count} so far")
+                        shown = time.perf_counter()
+                self.identity_validators = (ip, response_validators(response))
+            elapsed = time.perf_counter() - started
+            self.device_types = {k: device_types[k] for k in sorted(device_types, key=str.lower)}
             wx.CallAfter(self.list.add_devices, self.device_types)
+            wx.CallAfter(self.set_status_text, f"Fetched {count} devices in {elapsed:.2f} s: first after "
+                                               f"{(first or elapsed) * 1000:.0f} ms, {devices.parse_seconds * 1000:.0f} ms parsing.")
         except requests.RequestException as e:
             # Handle any connection errors
             wx.CallAfter(self.error_alert, f"Failed to connect: {str(e)}")
+        except (KeyError, ValueError) as e:
+            wx.CallAfter(self.error_alert, f"Unexpected device list from Insite: {str(e)}")
 
         # self.device_types = {"Test Device Type 1": [Widgets.Device("Ubuntu Test Server 1 ", "172.17.235.12"),
         #                                             Widgets.Device("Ubuntu Test Server 2 ", "172.17.235.3"),],
@@ -227,7 +366,7 @@ class Panel(wx.Panel):
 
     def stop_deployment(self, event):
         if self.deploy_thread:
-            self.deploy_thread.end_event.set()
+            self.deploy_thread.stop()
 # End class Panel(wx.Panel)
 
 
@@ -0,0 +1,172 @@
+import collections
+import contextlib
+import threading
+import time
+import traceback
+
+
+class WorkerPool:
+	"""Bounded pool of reusable worker threads.
+
+	At most `size` tasks run at once (None means no limit). A finishing task hands its
+	slot straight to the next queued one and completion is signalled through a condition,
+	so nothing polls. The size can be changed while tasks are running."""
+	def __init__(self, size, name="worker"):
+		self.size = size
+		self.name = name
+		self.tasks = collections.deque()
+		self.threads = set()
+		self.cond = threading.Condition()
+		self.idle = 0
+		self.pending = 0  # Queued plus running tasks
+		self.closed = False
+
+	def submit(self, task):
+		"""Queue a callable. Raises RuntimeError once the pool is closed, except from the pool's
+		own tasks, which may still queue follow-up work."""
+		with self.cond:
+			if self.closed and threading.current_thread() not in self.threads:
+				raise RuntimeError("Pool is closed")
+			self.tasks.append(task)
+			self.pending += 1
+			if len(self.tasks) > self.idle and self.has_room():
+				self.spawn()
+			else:
+				self.cond.notify_all()
+
+	def resize(self, size):
+		"""Change the number of concurrent tasks. Shrinking lets running tasks finish."""
+		with self.cond:
+			self.size = size
+			spawned = 0
+			while len(self.tasks) > self.idle + spawned and self.has_room():
+				self.spawn()
+				spawned += 1
+			self.cond.notify_all()
+
+	def close(self):
+		"""No more tasks will be submitted. Idle threads exit once the queue is empty."""
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+
+	def cancel(self):
+		"""Drop every queued task that has not started yet and return them."""
+		with self.cond:
+			dropped = list(self.tasks)
+			self.tasks.clear()
+			self.pending -= len(dropped)
+			self.cond.notify_all()
+			return dropped
+
+	def wait(self, timeout=None):
+		"""Block until the pool is closed and every task has finished. Returns False on timeout."""
+		with self.cond:
+			return self.cond.wait_for(lambda: self.closed and self.pending == 0, timeout)
+
+	@property
+	def finished(self):
+		with self.cond:
+			return self.closed and self.pending == 0
+
+	def has_room(self):
+		return self.size is None or len(self.threads) < self.size
+
+	def spawn(self):
+		"""Start one more worker thread. Must be called with the condition held."""
+		thread = threading.Thread(target=self.worker_loop, name=f"{self.name}-{len(self.threads)}", daemon=True)
+		self.threads.add(thread)
+		thread.start()
+
+	def worker_loop(self):
+		current = threading.current_thread()
+		while True:
+			with self.cond:
+				while True:
+					if self.size is not None and len(self.threads) > self.size:
+						self.threads.discard(current)  # Pool was shrunk
+						return
+					if self.tasks:
+						task = self.tasks.popleft()
+						break
+					if self.closed:
+						self.threads.discard(current)
+						return
+					self.idle += 1
+					self.cond.wait()
+					self.idle -= 1
+			try:
+				task()
+			except Exception:
+				print(f"{current.name}: task failed:\n{traceback.format_exc()}", end="")
+			finally:
+				with self.cond:
+					self.pending -= 1
+					self.cond.notify_all()
+
+
+class AdaptiveLimit:
+	"""Additive-increase/multiplicative-decrease control of a WorkerPool's size.
+
+	Every `window` connection attempts the pool is halved if too many failed or the median
+	latency rose well above the best median seen so far, and grown by one otherwise."""
+	def __init__(self, pool, maximum, minimum=1, window=20, max_failure_rate=0.2, latency_factor=3.0):
+		self.pool = pool
+		self.maximum = maximum
+		self.minimum = minimum
+		self.window = window
+		self.max_failure_rate = max_failure_rate
+		self.latency_factor = latency_factor
+		self.baseline = None
+		self.samples = []
+		self.lock = threading.Lock()
+
+	def record(self, ok, latency):
+		with self.lock:
+			self.samples.append((ok, latency))
+			if len(self.samples) < self.window:
+				return
+			failures = sum(1 for ok, _ in self.samples if not ok)
+			latencies = sorted(latency for ok, latency in self.samples if ok)
+			self.samples = []
+
+			size = self.pool.size or self.maximum
+			median = latencies[len(latencies) // 2] if latencies else None
+			slow = median is not None and self.baseline is not None and median > self.baseline * self.latency_factor
+			if failures / self.window > self.max_failure_rate or slow:
+				size = max(self.minimum, size // 2)
+			else:
+				size = min(self.maximum, size + 1)
+			if median is not None and (self.baseline is None or median < self.baseline):
+				self.baseline = median
+			self.pool.resize(size)
+
+
+class HandshakeGate:
+	"""Caps the connection attempts (TCP connect, key exchange and authentication) in
+	progress at once, independently of how many sessions are open. sshd's MaxStartups
+	limits exactly this. Outcomes are fed to an optional AdaptiveLimit; exceptions listed in
+	`benign` (bad credentials, say) count as successful handshakes."""
+	def __init__(self, limit=None, limiter=None, benign=()):
+		self.semaphore = threading.BoundedSemaphore(limit) if limit else None
+		self.limiter = limiter
+		self.benign = benign
+
+	@contextlib.contextmanager
+	def attempt(self):
+		if self.semaphore:
+			self.semaphore.acquire()
+		start = time.monotonic()
+		ok = True
+		try:
+			yield
+		except self.benign:
+			raise
+		except Exception:
+			ok = False
+			raise
+		finally:
+			if self.semaphore:
+				self.semaphore.release()
+			if self.limiter:
+				self.limiter.record(ok, time.monotonic() - start)
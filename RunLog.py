@@ -0,0 +1,83 @@
+import json
+from json.encoder import encode_basestring_ascii
+import os
+import threading
+import time
+import uuid
+
+LOG_DIR = "logs"
+FLUSH_INTERVAL = 0.5  # Seconds a log line may wait before it is written to disk
+
+
+def run_log_path(directory=LOG_DIR):
+	"""A file name no other run shares, even one started in the same second."""
+	return os.path.join(directory, f"run--{time.strftime('%Y-%m-%d__%H-%M-%S')}--{uuid.uuid4().hex[:8]}.jsonl")
+
+
+class RunLog:
+	"""Every job log line of a deployment, appended to a JSON Lines file as the run goes.
+
+	write() only queues the line, so workers never wait on the disk. A writer thread turns
+	queued lines into records (time, job, stage, device) and writes them in batches, flushing
+	at least every FLUSH_INTERVAL, so a run that crashes or is killed keeps its log up to
+	that point."""
+	def __init__(self, store, path=None):
+		self.store = store
+		self.path = path or run_log_path()
+		os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+		self.file = open(self.path, "a", encoding="utf-8")
+		self.pending = []
+		self.prefixes = {}  # Job index -> its record's fixed fields, encoded once
+		self.second = (None, None)  # Last whole second seen and its text, for the timestamps
+		self.condition = threading.Condition()
+		self.closed = False
+		self.writer = threading.Thread(target=self.write_batches, name="RunLog", daemon=True)
+		self.writer.start()
+
+	def write(self, index, message):
+		with self.condition:
+			if not self.closed:
+				self.pending.append((time.time(), index, message))
+
+	def record(self, when, index, message):
+		prefix = self.prefixes.get(index)
+		if prefix is None:
+			device = self.store.devices[index]
+			prefix = self.prefixes[index] = json.dumps({"job": index, "stage": self.store.stages[index],
+														"device": device.alias, "ip": device.control_ip})[1:-1]
+		second = int(when)
+		if second != self.second[0]:
+			self.second = (second, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second)))
+		return (f'{{"time": "{self.second[1]}.{int((when - second) * 1000):03d}", {prefix}, '
+				f'"message": {encode_basestring_ascii(message)}}}\n')
+
+	def write_batches(self):
+		while True:
+			with self.condition:
+				if not self.closed:
+					self.condition.wait(FLUSH_INTERVAL)
+				batch, self.pending = self.pending, []
+				closed = self.closed
+			if batch:
+				self.file.write("".join([self.record(*line) for line in batch]))
+				self.file.flush()
+			if closed:
+				break
+		self.file.close()
+
+	def close(self):
+		"""Write what is queued and close the file. Lines written afterwards are dropped."""
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		self.writer.join()
+
+
+def read_run_log(path):
+	"""Records of a run log, skipping a last line cut short by a crash."""
+	with open(path, encoding="utf-8") as file:
+		for line in file:
+			try:
+				yield json.loads(line)
+			except json.JSONDecodeError:
+				continue
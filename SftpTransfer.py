@@ -0,0 +1,152 @@
+import collections
+import os
+import threading
+import time
+
+import paramiko
+from paramiko.common import DEFAULT_MAX_PACKET_SIZE
+from paramiko.sftp import CMD_STATUS, CMD_WRITE, SFTPError, int64
+
+WINDOW_SIZE = 64 * 1024 * 1024  # Our receive window; acks and reads never stall on it
+BUFFER_SIZE = 1024 * 1024  # Bytes read from the local file at a time
+REQUEST_SIZE = 32 * 1024  # Largest write request every SFTP server accepts
+MAX_REQUESTS = 256  # Write requests in flight
+PROGRESS_INTERVAL = 0.25  # Seconds between progress callbacks
+
+
+def open_sftp(transport, window_size=WINDOW_SIZE, max_packet_size=DEFAULT_MAX_PACKET_SIZE):
+	"""SFTP session on an authenticated transport, with a large channel window."""
+	return paramiko.SFTPClient.from_transport(transport, window_size, max_packet_size)
+
+
+class PipelinedWrites:
+	"""Write requests on an open remote file, keeping up to max_requests in flight.
+
+	paramiko's pipelined SFTPFile waits for every outstanding ack once a hundred are queued,
+	which stalls the link for a round trip each time; here only the oldest ack is waited
+	for when the window is full. Acks paramiko reads while waiting for another come back
+	through _async_response."""
+	def __init__(self, sftp, handle, max_requests=MAX_REQUESTS):
+		self.sftp = sftp
+		self.handle = handle
+		self.max_requests = max_requests
+		self.outstanding = collections.deque()
+		self.acked = set()
+		self.error = None
+
+	def write(self, offset, data):
+		num = self.sftp._async_request(self, CMD_WRITE, self.handle, int64(offset), data)
+		self.outstanding.append(num)
+		while len(self.outstanding) > self.max_requests:
+			self.wait_oldest()
+
+	def wait_oldest(self):
+		num = self.outstanding.popleft()
+		if num in self.acked:
+			self.acked.discard(num)
+		else:
+			self.sftp._read_response(num)  # Raises on an error status
+		if self.error:
+			raise self.error
+
+	def flush(self):
+		while self.outstanding:
+			self.wait_oldest()
+
+	def _async_response(self, t, msg, num):
+		self.acked.add(num)
+		if t != CMD_STATUS:
+			self.error = SFTPError("Expected status")
+			return
+		try:
+			self.sftp._convert_status(msg)
+		except (IOError, EOFError) as e:
+			self.error = e
+
+
+def upload(sftp, local_path, remote_path, buffer_size=BUFFER_SIZE, callback=None, interval=PROGRESS_INTERVAL,
+		   channels=1):
+	"""Upload a file with pipelined writes and confirm the remote size.
+
+	With channels > 1 the file is split into that many ranges, each written through its own
+	SFTP session on the same connection. Every session gets its own flow-control window from
+	the server, which is what bounds a single session on high-latency links.
+
+	callback(transferred, total) is called at most every `interval` seconds and once at
+	the end; it may raise to abort the transfer."""
+	total = os.path.getsize(local_path)
+	transport = sftp.get_channel().get_transport()
+	sessions = [sftp]
+	targets = []
+	done = [0] * channels
+	bounds = [(i * total // channels // REQUEST_SIZE * REQUEST_SIZE,
+			   (i + 1) * total // channels // REQUEST_SIZE * REQUEST_SIZE if i + 1 < channels else total)
+			  for i in range(channels)]
+	stop = threading.Event()
+	errors = []
+	last_report = [time.monotonic()]
+
+	def report():
+		if callback and time.monotonic() - last_report[0] >= interval:
+			callback(sum(done), total)
+			last_report[0] = time.monotonic()
+
+	def send(index, progress=None):
+		first, end = bounds[index]
+		writes = PipelinedWrites(sessions[index], targets[index].handle)
+		view = memoryview(bytearray(buffer_size))
+		with open(local_path, "rb") as source:
+			source.seek(first)
+			offset = first
+			while offset < end and not stop.is_set():
+				n = source.readinto(view[:min(buffer_size, end - offset)])
+				if not n:
+					raise IOError(f"{local_path} is shorter than {total} bytes")
+				for start in range(0, n, REQUEST_SIZE):
+					writes.write(offset + start, bytes(view[start:min(n, start + REQUEST_SIZE)]))
+				offset += n
+				done[index] = offset - first
+				if progress:
+					progress()
+		writes.flush()
+
+	def run(index):
+		try:
+			send(index)
+		except Exception as e:
+			errors.append(e)
+			stop.set()
+
+	try:
+		targets.append(sftp.open(remote_path, "wb"))
+		for _ in range(channels - 1):
+			sessions.append(open_sftp(transport))
+			targets.append(sessions[-1].open(remote_path, "r+b"))
+		if channels == 1:
+			send(0, report)
+		else:
+			threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(channels)]
+			for thread in threads:
+				thread.start()
+			try:
+				for thread in threads:
+					while thread.is_alive():
+						thread.join(interval)
+						report()
+			finally:
+				stop.set()
+				for thread in threads:
+					thread.join()
+			if errors:
+				raise errors[0]
+	finally:
+		for target in targets:
+			target.close()
+		for session in sessions[1:]:
+			session.close()
+	if callback:
+		callback(sum(done), total)
+
+	size = sftp.stat(remote_path).st_size
+	if size != total:
+		raise IOError(f"size mismatch in upload! {size} != {total}")
@@ -0,0 +1,107 @@
+import select
+import time
+import uuid
+
+import paramiko
+
+RECV_SIZE = 32768
+PROMPT_TIMEOUT = 5  # Seconds to wait for the shell to answer with its prompt
+COMMAND_TIMEOUT = 300  # Seconds an install command may run before the shell is given up on
+
+
+def prompt_sentinel():
+	"""A unique shell prompt and the command that sets it.
+
+	The prompt is quoted in two halves in the command, so the terminal echoing the command
+	back never matches it; only the shell printing its prompt does."""
+	token = uuid.uuid4().hex
+	command = f"unset PROMPT_COMMAND; PS1='__probe_{token[:16]}''{token[16:]}__# '"
+	return command, f"__probe_{token}__# ".encode()
+
+
+def read_until(channel, expected, timeout=None):
+	"""Read from a paramiko channel until the expected bytes show up, it closes or the
+	timeout expires. Waits in select() on the channel, so it returns as soon as they arrive."""
+	deadline = None if timeout is None else time.monotonic() + timeout
+	reply = bytearray()
+	while True:
+		if channel.recv_ready():
+			data = channel.recv(RECV_SIZE)
+			if not data:
+				break
+			searched = max(0, len(reply) - len(expected) + 1) if expected else 0
+			reply.extend(data)
+			if expected and reply.find(expected, searched) >= 0:
+				break
+			continue
+		if channel.closed or channel.eof_received:
+			break
+		remaining = None if deadline is None else deadline - time.monotonic()
+		if remaining is not None and remaining <= 0:
+			break
+		select.select([channel], [], [], remaining)
+	return reply.decode('utf-8', 'replace')
+
+
+class Shell:
+	"""Interactive shell on a paramiko channel with an exact prompt.
+
+	Once start() has set a unique prompt, run() returns the moment the command's output
+	is complete, instead of when some '#' goes by or a timeout runs out."""
+	def __init__(self, channel):
+		self.channel = channel
+		self.prompt = None
+
+	def read_until(self, expected, timeout=None):
+		return read_until(self.channel, expected, timeout)
+
+	def send(self, text):
+		self.channel.send(text + '\n')
+
+	def start(self, timeout=PROMPT_TIMEOUT):
+		"""Replace the current prompt with a unique one."""
+		command, prompt = prompt_sentinel()
+		self.send(command)
+		if prompt.decode() not in self.read_until(prompt, timeout):
+			raise paramiko.SSHException("The shell did not accept a new prompt")
+		self.prompt = prompt
+
+	def run(self, command, timeout=COMMAND_TIMEOUT):
+		"""Run a command and wait for the prompt after it. Returns its output and how many
+		seconds it took."""
+		start = time.monotonic()
+		self.send(command)
+		output = self.read_until(self.prompt, timeout)
+		prompt = self.prompt.decode()
+		if prompt not in output:
+			if self.channel.closed or self.channel.eof_received:
+				raise paramiko.SSHException(f"Shell closed while running: {command}")
+			raise paramiko.SSHException(f"No prompt {timeout} s after: {command}")
+		return output.split(prompt, 1)[0], time.monotonic() - start
+
+
+def run_as_root(transport, command, password, password_prompt, timeout=COMMAND_TIMEOUT):
+	"""Run a command that asks for the root password, on a terminal in its own channel.
+
+	The password is only sent once password_prompt shows up, so it is never echoed into a
+	command that did not ask for it. Returns the exit status and everything the command
+	printed after the prompt."""
+	channel = transport.open_session(timeout=PROMPT_TIMEOUT)
+	try:
+		channel.get_pty(term='vt100', width=300, height=24)
+		channel.exec_command(command)
+		prompt = password_prompt.decode()
+		output = read_until(channel, password_prompt, PROMPT_TIMEOUT)
+		expected = None
+		if prompt in output:
+			channel.send(password + '\n')
+			output = output.split(prompt, 1)[1]
+			expected = password_prompt  # Asked again means the password was refused
+		output += read_until(channel, expected, timeout)
+		if expected and prompt in output:
+			raise paramiko.AuthenticationException("Root password was not accepted")
+		if not (channel.closed or channel.eof_received):
+			raise paramiko.SSHException(f"Still running after {timeout} s: {command}")
+		return channel.recv_exit_status(), output
+	finally:
+		channel.close()
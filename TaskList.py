@@ -0,0 +1,132 @@
+import Threads
+import wx
+import wx.dataview as dv
+from TaskRows import COLUMNS, FILTERS, PROGRESS_COLUMN, TaskRows
+
+
+class TaskListDialog(wx.Dialog):
+    def __init__(self, parent, thread: Threads.DeployProbesThread, title="Task List"):
+        super().__init__(parent, title=title, size=(900, 600), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+
+        self.thread = thread
+        self.task_list_view = TaskListView(self, self.thread)
+
+        filter_label = wx.StaticText(self, label="Show:")
+        self.status_filter = wx.Choice(self, choices=FILTERS)
+        self.status_filter.SetSelection(0)
+        self.status_filter.Bind(wx.EVT_CHOICE, self.on_filter)
+
+        filter_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        filter_sizer.Add(filter_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        filter_sizer.Add(self.status_filter, 0, wx.ALIGN_CENTER_VERTICAL)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(filter_sizer, 0, wx.LEFT | wx.RIGHT | wx.TOP, 10)
+        sizer.Add(self.task_list_view, 1, wx.EXPAND | wx.ALL, 10)
+
+        self.SetSizer(sizer)
+
+    def on_filter(self, event):
+        self.task_list_view.set_filter(self.status_filter.GetStringSelection())
+
+
+class TaskListModel(dv.DataViewVirtualListModel):
+    """Virtual model over TaskRows: the control asks for the cells it draws, nothing is stored per row."""
+    def __init__(self, rows: TaskRows):
+        super().__init__(len(rows))
+        self.rows = rows
+
+    def GetColumnCount(self):
+        return len(COLUMNS)
+
+    def GetColumnType(self, col):
+        return "long" if col == PROGRESS_COLUMN else "string"
+
+    def GetValueByRow(self, row, col):
+        return self.rows.value(row, col)
+
+    def SetValueByRow(self, value, row, col):
+        return False
+
+
+class TaskListView(dv.DataViewCtrl):
+    REDRAW_ALL = 200  # Changed rows past which one repaint is cheaper than notifying each
+
+    def __init__(self, parent, deploy_thread):
+        super().__init__(parent, style=dv.DV_ROW_LINES | dv.DV_VERT_RULES)
+
+        self.deploy_thread = deploy_thread
+        self.rows = TaskRows(deploy_thread)
+        self.model = TaskListModel(self.rows)
+        self.AssociateModel(self.model)
+
+        # Add columns
+        widths = [300, 100, 120, 80, 120, 120]
+        for col, (title, width) in enumerate(zip(COLUMNS, widths)):
+            if col == PROGRESS_COLUMN:
+                self.AppendProgressColumn(title, col, width=width)
+            else:
+                self.AppendTextColumn(title, col, width=width)
+        self.Bind(dv.EVT_DATAVIEW_ITEM_ACTIVATED, self.on_task_click)
+        self.Bind(dv.EVT_DATAVIEW_COLUMN_HEADER_CLICK, self.on_header_click)
+        self.timer: wx.Timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.refresh_tasks, self.timer)
+        self.timer.Start(1000)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy)
+
+    def on_destroy(self, event):
+        """Stop refreshing however the dialog was dismissed: close box, Esc or Cancel."""
+        if event.GetEventObject() is self:
+            self.timer.Stop()
+            self.rows.close()
+        event.Skip()
+
+    def refresh_tasks(self, event):
+        """Redraw the rows whose jobs changed since the last tick."""
+        positions = self.rows.refresh()
+        if positions is None:
+            self.model.Reset(len(self.rows))
+        elif len(positions) > self.REDRAW_ALL:
+            self.Refresh()
+        else:
+            for position in positions:
+                self.model.RowChanged(position)
+
+    def set_filter(self, name):
+        self.rows.set_filter(name)
+        self.model.Reset(len(self.rows))
+
+    def on_header_click(self, event: dv.DataViewEvent):
+        col = event.GetColumn()
+        self.rows.sort(col)
+        for index, title in enumerate(COLUMNS):
+            arrow = (" \u25b2" if self.rows.ascending else " \u25bc") if index == col else ""
+            self.GetColumn(index).SetTitle(title + arrow)
+        self.model.Reset(len(self.rows))
+
+    def on_task_click(self, event: dv.DataViewEvent):
+        """Handle task item click event."""
+        item = event.GetItem()
+        if item.IsOk():
+            dlg = LogListDialog(self, self.rows.job(self.model.GetRow(item)).get_logs())
+            dlg.ShowModal()
+            dlg.Destroy()
+
+
+class LogListDialog(wx.Dialog):
+    def __init__(self, parent: wx.Window, logs: list) -> None:
+        super().__init__(parent, title="", size=(500, 300), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+
+        self.main_sizer: wx.BoxSizer = wx.BoxSizer(wx.VERTICAL)
+
+        self.device_list_ctrl: wx.ListCtrl = wx.ListCtrl(self, style=wx.LC_REPORT | wx.BORDER_SUNKEN)
+        self.device_list_ctrl.InsertColumn(0, 'Logs:', width=500)
+
+        self.main_sizer.Add(self.device_list_ctrl, 1, wx.EXPAND | wx.ALL, 5)
+        self.SetSizer(self.main_sizer)
+
+        self.populate_list(logs)
+
+    def populate_list(self, logs: list) -> None:
+        for index, log in enumerate(logs):
+            self.device_list_ctrl.InsertItem(index, log)
\ No newline at end of file
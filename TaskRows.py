@@ -0,0 +1,152 @@
+from Devices import package_name
+
+COLUMNS = ["Task Name", "Size", "Progress", "%", "Status", "Avg Speed"]
+PROGRESS_COLUMN = 2
+FILTERS = ["All", "Pending", "In progress", "Completed", "Skipped", "Error"]
+STAGES = {  # Stage -> what its status calls work in progress and whether it has size and speed
+    "download": ("Downloading", True),
+    "sftp": ("Transferring", True),
+    "ssh": ("In progress", False),
+}
+
+
+def job_status(job, active):
+    """Status column text for a job or a snapshot of one; active is what the stage calls work
+    in progress."""
+    if job.error:
+        return "Error"
+    if job.completed:
+        return job.skipped or "Completed"
+    return active if job.in_progress else "Pending"
+
+
+def status_filter(job):
+    """Which of FILTERS a job or a snapshot of one falls under, besides All."""
+    if job.error:
+        return "Error"
+    if job.completed:
+        return "Skipped" if job.skipped else "Completed"
+    return "In progress" if job.in_progress else "Pending"
+
+
+class TaskRows:
+    """The task list's rows, without any wx: which job each row shows, in what order, and
+    the text of its cells, read from one job store snapshot per refresh.
+
+    Rows are every download, then every transfer, then every install. The visible rows are
+    those passing the status filter, in the chosen sort order; positions are indexes into
+    them. refresh() reports only the positions whose jobs were written since the last one."""
+    def __init__(self, deployment):
+        self.deployment = deployment
+        self.jobs = []
+        self.stages = []
+        for stage, jobs in (("download", deployment.download_jobs), ("sftp", deployment.sftp_jobs),
+                            ("ssh", deployment.ssh_jobs)):
+            self.jobs.extend(jobs)
+            self.stages.extend([stage] * len(jobs))
+        self.row_of = {job.index: row for row, job in enumerate(self.jobs)}
+        self.changed = deployment.job_store.watch()
+        self.snapshot = deployment.job_store.snapshot(self.changed)
+        self.filters = [status_filter(self.state(row)) for row in range(len(self.jobs))]
+        self.filter = "All"
+        self.sort_column = None
+        self.ascending = True
+        self.visible = list(range(len(self.jobs)))
+        self.position_of = None  # row -> position, None while they are the same
+
+    def close(self):
+        self.deployment.job_store.unwatch(self.changed)
+
+    def __len__(self):
+        return len(self.visible)
+
+    def state(self, row):
+        return self.snapshot[self.jobs[row].index]
+
+    def job(self, position):
+        return self.jobs[self.visible[position]]
+
+    def name(self, row):
+        device = self.jobs[row].device
+        stage = self.stages[row]
+        if stage == "download":
+            return f"Download {device.file_type} file for {device.probe_type}"
+        if stage == "sftp":
+            return f"Transfer {package_name(device)} to {device.alias}"
+        return f"Executing SSH commands on {device.alias}"
+
+    def value(self, position, column):
+        """Cell text, or the bar's integer percentage for the progress column."""
+        row = self.visible[position]
+        index = self.jobs[row].index
+        active, measured = STAGES[self.stages[row]]
+        snapshot = self.snapshot
+        if column == 0:
+            return self.name(row)
+        if column == 1:
+            size = snapshot.size[index]
+            return ("?" if size == 0 else f"{round(size, 2)} MB") if measured else "N/A"
+        if column == PROGRESS_COLUMN:
+            return int(snapshot.progress[index])
+        if column == 3:
+            return f"{round(snapshot.progress[index], 1)} %"
+        if column == 4:
+            return job_status(snapshot[index], active)
+        return f"{round(snapshot.speed[index], 1)} MB/s" if measured else "N/A"
+
+    def refresh(self):
+        """Take a new snapshot. Returns the positions to redraw, or None when the visible rows
+        themselves changed because a job moved in or out of the filter."""
+        self.snapshot = self.deployment.job_store.snapshot(self.changed)
+        rows = [self.row_of[index] for index in self.snapshot.changed if index in self.row_of]
+        moved = False
+        for row in rows:
+            category = status_filter(self.state(row))
+            if category != self.filters[row]:
+                moved = moved or self.filter in (category, self.filters[row])
+                self.filters[row] = category
+        if moved:
+            self.arrange()
+            return None
+        if self.position_of is None:
+            return rows
+        return [self.position_of[row] for row in rows if row in self.position_of]
+
+    def set_filter(self, name):
+        self.filter = name
+        self.arrange()
+
+    def sort(self, column):
+        """Sort by column, or flip the order when already sorted by it. Rows stay where they
+        are between refreshes until the next sort or filter change."""
+        if self.sort_column == column:
+            self.ascending = not self.ascending
+        else:
+            self.sort_column, self.ascending = column, True
+        self.arrange()
+
+    def sort_key(self, row):
+        index = self.jobs[row].index
+        column = self.sort_column
+        if column == 0:
+            return self.name(row)
+        if column == 1:
+            return self.snapshot.size[index]
+        if column in (PROGRESS_COLUMN, 3):
+            return self.snapshot.progress[index]
+        if column == 4:
+            return job_status(self.snapshot[index], STAGES[self.stages[row]][0])
+        return self.snapshot.speed[index]
+
+    def arrange(self):
+        """Recompute the visible rows from the filter and sort order."""
+        rows = range(len(self.jobs))
+        if self.filter != "All":
+            rows = [row for row in rows if self.filters[row] == self.filter]
+        if self.sort_column is not None:
+            rows = sorted(rows, key=self.sort_key, reverse=not self.ascending)
+        self.visible = list(rows)
+        if self.filter == "All" and self.sort_column is None:
+            self.position_of = None
+        else:
+            self.position_of = {row: position for position, row in enumerate(self.visible)}
@@ -1,50 +1,225 @@
-import random
+import base64
+import collections
+import re
 import threading
 import os
-import requests
-import json
+import hashlib
 import paramiko
+import shlex
 import time
-import urllib3
+import uuid
+from Devices import package_name
+from InsiteClient import InsiteClient
+from Jobs import Job, JobStore
+from PackageCache import DEFAULT_MAX_MB, PackageCache
+from Metrics import RunMetrics
+from RunLog import RunLog, read_run_log
+from Pool import AdaptiveLimit, HandshakeGate, WorkerPool
+from Connections import ConnectionPool, run_command
+from SftpTransfer import BUFFER_SIZE, open_sftp, upload
+from Shell import PROMPT_TIMEOUT, Shell, run_as_root
 
-FILE_DIR = "probe_files"
 LOG_DIR = "logs"
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-class DeployProbesThread(threading.Thread):
-	def __init__(self, devices, insite_ip, download_batch, sftp_batch):
+PROBE_MARKER = "/opt/evertz/insite/probe/.deployed-sha256"  # sha256 of the package the deployer installed
+DOWNLOAD_BUFFER_SIZE = 4 * 1024 * 1024
+RELAY_MIN_DEVICES = 3  # Smaller sites get direct transfers
+RELAY_FANOUT = 4  # Copies a seed serves at once
+SUDO_PROMPT = "[probe-deployer] password: "
+SCRIPT_TIMEOUT = 900  # Seconds a whole single-script install may take
+# Install progress at each milestone, in percent; the install commands share the span in between
+PROGRESS_CONNECTED, PROGRESS_ROOT, PROGRESS_INSTALLED, PROGRESS_SERVICE = 10, 20, 80, 90
+
+
+def command_label(command):
+	"""Metrics label of an install command: the program it runs, or the last one of a
+	pipeline, without paths or arguments."""
+	words = command.split("|")[-1].split()
+	return os.path.basename(words[0]) if words else "empty"
+
+
+def probe_payload(device):
+	"""Body of the Insite request that builds the probe package for a device."""
+	return {
+		"type": device.probe_type,
+		"os": {"family": "linux", "architecture": "amd64"},
+		"bits": 64,
+		"archive-type": device.file_type,
+		"port": 22222,
+		"beats": {"filebeat": True, "metricbeat": True},
+	}
+
+
+def root_shell(device):
+	"""Command that opens a root shell on the device and the password prompt it shows."""
+	if device.probe_type == "debian":
+		return 'su', b'Password:'
+	return 'sudo -s', b'[sudo] password for'
+
+
+def root_exec(device, command):
+	"""Command that runs command as root without a login shell, and the password prompt it shows."""
+	if device.probe_type == "debian":
+		return f"su -c {shlex.quote(command)}", b'Password:'
+	return f"sudo -p {shlex.quote(SUDO_PROMPT)} sh -c {shlex.quote(command)}", SUDO_PROMPT.encode()
+
+
+def systemctl(device):
+	return "/bin/systemctl" if device.probe_type in ["centos", "fedora"] else "systemctl"
+
+
+def install_commands(device):
+	"""Root shell commands that install the transferred package."""
+	file = package_name(device)
+	if device.file_type == "TAR":
+		return [
+			'rm -rf /opt/evertz/insite/probe',
+			'rm /lib/systemd/system/insite-probe.service',
+			'rm /usr/lib/systemd/system/insite-probe.service',
+			'rm -rf /bin/insite-probe',
+			'mkdir -p /opt/evertz/insite/probe',
+			f'mv /home/{device.username}/{file} /opt/evertz/insite/probe/{file}',
+			'cd /opt/evertz/insite/probe',
+			f'tar -xvf {file}',
+			'cd /opt/evertz/insite/probe/insite-probe/setup',
+			'chmod +x ./install',
+			"printf '1\\ny\\n' | ./install"  # Answers its two questions, so the prompt comes back
+		]
+	return [f'rm -f {PROBE_MARKER}', f'dpkg -i {file}']
+
+
+def install_steps(device, digest=None):
+	"""Commands of the single-script install: what install_commands() types into the root
+	shell, followed by the service start and marker."""
+	file = package_name(device)
+	if device.file_type == "TAR":
+		steps = [
+			'rm -rf /opt/evertz/insite/probe /lib/systemd/system/insite-probe.service '
+			'/usr/lib/systemd/system/insite-probe.service /bin/insite-probe',
+			'mkdir -p /opt/evertz/insite/probe',
+			f'mv /home/{device.username}/{file} /opt/evertz/insite/probe/{file}',
+			'cd /opt/evertz/insite/probe',
+			f'tar -xf {file}',
+			'cd /opt/evertz/insite/probe/insite-probe/setup',
+			'chmod +x ./install',
+			"printf '1\\ny\\n' | ./install",
+		]
+	else:
+		steps = [f'rm -f {PROBE_MARKER}', f'dpkg -i {file}']
+	steps += [f'{systemctl(device)} start insite-probe', f'{systemctl(device)} is-active --quiet insite-probe']
+	if digest:
+		steps.append(marker_command(digest))
+	return steps
+
+
+def install_script(steps, token):
+	"""Bash script running steps in order and stopping at the first that fails. After each
+	step it prints '<token> <exit status> <milliseconds> <step>', see script_steps()."""
+	lines = [
+		'step() {',
+		'	local start=$(date +%s%N)',
+		'	eval "$1"',
+		'	local status=$?',
+		f'	echo "{token} $status $(( ($(date +%s%N) - start) / 1000000 )) $1"',
+		'	return $status',
+		'}',
+	]
+	lines += [f'step {shlex.quote(step)} || exit' for step in steps]
+	script = base64.b64encode("\n".join(lines).encode()).decode()
+	return f'bash -c "$(echo {script} | base64 -d)"'
+
+
+def script_steps(output, token):
+	"""(exit status, milliseconds, step) of every step install_script() reported in output."""
+	return [(int(status), int(ms), step.strip()) for status, ms, step
+			in re.findall(rf"{token} (\d+) (\d+) (.*)", output)]
+
+
+def site_of(device):
+	"""Devices in the same /24 are taken to share a site LAN."""
+	return device.control_ip.rsplit(".", 1)[0]
+
+
+def relay_hop(device, askpass):
+	"""Command run on a seed that opens an SSH session to device, authenticating with the
+	password that the askpass script on the seed prints."""
+	return (f"SSH_ASKPASS={shlex.quote(askpass)} SSH_ASKPASS_REQUIRE=force DISPLAY=:0 "
+			f"ssh -p {device.port} -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null "
+			f"-o NumberOfPasswordPrompts=1 -o ConnectTimeout=10 {shlex.quote(device.username)}@{device.control_ip}")
+
+
+def on_seed(command, askpass):
+	"""command run on a seed through sh, which removes the askpass script when it ends, also
+	when the session is cut because the deployer died."""
+	script = f"trap {shlex.quote(f'rm -f {shlex.quote(askpass)}')} EXIT; trap 'exit 129' HUP INT TERM; {command}"
+	return f"sh -c {shlex.quote(script)}"
+
+
+def fingerprint_command(device):
+	"""Prints the sha256 of the package the deployer last installed, then the probe service state."""
+	return f"cat {PROBE_MARKER} 2>/dev/null; echo; {systemctl(device)} is-active insite-probe"
+
+
+def is_installed(output, digest):
+	"""Whether fingerprint_command output shows the package with this digest installed and running."""
+	return bool(digest) and output.split() == [digest, "active"]
+
+
+def marker_command(digest):
+	"""Root shell command recording which package is installed, once the probe is running."""
+	return f"mkdir -p {os.path.dirname(PROBE_MARKER)} && echo {digest} > {PROBE_MARKER}"
+
+
+class Deployment(threading.Thread):
+	"""Job graph and run log shared by the deployment engines.
+
+	Subclasses run the jobs; the GUI only relies on the job lists, snapshot(), end_event,
+	stop() and set_batch_sizes()."""
+	def __init__(self, devices, insite_ip, cache_mb=DEFAULT_MAX_MB, force_reinstall=False, script_install=False):
 		super().__init__()
 		self.devices = devices
 		self.insite_ip = insite_ip
-
-		seen_pairs = {}
+		self.force_reinstall = force_reinstall  # Reinstall even where the same probe is already running
+		self.script_install = script_install  # One root script over exec instead of typing into a shell
+		self.cache = PackageCache(max_bytes=cache_mb * 1024 * 1024)
+		self.packages = {}      # (probe_type, file_type) -> local path of the downloaded package
+		self.package_keys = {}  # (probe_type, file_type) -> cache key pinned by this run
+
+		# Dependency graph: a download feeds the transfers of every device that needs its
+		# (probe_type, file_type) package and each transfer feeds the install on its own device.
+		self.job_store = JobStore()  # State of all three stages' jobs
+		self.run_log = RunLog(self.job_store)  # Every log line, on disk as the run goes
+		self.job_store.run_log = self.run_log
+		self.metrics = RunMetrics()  # Stage timings, exported next to the run log
 		self.download_jobs = []
 		self.sftp_jobs = []
 		self.ssh_jobs = []
+		self.pair_sftp_jobs = {}  # (probe_type, file_type) -> sftp jobs waiting on that download
+		self.sftp_to_ssh = {}     # id(sftp job) -> ssh job waiting on that transfer
 		for device in devices:
-			self.sftp_jobs.append(Job(device))
-			self.ssh_jobs.append(Job(device))
+			sftp_job = self.job_store.add(device, "sftp")
+			ssh_job = self.job_store.add(device, "ssh")
+			self.sftp_jobs.append(sftp_job)
+			self.ssh_jobs.append(ssh_job)
+			self.sftp_to_ssh[id(sftp_job)] = ssh_job
 
 			pair = (device.probe_type, device.file_type)
-			if pair not in seen_pairs:
-				seen_pairs[pair] = ""
-				self.download_jobs.append(Job(device))
-
-		self.download_manager = DownloadManager(self.download_jobs, insite_ip, download_batch, self)
-		self.sftp_manager = SftpManager(self.sftp_jobs, sftp_batch, self)
-		self.ssh_manager = SSHManager(self.ssh_jobs)
+			if pair not in self.pair_sftp_jobs:
+				self.pair_sftp_jobs[pair] = []
+				self.download_jobs.append(self.job_store.add(device, "download"))
+			self.pair_sftp_jobs[pair].append(sftp_job)
 		self.end_event = threading.Event()
 
-	def handle_download_error(self, probe_type, file_type):
-		for job in self.sftp_jobs:
-			if job.device.probe_type == probe_type and job.device.file_type == file_type:
-				job.add_log("Probe package download failed, cannot transfer.")
-				job.error = True
+	def snapshot(self):
+		"""Consistent state of every job, indexed by Job.index."""
+		return self.job_store.snapshot()
 
-		for job in self.ssh_jobs:
-			if job.device.probe_type == probe_type and job.device.file_type == file_type:
-				job.add_log("Probe package download failed.")
-				job.error = True
+	def handle_download_error(self, probe_type, file_type):
+		for job in self.pair_sftp_jobs.get((probe_type, file_type), []):
+			job.add_log("Probe package download failed, cannot transfer.")
+			job.error = True
+			ssh_job = self.sftp_to_ssh[id(job)]
+			ssh_job.add_log("Probe package download failed.")
+			ssh_job.error = True
 
 	def handle_sftp_error(self, device):
 		for job in self.ssh_jobs:
@@ -52,235 +227,449 @@ class DeployProbesThread(threading.Thread):
 				job.error = True
 				job.add_log("Probe package transfer failed.")
 
-	def run(self):
-		self.download_manager.start()
-		while self.download_manager.is_alive():
-			if self.end_event.is_set():
-				self.download_manager.stop(block=True)
-				return
-			time.sleep(1)
+	def handle_installed(self, sftp_job):
+		"""The device already runs this package: the transfer was skipped, skip the install too."""
+		ssh_job = self.sftp_to_ssh[id(sftp_job)]
+		ssh_job.add_log("Probe package already installed and running, nothing to do.")
+		ssh_job.update(skipped="Already installed", completed=True, progress=100)
 
-		self.sftp_manager.start()
-		while self.sftp_manager.is_alive():
-			if self.end_event.is_set():
-				self.sftp_manager.end_event.set()
-				return
-			time.sleep(1)
+	def add_package(self, device, cache_key, path):
+		pair = (device.probe_type, device.file_type)
+		self.packages[pair] = path
+		self.package_keys[pair] = cache_key
 
-		self.ssh_manager.start()
-		while self.ssh_manager.is_alive():
-			if self.end_event.is_set():
-				self.ssh_manager.end_event.set()
-				return
-			time.sleep(1)
+	def package_path(self, device):
+		return self.packages[(device.probe_type, device.file_type)]
 
-		self.log_data()
-		self.delete_files()
-		self.end_event.set()
+	def package_sha256(self, device):
+		entry = self.cache.lookup(self.package_keys[(device.probe_type, device.file_type)])
+		return entry.get("sha256") if entry else None
+
+	def script_command(self, device):
+		"""Single-script install command for device, run as root, with its password prompt and
+		the token its step reports are marked with."""
+		token = f"__step_{uuid.uuid4().hex}__"
+		steps = install_steps(device, self.package_sha256(device))
+		command, passw = root_exec(device, install_script(steps, token))
+		return command, passw, token
+
+	@staticmethod
+	def report_script(job, status, output, token, elapsed, metrics=None):
+		"""Log the per-step timings of a single-script install, and record them in metrics.
+		Returns whether it succeeded."""
+		steps = script_steps(output, token)
+		for code, ms, step in steps:
+			if metrics is not None and code == 0:
+				metrics.observe("install_command_seconds", ms / 1000, command=command_label(step))
+			if code == 0:
+				job.add_log(f"Step finished in {ms} ms: {step}")
+			else:
+				job.add_log(f"Step failed with exit status {code} after {ms} ms: {step}")
+		job.add_log(f"Install script exited with status {status} after {elapsed * 1000:.0f} ms")
+		if status == 0:
+			return True
+		if not steps:
+			job.add_log("Could not gain root shell.")
+		for line in output.strip().splitlines()[-5:]:
+			if token not in line:
+				job.add_log(f"> {line.rstrip()}")
+		return False
+
+	def release_packages(self):
+		"""Unpin this run's packages so the cache may evict them again."""
+		for cache_key in self.package_keys.values():
+			self.cache.release(cache_key)
+		self.package_keys = {}
+
+	def drain(self):
+		"""Stop every stage and wait until none of their workers runs any more. After a stop,
+		later stages may still be installing; their pooled connections must outlive them."""
+		managers = (self.download_manager, self.sftp_manager, self.ssh_manager)
+		for manager in managers:
+			manager.stop()
+		for manager in managers:
+			manager.wait()
+
+	def set_batch_sizes(self, download_batch=None, sftp_batch=None, ssh_batch=None):
+		"""Change stage concurrency while the deployment is running."""
+		raise NotImplementedError("Subclasses should implement this method")
+
+	def stop(self, block=False):
+		raise NotImplementedError("Subclasses should implement this method")
+
+	def close_logs(self):
+		"""Finish the run log and export the metrics beside it, whether or not the run completed.
+		Call once no worker is left: the run log drops lines written after it closes, and the
+		exported counts and quantiles would leave out samples still to come."""
+		self.run_log.close()
+		self.metrics.write(os.path.splitext(self.run_log.path)[0])
 
 	def log_data(self):
-		if not os.path.exists("logs"):
-			os.makedirs("logs")
-		filename = time.strftime("%m-%d__%H-%M")
-		with open(f"logs/log--{filename}.log", "w") as file:
-			file.write("Download tasks\n")
+		"""Write the readable summary of the run next to its run log. Lines come from the run
+		log, so those the jobs no longer hold in memory are there too. Call after the run log
+		is closed."""
+		lines = {}  # Job index -> its log lines
+		for record in read_run_log(self.run_log.path):
+			lines.setdefault(record["job"], []).append(record["message"])
+		with open(os.path.splitext(self.run_log.path)[0] + ".log", "w") as file:
+			installed = [job for job in self.ssh_jobs if job.skipped]
+			file.write(f"Already installed, not reinstalled ({len(installed)} of {len(self.ssh_jobs)} devices)\n")
+			for job in installed:
+				file.write(f"Alias: {job.device.alias}    Control IP: {job.device.control_ip}\n")
+			file.write("\n\nDownload tasks\n")
 			for job in self.download_jobs:
 				file.write("----------------------------------\n")
 				file.write(f"File: {job.device.probe_type}.{job.device.file_type}\n")
-				for log in job.logs:
+				for log in lines.get(job.index, []):
 					file.write(log + "\n")
 			file.write("\n\nSftp tasks\n")
 			for job in self.sftp_jobs:
 				file.write("-------------------------------------------------\n")
 				file.write(f"Alias: {job.device.alias}    Control IP: {job.device.control_ip}\n")
-				for log in job.logs:
+				for log in lines.get(job.index, []):
 					file.write(log + "\n")
 			file.write("\n\nSSH Commands\n")
 			for job in self.ssh_jobs:
 				file.write("-------------------------------------------------\n")
 				file.write(f"Alias: {job.device.alias}    Control IP: {job.device.control_ip}\n")
-				for log in job.logs:
+				for log in lines.get(job.index, []):
 					file.write(log + "\n")
 
-	@staticmethod
-	def delete_files():
-		if not os.path.exists(FILE_DIR):
+
+class DeployProbesThread(Deployment):
+	def __init__(self, devices, insite_ip, download_batch, sftp_batch, ssh_batch=None, max_handshakes=None,
+				 adaptive_ssh=False, cache_mb=DEFAULT_MAX_MB, download_segments=1, insite_client=None,
+				 force_reinstall=False, site_relay=False, relay_fanout=RELAY_FANOUT, sftp_buffer_size=BUFFER_SIZE,
+				 sftp_channels=1, script_install=False):
+		super().__init__(devices, insite_ip, cache_mb, force_reinstall, script_install)
+		self.site_relay = site_relay
+		self.relay_fanout = relay_fanout
+		self.sites = {}  # id(sftp job) -> SiteRelay the job is being served through
+		self.download_manager = DownloadManager(insite_ip, download_batch, self, download_segments, insite_client)
+		self.sftp_manager = SftpManager(sftp_batch, self, sftp_buffer_size, sftp_channels)
+		self.ssh_manager = SSHManager(ssh_batch, self, adaptive_ssh)
+		self.handshake_gate = HandshakeGate(max_handshakes, self.ssh_manager.limiter, (paramiko.AuthenticationException,))
+		# One SSH handshake per device for both stages
+		self.connections = ConnectionPool(self.handshake_gate, metrics=self.metrics)
+
+	def handle_download_done(self, job):
+		"""Release the transfers waiting on this package, failed or not, so errors flow downstream."""
+		sftp_jobs = self.pair_sftp_jobs.get((job.device.probe_type, job.device.file_type), [])
+		if not self.site_relay or job.error:
+			for sftp_job in sftp_jobs:
+				self.sftp_manager.submit(sftp_job)
 			return
 
-		for filename in os.listdir(FILE_DIR):
-			file_path = os.path.join(FILE_DIR, filename)
-			try:
-				if os.path.isfile(file_path):
-					os.remove(file_path)
-			except Exception as e:
-				print(f"Failed to delete {file_path}. Reason: {e}")
+		groups = {}
+		for sftp_job in sftp_jobs:
+			groups.setdefault(site_of(sftp_job.device), []).append(sftp_job)
+		for site_jobs in groups.values():
+			if len(site_jobs) < RELAY_MIN_DEVICES:
+				for sftp_job in site_jobs:
+					self.sftp_manager.submit(sftp_job)
+				continue
+			site = SiteRelay(site_jobs, self.relay_fanout)
+			for sftp_job in site_jobs:
+				self.sites[id(sftp_job)] = site
+			self.next_seed(site)
+
+	def next_seed(self, site):
+		"""Send the package straight to the next device of a site, to serve the others from."""
+		seed = site.next_seed()
+		if seed is not None:
+			seed.add_log("Chosen as site relay seed")
+			self.sftp_manager.submit(seed)
+
+	def fan_out(self, site, relay_done=False):
+		"""Start relayed copies from the seed up to the fanout. Once the seed has served every
+		neighbour its own install may run, which moves the package away."""
+		started, finished = site.take(relay_done)
+		for job in started:
+			self.sftp_manager.submit_relay(job, site.seed.device)
+		if finished:
+			self.submit_install(site.seed)
+
+	def submit_install(self, sftp_job):
+		ssh_job = self.sftp_to_ssh[id(sftp_job)]
+		if not ssh_job.skipped:
+			self.ssh_manager.submit(ssh_job)
+
+	def handle_sftp_done(self, job):
+		"""Release the install waiting on this transfer, unless it has nothing to do. A seed
+		that got the package starts serving its site instead; a seed that failed, or did not
+		need the package, hands over to the next device."""
+		site = self.sites.get(id(job))
+		if site is None:
+			self.submit_install(job)
+		elif job.error or job.skipped == "Already installed":
+			self.submit_install(job)
+			self.next_seed(site)
+		else:
+			self.fan_out(site)
+
+	def handle_relay_done(self, job, relayed):
+		"""A copy from the seed finished. Failed copies fall back to a direct transfer."""
+		site = self.sites.pop(id(job))
+		if relayed:
+			self.submit_install(job)
+		elif not self.end_event.is_set():
+			job.add_log("Falling back to direct transfer")
+			self.sftp_manager.submit(job)
+		self.fan_out(site, relay_done=True)
+
+	def wait_for(self, manager):
+		"""Wait for a stage to drain. Returns False if the deployment was stopped meanwhile."""
+		manager.wait()
+		return not self.end_event.is_set()
+
+	def run(self):
+		try:
+			for job in self.download_jobs:
+				self.download_manager.submit(job)
+			self.download_manager.close()
+
+			# Once every download has finished, every transfer has been submitted, and so on.
+			if not self.wait_for(self.download_manager):
+				return
+			self.sftp_manager.close()
+			if not self.wait_for(self.sftp_manager):
+				return
+			self.ssh_manager.close()
+			if not self.wait_for(self.ssh_manager):
+				return
+		finally:
+			self.drain()
+			self.connections.close_all()
+			self.close_logs()  # Only once drained, so a stopped run keeps every line and sample of its workers
+
+		self.log_data()
+		self.release_packages()
+		self.end_event.set()
+
+	def set_batch_sizes(self, download_batch=None, sftp_batch=None, ssh_batch=None):
+		"""Change stage concurrency while the deployment is running."""
+		if download_batch is not None:
+			self.download_manager.resize(download_batch)
+		if sftp_batch is not None:
+			self.sftp_manager.resize(sftp_batch)
+		if ssh_batch is not None:
+			self.ssh_manager.resize(ssh_batch)
 
 	def stop(self, block=False):
 		"""Signal the thread to stop and optionally block until exited."""
 		self.end_event.set()
-		if self.download_manager.is_alive():
-			self.download_manager.stop(block)
-		if self.sftp_manager.is_alive():
-			self.sftp_manager.stop(block)
-		if self.ssh_manager.is_alive():
-			self.ssh_manager.stop(block)
+		for manager in (self.download_manager, self.sftp_manager, self.ssh_manager):
+			manager.stop(block)
 		if block is True:
 			self.join()
 
 
-class Job:
-	def __init__(self, device):
-		self.device = device
-		self.error = False
-		self.completed = False
-		self.in_progress = False
-		self.final_update_done = False  # Used by GUI to track the animation
-		self.size = 0
-		self.done = 0  # Store the downloaded/transferred portion
-		self.progress = 0  # Percentage of completed job
-		self.speed = 0
-		self.logs = []
+class SiteRelay:
+	"""Transfers of one package to one site: a seed gets it from the deployer and its
+	neighbours copy it from the seed over the LAN, at most fanout at a time."""
+	def __init__(self, jobs, fanout):
+		self.pending = collections.deque(jobs)  # Sftp jobs neither seeded nor relayed yet
+		self.fanout = fanout
+		self.seed = None
+		self.active = 0
+		self.done = False  # The seed was handed to its install
 		self.lock = threading.Lock()
 
-	def get_logs(self):
+	def next_seed(self):
 		with self.lock:
-			return self.logs[:]
+			self.seed = self.pending.popleft() if self.pending else None
+			return self.seed
 
-	def add_log(self, message):
+	def take(self, relay_done=False):
+		"""Jobs to relay now, and whether the seed has nothing left to serve. relay_done counts
+		a finished copy first. The seed is reported finished exactly once, however many
+		copies end at the same time."""
 		with self.lock:
-			self.logs.append(message)
-
-
-class BaseManager(threading.Thread):
-	def __init__(self, jobs, batch_size, parent):
-		super().__init__()
-		self.jobs = jobs
-		self.batch_size = batch_size
+			if relay_done:
+				self.active -= 1
+			started = []
+			while self.pending and self.active < self.fanout:
+				started.append(self.pending.popleft())
+				self.active += 1
+			finished = not self.pending and self.active == 0 and not self.done
+			self.done = self.done or finished
+			return started, finished
+
+
+class BaseManager:
+	"""Runs the jobs submitted to it on a WorkerPool, at most batch_size at a time, until
+	closed. A batch_size of None means no limit."""
+	def __init__(self, batch_size, parent):
 		self.parent = parent
-		self.active_threads = []
-		self.thread_lock = threading.Lock()
+		self.pool = WorkerPool(batch_size, name=type(self).__name__)
+		self.active_workers = set()
+		self.worker_lock = threading.Lock()
 		self.end_event = threading.Event()
 
-	def run(self):
-		for job in self.jobs:
-			with self.thread_lock:
-				while len(self.active_threads) == self.batch_size:
-					self.active_threads = [t for t in self.active_threads if t.is_alive()]
-					threading.Event().wait(1)
+	def submit(self, job):
+		if self.end_event.is_set():
+			return
+		self.pool.submit(lambda: self.run_worker(job))
 
-				if self.end_event.is_set():
-					return
+	def run_worker(self, job, create_worker=None):
+		if self.end_event.is_set():
+			return
+		worker = (create_worker or self.create_worker)(job)
+		with self.worker_lock:
+			self.active_workers.add(worker)
+		try:
+			worker.run()
+		except Exception as e:
+			# A failure the worker did not expect; the pool prints the traceback
+			job.add_log(f"Unexpected error: {e!r}")
+			job.update(error=True, completed=True, in_progress=False, progress=100)
+			raise
+		finally:
+			with self.worker_lock:
+				self.active_workers.discard(worker)
+
+	def close(self):
+		"""No more jobs will be submitted; wait() returns once the queued ones are done."""
+		self.pool.close()
 
-				thread = self.create_worker(job)
-				thread.start()
-				self.active_threads.append(thread)
+	def wait(self, timeout=None):
+		return self.pool.wait(timeout)
 
-		while self.active_threads:
-			self.active_threads = [t for t in self.active_threads if t.is_alive()]
-			threading.Event().wait(1)
+	def resize(self, batch_size):
+		self.pool.resize(batch_size)
 
 	def stop(self, block=False):
 		self.end_event.set()
-		for thread in self.active_threads:
-			thread.stop()
+		self.pool.cancel()
+		self.pool.close()
+		with self.worker_lock:
+			workers = list(self.active_workers)
+		for worker in workers:
+			worker.stop()
 
 		if block is True:
-			self.join()
+			self.pool.wait()
 
 	def create_worker(self, job):
 		raise NotImplementedError("Subclasses should implement this method")
 
 
+class Worker:
+	"""Runs one job on a pool thread. Long running steps should check end_event."""
+	def __init__(self, job: Job):
+		self.job = job
+		self.end_event = threading.Event()
+
+	def log(self, msg):
+		self.job.add_log(msg)
+
+	def run(self):
+		raise NotImplementedError("Subclasses should implement this method")
+
+	def stop(self):
+		"""Signal the worker to stop."""
+		self.end_event.set()
+
+
 class DownloadManager(BaseManager):
-	def __init__(self, download_jobs, insite_ip, batch_size, parent):
-		super().__init__(download_jobs, batch_size, parent)
+	def __init__(self, insite_ip, batch_size, parent, segments=1, client=None):
+		super().__init__(batch_size, parent)
 		self.insite_ip = insite_ip
-		if not os.path.exists(FILE_DIR):
-			os.makedirs(FILE_DIR)
+		self.segments = segments  # Parallel range requests per package, 1 for a single stream
+		self.client = client or InsiteClient(insite_ip)
+		self.client.resize(batch_size * segments)
+
+	def resize(self, batch_size):
+		super().resize(batch_size)
+		self.client.resize(batch_size * self.segments)
 
 	def create_worker(self, job):
 		return DownloadWorker(self.insite_ip, job, self)
 
+	def add_package(self, job, cache_key, path):
+		self.parent.add_package(job.device, cache_key, path)
+
 	def handle_download_error(self, probe_type, file_type):
 		self.parent.handle_download_error(probe_type, file_type)
 
+	def handle_download_done(self, job):
+		self.parent.handle_download_done(job)
+
 
-class DownloadWorker(threading.Thread):
+class DownloadWorker(Worker):
 	def __init__(self, insite_ip, job: Job, manager: DownloadManager, retries=3):
-		super().__init__()
+		super().__init__(job)
 		self.insite_ip = insite_ip
-		self.job = job
 		self.manager = manager
 		self.retries = retries
-		self.end_event = threading.Event()
-
-	def log(self, msg):
-		self.job.add_log(msg)
+		self.segment_state = None  # (validator, bytes done per segment) carried across attempts
 
 	def run(self):
+		try:
+			self.download()
+		finally:
+			self.manager.handle_download_done(self.job)
+
+	def download(self):
 		self.job.in_progress = True
-		file = f"{self.job.device.probe_type}.{self.job.device.file_type.lower()}"
+		cache = self.manager.parent.cache
+		client = self.manager.client
+		file = package_name(self.job.device)
 		self.log("Starting download")
 		for attempt in range(1, self.retries + 1):
 			try:
-				url = f"https://{self.insite_ip}/api/-/model/probes?static-asset=true"
-				headers = {"Content-Type": "application/json"}
-				payload = {
-					"type": self.job.device.probe_type,
-					"os": {"family": "linux", "architecture": "amd64"},
-					"bits": 64,
-					"archive-type": self.job.device.file_type,
-					"port": 22222,
-					"beats": {"filebeat": True, "metricbeat": True},
-				}
+				payload = probe_payload(self.job.device)
 				self.log(f"Attempt {attempt}: Requesting probe File Path")
-				response = requests.post(url, headers=headers, data=json.dumps(payload), verify=False)
-				self.log(f"Attempt {attempt}: Response status code: {response.status_code}")
-				if response.status_code == 200:
-					path = response.json().get("path")
-					self.log(f"Attempt {attempt}: Path retrieved: {path}")
-
-					if path:
-						download_url = f"https://{self.insite_ip}/probe/download/{path}"
-						self.log(f"Attempt {attempt}: Requesting file size from {download_url}")
-						response = requests.head(download_url, verify=False)  # Get content length
-						total_size = int(response.headers.get("content-length", 0))
-						self.job.size = total_size / (1024 * 1024)
-						self.log(f"Attempt {attempt}: Total file size: {self.job.size} MB")
-						self.log(f"Attempt {attempt}: Downloading file...")
-						with requests.get(download_url, stream=True, verify=False) as download_response:
-							self.log(
-								f"Attempt {attempt}: Download response status code: {download_response.status_code}")
-							if download_response.status_code == 200:
-								file_path = f"{FILE_DIR}/{file}"
-								with open(file_path, "wb") as file:
-									downloaded_size = 0
-									start_time = time.time()
-									for chunk in download_response.iter_content(chunk_size=1024):
-										if chunk:
-											file.write(chunk)
-											downloaded_size += len(chunk)
-											progress = (downloaded_size / total_size) * 100
-											self.job.progress = progress
-
-											elapsed_time = time.time() - start_time
-											if elapsed_time > 0:
-												speed = downloaded_size / elapsed_time  # bytes per second
-												self.job.speed = speed / (1024 * 1024)  # MB/s
-
-											if self.end_event.is_set():
-												return
-
-								self.log(f"Attempt {attempt}: File downloaded successfully")
-								self.job.in_progress = False
-								self.job.completed = True
-								self.job.progress = 100
-								return  # Exit after successful download
-							else:
-								self.log(
-									f"Attempt {attempt}: Failed to download file. Status code: {download_response.status_code}")
-				else:
-					self.log(f"Attempt {attempt}: Failed to get download path. Status code: {response.status_code}")
+				with self.manager.parent.metrics.timer("download_request_seconds"):
+					path = client.probe_path(payload)
+				self.log(f"Attempt {attempt}: Path retrieved: {path}")
+
+				cache_key = cache.key(self.insite_ip, payload)
+				headers = cache.validators(cache_key)
+				if headers:
+					self.log(f"Attempt {attempt}: Revalidating cached package")
+				offset, validator = cache.partial(cache_key)
+				if offset and validator:
+					# Only continue the partial file if the package is still the one it came from
+					headers["Range"] = f"bytes={offset}-"
+					headers["If-Range"] = validator
+					self.log(f"Attempt {attempt}: Resuming download from {offset / (1024 * 1024):.2f} MB")
+				self.log(f"Attempt {attempt}: Downloading file from {client.download_url(path)}")
+				with client.download(path, headers) as download_response:
+					self.log(f"Attempt {attempt}: Download response status code: {download_response.status_code}")
+					if download_response.status_code == 304:
+						self.finish(cache_key, cache.hit(cache_key))
+						self.log(f"Attempt {attempt}: Cache hit, package unchanged since the last download")
+						return
+					if download_response.status_code == 416:
+						cache.discard_partial(cache_key)  # Partial file no longer matches, start over
+					if download_response.status_code not in (200, 206):
+						self.log(f"Attempt {attempt}: Failed to download file. Status code: {download_response.status_code}")
+						continue
+
+					if download_response.status_code == 200:
+						offset = 0
+					elif not download_response.headers.get("content-range", "").startswith(f"bytes {offset}-"):
+						raise IOError(f"Unexpected Content-Range {download_response.headers.get('content-range')}")
+					total_size = offset + int(download_response.headers.get("content-length", 0))
+					self.job.size = total_size / (1024 * 1024)
+					self.log(f"Attempt {attempt}: Total file size: {self.job.size} MB")
+					started = time.perf_counter()
+					if self.manager.segments > 1 and offset == 0:
+						if download_response.headers.get("accept-ranges", "").lower() == "bytes" and total_size:
+							self.log(f"Attempt {attempt}: Downloading file in {self.manager.segments} segments...")
+							file_path = self.download_segmented(download_response, path, cache, cache_key, total_size)
+						else:
+							self.log(f"Attempt {attempt}: Server does not accept ranges, using a single stream")
+							file_path = self.write_package(download_response, cache, cache_key, offset, total_size)
+					else:
+						file_path = self.write_package(download_response, cache, cache_key, offset, total_size)
+					if file_path is None:  # Stopped by user
+						return
+					self.record_download(total_size - offset, time.perf_counter() - started)
+					self.finish(cache_key, file_path)
+					self.log(f"Attempt {attempt}: File downloaded successfully")
+					return  # Exit after successful download
 
 			except Exception as e:
 				self.log(f"Attempt {attempt}: Error in downloading {file}: {e}")
@@ -290,211 +679,416 @@ class DownloadWorker(threading.Thread):
 		self.error()
 		self.manager.handle_download_error(self.job.device.probe_type, self.job.device.file_type)
 
-	def error(self):
-		self.job.error = True
-		self.job.progress = 100
-		self.job.in_progress = False
-		self.job.completed = False
+	def finish(self, cache_key, file_path):
+		self.manager.add_package(self.job, cache_key, file_path)
+		self.job.update(size=os.path.getsize(file_path) / (1024 * 1024), in_progress=False, completed=True, progress=100)
+
+	def download_segmented(self, response, path, cache, cache_key, total_size):
+		"""Fetch the package as parallel byte ranges into a preallocated file, each segment
+		writing at its own offset. The first segment is read from response, the full GET
+		that reported the size. Segments that finished survive a failed attempt.
+		Returns the cached package path, or None if stopped by the user."""
+		count = self.manager.segments
+		client = self.manager.client
+		temp_path = cache.temp_path(cache_key)
+		etag = response.headers.get("ETag")
+		last_modified = response.headers.get("Last-Modified")
+		validator = etag if etag and not etag.startswith("W/") else last_modified
+		bounds = [(i * total_size // count, (i + 1) * total_size // count) for i in range(count)]
+		if self.segment_state is None or self.segment_state[0] != validator or not validator:
+			cache.discard_partial(cache_key)
+			with open(temp_path, "wb") as file:
+				file.truncate(total_size)
+			self.segment_state = (validator, [0] * count)
+		done = self.segment_state[1]
+		lock = threading.Lock()
+		errors = []
+		start_done = sum(done)
+		start_time = time.time()
+
+		def copy(index, source, first, end):
+			raw = source.raw
+			raw.decode_content = True
+			view = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+			with open(temp_path, "r+b") as file:
+				file.seek(first)
+				while first < end and not self.end_event.is_set():
+					n = raw.readinto(view[:min(len(view), end - first)])
+					if not n:
+						raise IOError(f"segment {index} closed after {first - bounds[index][0]} bytes")
+					file.write(view[:n])
+					first += n
+					with lock:
+						done[index] += n
+						downloaded_size = sum(done)
+					self.job.progress = (downloaded_size / total_size) * 100
+					elapsed_time = time.time() - start_time
+					if elapsed_time > 0:
+						self.job.speed = (downloaded_size - start_done) / elapsed_time / (1024 * 1024)  # MB/s
 
-	def stop(self, block=False):
-		"""Signal the thread to stop and optionally block until exited."""
-		self.end_event.set()
-		if block is True:
-			self.join()
+		def fetch(index):
+			first, end = bounds[index][0] + done[index], bounds[index][1]
+			if first >= end:
+				return
+			try:
+				if first == 0:  # The body of the full GET starts at byte 0
+					copy(index, response, first, end)
+					return
+				headers = {"Range": f"bytes={first}-{end - 1}"}
+				if validator:
+					headers["If-Range"] = validator
+				with client.download(path, headers) as segment:
+					if segment.status_code != 206:
+						raise IOError(f"segment {index} got status code {segment.status_code}")
+					copy(index, segment, first, end)
+			except Exception as e:
+				errors.append(str(e))
+
+		pool = WorkerPool(count, name="Segment")
+		for index in range(count):
+			pool.submit(lambda index=index: fetch(index))
+		pool.close()
+		pool.wait()
+		if self.end_event.is_set():
+			return None
+		if errors:
+			raise IOError("; ".join(errors))
+
+		digest = hashlib.sha256()
+		view = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+		with open(temp_path, "rb") as file:
+			while n := file.readinto(view):
+				digest.update(view[:n])
+		self.segment_state = None
+		return cache.store(cache_key, temp_path, etag, last_modified, digest.hexdigest())
+
+	def record_download(self, size, elapsed):
+		metrics = self.manager.parent.metrics
+		metrics.observe("download_seconds", elapsed)
+		if elapsed > 0:
+			metrics.observe("download_mb_per_second", size / elapsed / (1024 * 1024))
+
+	def write_package(self, response, cache, cache_key, offset, total_size):
+		"""Stream the response body into the cache's partial file, appending after offset.
+		Returns the cached package path, or None if stopped by the user."""
+		temp_path = cache.temp_path(cache_key)
+		etag = response.headers.get("ETag")
+		last_modified = response.headers.get("Last-Modified")
+		validator = etag if etag and not etag.startswith("W/") else last_modified
+		if validator:
+			cache.begin_partial(cache_key, validator)
+
+		digest = hashlib.sha256()
+		buffer = bytearray(DOWNLOAD_BUFFER_SIZE)
+		view = memoryview(buffer)
+		with open(temp_path, "r+b" if offset else "wb") as file:
+			remaining = offset
+			while remaining:  # The digest has to cover the bytes already on disk
+				n = file.readinto(view[:min(remaining, len(buffer))])
+				if not n:
+					raise IOError("Partial download is shorter than expected")
+				digest.update(view[:n])
+				remaining -= n
+			file.truncate()
+
+			raw = response.raw
+			raw.decode_content = True
+			downloaded_size = offset
+			start_time = time.time()
+			while True:
+				n = raw.readinto(view)
+				if not n:
+					break
+				file.write(view[:n])
+				digest.update(view[:n])
+				downloaded_size += n
+				if total_size:
+					self.job.progress = (downloaded_size / total_size) * 100
+				elapsed_time = time.time() - start_time
+				if elapsed_time > 0:
+					self.job.speed = (downloaded_size - offset) / elapsed_time / (1024 * 1024)  # MB/s
+
+				if self.end_event.is_set():
+					return None
+
+		if total_size and downloaded_size < total_size:
+			raise IOError(f"Connection closed after {downloaded_size} of {total_size} bytes")
+		return cache.store(cache_key, temp_path, etag, last_modified, digest.hexdigest())
+
+	def error(self):
+		self.job.update(error=True, progress=100, in_progress=False, completed=False)
 
 
 class SftpManager(BaseManager):
+	def __init__(self, batch_size, parent, buffer_size=BUFFER_SIZE, channels=1):
+		super().__init__(batch_size, parent)
+		self.buffer_size = buffer_size
+		self.channels = channels  # SFTP sessions each upload is spread over
+
 	def create_worker(self, job):
 		return SftpWorker(job, self)
 
+	def submit_relay(self, job, seed):
+		"""Queue a copy of the package from the seed device to the job's device."""
+		if self.end_event.is_set():
+			return
+		self.pool.submit(lambda: self.run_worker(job, lambda job: RelayWorker(job, seed, self)))
+
 	def handle_sftp_error(self, device):
 		self.parent.handle_sftp_error(device)
 
+	def handle_sftp_done(self, job):
+		self.parent.handle_sftp_done(job)
+
 
-class SftpWorker(threading.Thread):
+class SftpWorker(Worker):
 	def __init__(self, job: Job, manager):
-		super().__init__()
-		self.job = job
+		super().__init__(job)
 		self.device = job.device
 		self.manager = manager
 		self.start_time = None
-		self.end_event = threading.Event()
-
-	def log(self, msg):
-		self.job.add_log(msg)
 
 	def run(self):
+		try:
+			self.transfer()
+		finally:
+			self.manager.handle_sftp_done(self.job)
+
+	def transfer(self):
 		if self.job.error:  # If error is true from the get-go...
 			self.error()
 			return
 
-		ssh = paramiko.SSHClient()
-		ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 		try:
 			self.log("Connecting to device via SSH")
-			ssh.connect(self.device.control_ip, 22, self.device.username, self.device.password)
-			self.log("SFTP Started")
-			sftp = ssh.open_sftp()
-			try:
-				file = f"{self.device.probe_type}.{self.device.file_type.lower()}"
-				file_path = f"{FILE_DIR}/{file}"
-				dest = f"/home/{self.device.username}/{file}"
-
-				self.start_time = time.time()
-				self.job.in_progress = True
-
-				def sftp_progress(transferred, total):
-					if self.end_event.is_set():
-						raise InterruptedError("Transfer interrupted by user")
-
-					sent_mb = transferred / (1024 * 1024)
-					size_mb = total / (1024 * 1024)
-					progress_percentage = (transferred / total) * 100 if total > 0 else 0
-					self.job.done = sent_mb
-					self.job.size = size_mb
-					self.job.progress = progress_percentage
-					elapsed_time = time.time() - self.start_time
-					if elapsed_time > 0:
-						self.job.speed = sent_mb / elapsed_time
-
-				self.log(f"Transferring {file_path} to {dest}")
-				sftp.put(file_path, dest, callback=sftp_progress)
-				self.log("Probe package SFTP to device successful")
-				self.job.in_progress = False
-				self.job.completed = True
-			except InterruptedError:
-				self.log("Transfer stopped by user")
-				self.error()
-			finally:
-				sftp.close()
+			with self.manager.parent.connections.connection(self.device) as transport:
+				self.log("SFTP Started")
+				sftp = open_sftp(transport)
+				try:
+					file = package_name(self.device)
+					file_path = self.manager.parent.package_path(self.device)
+					dest = f"/home/{self.device.username}/{file}"
+
+					self.start_time = time.time()
+					self.job.in_progress = True
+					if not self.manager.parent.force_reinstall and self.probe_installed(transport):
+						self.log("insite-probe is already running this package, skipping transfer and install")
+						self.job.update(skipped="Already installed", progress=100, in_progress=False, completed=True)
+						self.manager.parent.handle_installed(self.job)
+						return
+					if self.already_present(transport, sftp, file_path, dest):
+						self.log(f"{dest} already matches the package, skipping transfer")
+						self.job.skipped = "Already present"
+						self.job.size = self.job.done = os.path.getsize(file_path) / (1024 * 1024)
+						self.job.update(progress=100, in_progress=False, completed=True)
+						return
+
+					def sftp_progress(transferred, total):
+						if self.end_event.is_set():
+							raise InterruptedError("Transfer interrupted by user")
+
+						sent_mb = transferred / (1024 * 1024)
+						size_mb = total / (1024 * 1024)
+						progress_percentage = (transferred / total) * 100 if total > 0 else 0
+						self.job.update(done=sent_mb, size=size_mb, progress=progress_percentage)
+						elapsed_time = time.time() - self.start_time
+						if elapsed_time > 0:
+							self.job.speed = sent_mb / elapsed_time
+
+					self.log(f"Transferring {file_path} to {dest}")
+					started = time.perf_counter()
+					upload(sftp, file_path, dest, self.manager.buffer_size, sftp_progress, channels=self.manager.channels)
+					elapsed = time.perf_counter() - started
+					metrics = self.manager.parent.metrics
+					metrics.observe("sftp_transfer_seconds", elapsed)
+					if elapsed > 0:
+						metrics.observe("sftp_mb_per_second", os.path.getsize(file_path) / elapsed / (1024 * 1024))
+					self.log("Probe package SFTP to device successful")
+					self.job.update(in_progress=False, completed=True)
+				except InterruptedError:
+					self.log("Transfer stopped by user")
+					self.error()
+				finally:
+					sftp.close()
 
 		except Exception as e:
 			self.log(f"SFTP failed: {str(e)}")
 			self.error()
-		finally:
-			ssh.close()
+
+	def probe_installed(self, transport):
+		"""Whether the device runs the probe from the very package being deployed."""
+		self.log("Checking installed probe")
+		_, output = run_command(transport, fingerprint_command(self.device), timeout=30)
+		return is_installed(output, self.manager.parent.package_sha256(self.device))
+
+	def already_present(self, transport, sftp, file_path, dest):
+		"""Whether dest already holds this exact package, by size and then by sha256sum."""
+		digest = self.manager.parent.package_sha256(self.device)
+		if not digest:
+			return False
+		try:
+			if sftp.stat(dest).st_size != os.path.getsize(file_path):
+				return False
+		except IOError:  # Not there
+			return False
+		self.log(f"Checking sha256 of existing {dest}")
+		_, output = run_command(transport, f"sha256sum {shlex.quote(dest)}")
+		return output.split()[:1] == [digest]
 
 	def error(self):
 		self.manager.handle_sftp_error(self.device)
-		self.job.error = True
-		self.job.progress = 100
-		self.job.in_progress = False
-		self.job.completed = False
+		self.job.update(error=True, progress=100, in_progress=False, completed=False)
 
-	def stop(self, block=False):
-		"""Signal the thread to stop and optionally block until exited."""
-		self.end_event.set()
-		if block:
-			self.join()
 
+class RelayWorker(SftpWorker):
+	"""Copies the package from a seed device that already holds it to a neighbour, so it
+	crosses the WAN once per site. The seed pipes the file through dd into ssh, logging in
+	to the neighbour with a throwaway SSH_ASKPASS script, and dd's progress is read back.
+	The script holds the neighbour's password in the seed's home directory only while a
+	command that needs it runs."""
+	def __init__(self, job: Job, seed, manager):
+		super().__init__(job, manager)
+		self.seed = seed
 
-class SSHManager(threading.Thread):
-	def __init__(self, ssh_jobs):
-		super().__init__()
-		self.jobs = ssh_jobs
-		self.end_event = threading.Event()
-		self.workers = []
 	def run(self):
-		for ssh_job in self.jobs:
-			if self.end_event.is_set():
-				break
-			worker: SSHWorker = SSHWorker(ssh_job)
-			worker.start()
-			self.workers.append(worker)
+		relayed = False
+		try:
+			relayed = self.relay()
+		except Exception as e:
+			self.log(f"Relay from {self.seed.alias} failed: {str(e)}")
+		if self.end_event.is_set() and not relayed:
+			self.log("Transfer stopped by user")
+			self.error()
+		self.manager.parent.handle_relay_done(self.job, relayed)
+
+	def relay(self):
+		seed = self.seed
+		parent = self.manager.parent
+		file = package_name(self.device)
+		src = f"/home/{seed.username}/{file}"
+		dest = f"/home/{self.device.username}/{file}"
+		askpass = f"/home/{seed.username}/.probe-relay-{uuid.uuid4().hex}"
+		digest = parent.package_sha256(self.device)
+
+		self.log(f"Connecting to relay seed {seed.alias} ({seed.control_ip})")
+		with parent.connections.connection(seed) as transport:
+			sftp = paramiko.SFTPClient.from_transport(transport)
+
+			def stage_askpass():
+				# Every command on the seed removes the script when it ends, see on_seed()
+				with sftp.open(askpass, "w") as script:
+					script.chmod(0o700)
+					script.write(f"#!/bin/sh\nprintf '%s\\n' {shlex.quote(self.device.password)}\n")
 
-		for worker in self.workers:
-			worker.join()
+			try:
+				hop = relay_hop(self.device, askpass)
+				self.job.in_progress = True
+				if not parent.force_reinstall:
+					self.log("Checking installed probe")
+					stage_askpass()
+					_, output = run_command(transport, on_seed(f"{hop} {shlex.quote(fingerprint_command(self.device))}",
+															   askpass))
+					if is_installed(output, digest):
+						self.log("insite-probe is already running this package, skipping transfer and install")
+						self.job.update(skipped="Already installed", progress=100, in_progress=False, completed=True)
+						parent.handle_installed(self.job)
+						return True
+
+				self.log(f"Relaying {src} from {seed.alias} to {dest}")
+				total = os.path.getsize(parent.package_path(self.device))
+				self.job.size = total / (1024 * 1024)
+				remote = f"cat > {shlex.quote(dest)} && sha256sum {shlex.quote(dest)}"
+				channel = transport.open_session()
+				channel.settimeout(60)
+				stage_askpass()
+				channel.exec_command(on_seed(f"dd if={shlex.quote(src)} bs=1M status=progress | {hop} {shlex.quote(remote)}",
+											 askpass))
+				self.start_time = time.time()
+				while True:
+					if self.end_event.is_set():
+						channel.close()
+						return False
+					data = channel.recv_stderr(4096)
+					if not data:
+						break
+					copied = re.findall(rb"(\d+) bytes", data)
+					if copied:
+						sent_mb = int(copied[-1]) / (1024 * 1024)
+						self.job.update(done=sent_mb, progress=(int(copied[-1]) / total) * 100 if total > 0 else 0)
+						elapsed_time = time.time() - self.start_time
+						if elapsed_time > 0:
+							self.job.speed = sent_mb / elapsed_time
+				output = channel.makefile().read().decode('utf-8', 'replace')
+				status = channel.recv_exit_status()
+				if status != 0 or (digest and output.split()[:1] != [digest]):
+					self.log(f"Relayed copy did not verify (exit status {status})")
+					return False
+			finally:
+				try:
+					sftp.remove(askpass)
+				except IOError:
+					pass
+				sftp.close()
 
-	def stop(self, block=False):
-		"""Signal the thread to stop and optionally block until exited."""
-		self.end_event.set()
-		if block is True:
-			self.join()
+		self.log("Probe package relayed to device successfully")
+		self.job.update(progress=100, in_progress=False, completed=True)
+		return True
 
 
-class SSHWorker(threading.Thread):
-	def __init__(self, job: Job):
-		super().__init__()
-		self.device = job.device
-		self.job = job
+class SSHManager(BaseManager):
+	"""Install stage. With adaptive set, batch_size is only the upper bound and the number of
+	concurrent installs backs off when handshakes start failing or slowing down."""
+	def __init__(self, batch_size, parent, adaptive=False):
+		super().__init__(batch_size, parent)
+		self.limiter = AdaptiveLimit(self.pool, batch_size) if adaptive and batch_size else None
 
-	def log(self, msg):
-		self.job.add_log(msg)
+	def create_worker(self, job):
+		return SSHWorker(job, self)
 
-	@staticmethod
-	def read_until(channel, expected, timeout=None):
-		"""Read from the channel until the expected text is found or the timeout expires."""
-		start = time.time()
-		reply = bytearray()
-		while not channel.exit_status_ready():
-			if channel.recv_ready():
-				reply.extend(channel.recv(8192))
-				if expected and expected in reply:
-					break
-			elif timeout and time.time() - start > timeout:
-				break
-			time.sleep(0.1)
-		return reply.decode('utf-8')
+	def resize(self, batch_size):
+		if self.limiter:
+			self.limiter.maximum = batch_size
+			batch_size = min(batch_size, self.pool.size or batch_size)
+		super().resize(batch_size)
 
-	def authenticate(self, transport):
-		"""Authenticate to the SSH server."""
-		try:
-			self.log("Authenticating to SSH server")
-			transport.auth_password(self.device.username, self.device.password)
-			if not transport.is_authenticated():
-				raise paramiko.SSHException("Authorization failed.")
-		except paramiko.SSHException as err:
-			self.log(f"Authentication failed: {str(err)}")
-			self.error()
-			return False
-		return True
+
+class SSHWorker(Worker):
+	def __init__(self, job: Job, manager: SSHManager):
+		super().__init__(job)
+		self.device = job.device
+		self.manager = manager
 
 	def error(self):
-		self.job.error = True
-		self.job.completed = True
-		self.job.in_progress = False
-		self.job.progress = 100
-
-	def execute_commands(self, channel, commands):
-		"""Send a list of commands to the SSH channel."""
-		for command in commands:
+		self.job.update(error=True, completed=True, in_progress=False, progress=100)
+
+	def execute(self, shell, command):
+		"""Run one command in the root shell and log how long it took."""
+		output, elapsed = shell.run(command)
+		self.log(f"Command finished in {elapsed * 1000:.0f} ms")
+		self.manager.parent.metrics.observe("install_command_seconds", elapsed, command=command_label(command))
+		return output
+
+	def execute_commands(self, shell, commands):
+		"""Run a list of commands in the root shell, moving progress from PROGRESS_ROOT to
+		PROGRESS_INSTALLED as they finish."""
+		for number, command in enumerate(commands, 1):
+			if self.end_event.is_set():
+				raise paramiko.SSHException("Stopped by user")
 			self.log(f"Executing command: {command}")
-			channel.send(command + '\n')
-			out = self.read_until(channel, b'#', 20)
+			self.execute(shell, command)
+			self.job.progress = PROGRESS_ROOT + (PROGRESS_INSTALLED - PROGRESS_ROOT) * number / len(commands)
 
-	def install_probe(self, channel):
+	def install_probe(self, shell):
 		"""Install the probe on the device."""
-		file = f"{self.device.probe_type}.{self.device.file_type.lower()}"
-		if self.device.file_type == "TAR":
-			commands = [
-				'rm -rf /opt/evertz/insite/probe',
-				'rm /lib/systemd/system/insite-probe.service',
-				'rm /usr/lib/systemd/system/insite-probe.service',
-				'rm -rf /bin/insite-probe',
-				'mkdir -p /opt/evertz/insite/probe',
-				f'mv /home/{self.device.username}/{file} /opt/evertz/insite/probe/{file}',
-				'cd /opt/evertz/insite/probe',
-				f'tar -xvf {file}',
-				'cd /opt/evertz/insite/probe/insite-probe/setup',
-				'chmod +x ./install',
-				'./install',
-				'1',
-				'y'
-			]
-		else:
-			commands = [f'dpkg -i {file}']
-
-		self.execute_commands(channel, commands)
+		self.execute_commands(shell, install_commands(self.device))
 
-	def check_and_start_service(self, channel):
+	def check_and_start_service(self, shell):
 		"""Check and start the `insite-probe` service if not running."""
 		self.log("Starting probe service")
-		systemctl = "/bin/systemctl" if self.device.probe_type in ["centos", "fedora"] else "systemctl"
-		channel.send(f'{systemctl} start insite-probe\n')
-		self.read_until(channel, b'#', 5)
-
-		channel.send(f'{systemctl} status insite-probe\n')
-		output = self.read_until(channel, b'#', 5)
+		with self.manager.parent.metrics.timer("service_start_seconds"):
+			self.execute(shell, f'{systemctl(self.device)} start insite-probe')
+			self.job.progress = PROGRESS_SERVICE
+			output = self.execute(shell, f'{systemctl(self.device)} --no-pager status insite-probe')
 
 		if 'active (running)' not in output:
 			self.log("Probe not started. Error occurred while installing it.")
@@ -502,59 +1096,77 @@ class SSHWorker(threading.Thread):
 			self.error()
 		else:
 			self.log("Probe started successfully.")
+			digest = self.manager.parent.package_sha256(self.device)
+			if digest:
+				self.execute(shell, marker_command(digest))
 
 	def run(self):
 		if self.job.error:  # If error is true from the get-go....
 			self.error()
 			return
 
-		self.job.in_progress = True
-		self.job.progress = random.randint(7, 11)
+		self.job.update(in_progress=True, progress=0)
 		self.log("Starting working on SSH job")
+		started = time.perf_counter()
 		try:
 			self.log(f"Connecting to {self.device.control_ip}")
-			transport = paramiko.Transport((self.device.control_ip, 22))
-			self.log("SSH connection established")
-			transport.start_client()
-
-			if not self.authenticate(transport):
-				return
-
-			self.log("Executing SSH commands")
-			channel = transport.open_session()
-			channel.get_pty(term='vt100', width=300, height=24)
-			channel.invoke_shell()
-			self.job.progress = random.randint(27, 34)
-
-			# Gain root access
-			self.log("Switching to root shell")
-			if self.job.device.probe_type == "debian":
-				sudo = 'su\n'
-				passw = b'Password:'
-			else:
-				sudo = 'sudo -s\n'
-				passw = b'[sudo] password for'
-
-			channel.send(sudo)
-			self.read_until(channel, passw, 5)
-			channel.send(self.device.password + '\n')
-			out = self.read_until(channel, b'#', 5)
-			if '#' in out:
-				self.log("Switched to root shell")
-			else:
-				self.log("Could not gain root shell.")
-				self.error()
-				return
-
-			self.job.progress = random.randint(38, 45)
-			self.install_probe(channel)
-			self.job.progress = random.randint(80, 89)
-			self.check_and_start_service(channel)
-			self.job.completed = True
-			self.job.in_progress = False
-			self.job.progress = 100
-			transport.close()
-			self.log("SSH connection closed")
-		except paramiko.SSHException as err:
+			with self.manager.parent.connections.connection(self.device, keep=False) as transport:
+				self.job.progress = PROGRESS_CONNECTED
+				if self.manager.parent.script_install:
+					self.install_script(transport)
+				else:
+					self.install(transport)
+		except paramiko.AuthenticationException as err:
+			self.log(f"Authentication failed: {str(err)}")
+			self.error()
+		except (paramiko.SSHException, OSError) as err:
 			self.log(f"SSH Error: {str(err)}")
 			self.error()
+		else:
+			self.log("SSH connection closed")
+			if not self.job.error:
+				self.manager.parent.metrics.observe("install_seconds", time.perf_counter() - started)
+
+	def install_script(self, transport):
+		"""Install the probe with one generated script run as root, a single round trip."""
+		parent = self.manager.parent
+		command, passw, token = parent.script_command(self.device)
+		self.log("Running install script")
+		self.job.progress = PROGRESS_ROOT
+		start = time.monotonic()
+		status, output = run_as_root(transport, command, self.device.password, passw, SCRIPT_TIMEOUT)
+		if not parent.report_script(self.job, status, output, token, time.monotonic() - start, parent.metrics):
+			self.error()
+			return
+		self.log("Probe started successfully.")
+		self.job.update(completed=True, in_progress=False, progress=100)
+
+	def install(self, transport):
+		"""Open a root shell on the connected device and install the probe."""
+		self.log("Executing SSH commands")
+		channel = transport.open_session()
+		channel.get_pty(term='vt100', width=300, height=24)
+		channel.invoke_shell()
+		shell = Shell(channel)
+
+		# Gain root access
+		self.log("Switching to root shell")
+		started = time.perf_counter()
+		sudo, passw = root_shell(self.device)
+		shell.send(sudo)
+		shell.read_until(passw, PROMPT_TIMEOUT)
+		shell.send(self.device.password)
+		if '#' in shell.read_until(b'#', PROMPT_TIMEOUT):
+			self.log("Switched to root shell")
+		else:
+			self.log("Could not gain root shell.")
+			self.error()
+			return
+		shell.start()
+		self.manager.parent.metrics.observe("root_shell_seconds", time.perf_counter() - started)
+
+		self.job.progress = PROGRESS_ROOT
+		self.install_probe(shell)
+		self.job.progress = PROGRESS_INSTALLED
+		self.check_and_start_service(shell)
+		self.job.update(completed=True, in_progress=False, progress=100)
@@ -0,0 +1,109 @@
+"""CPU cost per GB of the download loop: 1 KiB iter_content (old) vs 4 MiB readinto (new).
+
+A plain HTTP server in a child process streams the body so only the client's CPU is
+measured, and the body goes to os.devnull so the disk is out of the picture.
+
+    python benchmarks/bench_download.py [--mb 1024]
+"""
+import argparse
+import hashlib
+import http.server
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Threads import DOWNLOAD_BUFFER_SIZE
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+def serve(port, size):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            for _ in range(size // len(BLOCK)):
+                self.wfile.write(BLOCK)
+
+    http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def old_loop(response, out, total_size):
+    """The download loop as it was: a write, a division and a clock read per KiB."""
+    downloaded_size = 0
+    start_time = time.time()
+    for chunk in response.iter_content(chunk_size=1024):
+        if chunk:
+            out.write(chunk)
+            downloaded_size += len(chunk)
+            progress = (downloaded_size / total_size) * 100
+            elapsed_time = time.time() - start_time
+            if elapsed_time > 0:
+                speed = downloaded_size / elapsed_time
+    return downloaded_size
+
+
+def new_loop(response, out, total_size):
+    """DownloadWorker.write_package's loop, including the sha256 it now keeps for the cache."""
+    digest = hashlib.sha256()
+    view = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+    raw = response.raw
+    raw.decode_content = True
+    downloaded_size = 0
+    start_time = time.time()
+    while True:
+        n = raw.readinto(view)
+        if not n:
+            break
+        out.write(view[:n])
+        digest.update(view[:n])
+        downloaded_size += n
+        progress = (downloaded_size / total_size) * 100
+        elapsed_time = time.time() - start_time
+        if elapsed_time > 0:
+            speed = downloaded_size / elapsed_time
+    return downloaded_size
+
+
+def measure(url, loop, size):
+    with open(os.devnull, "wb") as out, requests.get(url, stream=True) as response:
+        cpu, wall = time.process_time(), time.perf_counter()
+        assert loop(response, out, size) == size
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    gb = size / 1024 ** 3
+    print(f"{loop.__name__:9} cpu {cpu / gb:6.2f} s/GB   wall {wall / gb:6.2f} s/GB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=1024)
+    args = parser.parse_args()
+    size = args.mb * 1024 * 1024
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = multiprocessing.Process(target=serve, args=(port, size), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    try:
+        url = f"http://127.0.0.1:{port}/"
+        measure(url, old_loop, size)
+        measure(url, new_loop, size)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Threaded engine vs asyncio engine against local stand-in servers.
+
+Each (engine, fleet size) runs in its own process so peak RSS is per run. Stand-ins
+(benchmarks/standins.py) run in a separate process on localhost.
+
+    python benchmarks/bench_engines.py [--sizes 1000 5000 10000] [--engines threads asyncio]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Stand-in on port {port} did not start")
+
+
+def run_one(engine, size, http_port, ssh_port, batch):
+    """Deploy `size` simulated devices and return the measurements. Runs in a child process."""
+    from Devices import Device
+    devices = []
+    for i in range(size):
+        device = Device(f"Device {i}", "127.0.0.1")
+        device.port = ssh_port
+        device.username = f"user{i}"
+        device.password = "password"
+        device.probe_type = ("ubuntu", "centos", "debian")[i % 3]
+        device.file_type = "TAR"
+        devices.append(device)
+
+    os.chdir(tempfile.mkdtemp(prefix="bench-engines-"))  # probe_files/ and logs/ land here
+    insite = f"127.0.0.1:{http_port}"
+    if engine == "asyncio":
+        from AsyncEngine import AsyncDeployProbes
+        deployment = AsyncDeployProbes(devices, insite, 2, batch, batch, batch)
+    else:
+        from Threads import DeployProbesThread
+        deployment = DeployProbesThread(devices, insite, 2, batch, batch, batch)
+
+    peak_threads = 0
+    start = time.perf_counter()
+    deployment.start()
+    while deployment.is_alive():
+        peak_threads = max(peak_threads, threading.active_count())
+        deployment.join(0.2)
+    wall = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    failed = sum(1 for job in deployment.ssh_jobs if job.error)
+    return {
+        "engine": engine, "devices": size, "wall_s": round(wall, 2),
+        "devices_per_s": round(size / wall, 1), "cpu_s": round(usage.ru_utime + usage.ru_stime, 2),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1), "peak_threads": peak_threads, "failed": failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--engines", nargs="+", default=["threads", "asyncio"])
+    parser.add_argument("--batch", type=int, default=200, help="transfer/install concurrency and handshake cap")
+    parser.add_argument("--package-kb", type=int, default=256)
+    parser.add_argument("--run", nargs=4, metavar=("ENGINE", "SIZE", "HTTP_PORT", "SSH_PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        engine, size, http_port, ssh_port = args.run
+        print(json.dumps(run_one(engine, int(size), int(http_port), int(ssh_port), args.batch)))
+        return
+
+    import standins
+    http_port, ssh_port = free_port(), free_port()
+    server = multiprocessing.Process(target=standins.serve, args=(http_port, ssh_port, args.package_kb), daemon=True)
+    server.start()
+    wait_for_port(http_port)
+    wait_for_port(ssh_port)
+
+    print(f"{'engine':8} {'devices':>8} {'wall s':>8} {'dev/s':>8} {'cpu s':>8} {'rss MB':>8} {'threads':>8} {'failed':>7}")
+    try:
+        for size in args.sizes:
+            for engine in args.engines:
+                out = subprocess.run([sys.executable, __file__, "--batch", str(args.batch), "--run", engine, str(size),
+                                      str(http_port), str(ssh_port)], capture_output=True, text=True)
+                if out.returncode != 0:
+                    print(f"{engine:8} {size:>8} failed:\n{out.stderr}")
+                    continue
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                print(f"{r['engine']:8} {r['devices']:>8} {r['wall_s']:>8} {r['devices_per_s']:>8} {r['cpu_s']:>8} "
+                      f"{r['peak_rss_mb']:>8} {r['peak_threads']:>8} {r['failed']:>7}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Full deployments against a simulated network: fetch, download, transfer and install.
+
+The stand-ins (benchmarks/standins.py) run in their own process: an HTTPS Insite serving
+login, the device identity document and the probe packages, and --ssh-servers SSH servers
+that play the devices. --latency-ms is added to every HTTP answer, SSH login and shell
+command; --bandwidth-mbps caps each download and each upload.
+
+Every fleet size runs in a fresh process, which logs in, streams the device inventory and
+deploys it with DeployProbesThread exactly as the GUI would. Reported are wall time, CPU,
+peak RSS and, per stage, jobs per second over the stage's span in the run log, next to the
+medians of the run's own metrics.
+
+    python benchmarks/bench_fleet.py [--sizes 10 100 1000] [--latency-ms 20] [--bandwidth-mbps 100]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_engines import free_port, wait_for_port  # noqa: E402
+
+PROBE_TYPES = {"Edge Gateway": ("ubuntu", "TAR"), "Core Router": ("centos", "TAR"), "Encoder": ("debian", "DEB")}
+STAGES = ("download", "sftp", "ssh")
+
+
+def stage_spans(path):
+    """Seconds from each stage's first log line to its last, from a run log."""
+    from RunLog import read_run_log
+    spans = {}
+    for record in read_run_log(path):
+        when = datetime.datetime.fromisoformat(record["time"]).timestamp()
+        first, last = spans.get(record["stage"], (when, when))
+        spans[record["stage"]] = (min(first, when), max(last, when))
+    return {stage: last - first for stage, (first, last) in spans.items()}
+
+
+def median(summary, name):
+    values = [entry["p50"] for entry in summary if entry["name"] == name]
+    return round(values[0], 3) if values else None
+
+
+def run_one(size, http_port, ssh_ports, args):
+    """Fetch and deploy a fleet of `size` devices. Runs in a child process."""
+    from Devices import Device
+    from InsiteClient import STREAM_CHUNK, InsiteClient, JsonArrayStream
+    from Jobs import ERROR
+    from Threads import DeployProbesThread
+
+    os.chdir(tempfile.mkdtemp(prefix="bench-fleet-"))  # probe_cache/ and logs/ land here
+    insite = f"127.0.0.1:{http_port}"
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+
+    client = InsiteClient(insite, api_port=None)
+    client.login("admin", "admin")
+    devices = []
+    with client.device_identity_stream() as response:
+        for i, identity in enumerate(JsonArrayStream(response.iter_content(STREAM_CHUNK), "devices")):
+            identity = identity["identification"]
+            device = Device(identity["alias"], "127.0.0.1")  # Every device is on a local stand-in
+            device.port = ssh_ports[i % len(ssh_ports)]
+            device.username, device.password = f"user{i}", "password"
+            device.probe_type, device.file_type = PROBE_TYPES[identity["device-type"]]
+            devices.append(device)
+    fetch = time.perf_counter() - start
+
+    deployment = DeployProbesThread(devices, insite, 2, args.batch, args.batch, args.batch, insite_client=client,
+                                    script_install=args.script_install)
+    peak_threads = 0
+    deployment.start()
+    while deployment.is_alive():
+        peak_threads = max(peak_threads, threading.active_count())
+        deployment.join(0.2)
+    wall = time.perf_counter() - start
+
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    spans = stage_spans(deployment.run_log.path)
+    summary = deployment.metrics.summary()
+    snapshot = deployment.snapshot()
+    result = {
+        "devices": len(devices), "fetch_s": round(fetch, 3), "wall_s": round(wall, 2),
+        "cpu_s": round(after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime, 2),
+        "peak_rss_mb": round(after.ru_maxrss / 1024, 1), "peak_threads": peak_threads,
+        "failed": sum(1 for job in deployment.ssh_jobs if snapshot.flags[job.index] & ERROR),
+        "connect_p50_s": median(summary, "ssh_connect_seconds"),
+        "sftp_mb_s_p50": median(summary, "sftp_mb_per_second"),
+        "install_p50_s": median(summary, "install_seconds"),
+    }
+    for stage, jobs in zip(STAGES, (deployment.download_jobs, deployment.sftp_jobs, deployment.ssh_jobs)):
+        span = spans.get(stage, 0)
+        result[f"{stage}_per_s"] = round(len(jobs) / span, 1) if span else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--batch", type=int, default=50, help="transfer/install concurrency and handshake cap")
+    parser.add_argument("--package-kb", type=int, default=2048)
+    parser.add_argument("--ssh-servers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100, help="per stream, 0 for unlimited")
+    parser.add_argument("--script-install", action="store_true")
+    parser.add_argument("--run", nargs=2, metavar=("SIZE", "PORTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        size, ports = args.run
+        http_port, *ssh_ports = [int(port) for port in ports.split(",")]
+        print(json.dumps(run_one(int(size), http_port, ssh_ports, args)))
+        return
+
+    import standins
+    print(f"{args.latency_ms:g} ms latency, {args.bandwidth_mbps:g} Mbit/s per stream, "
+          f"{args.package_kb} KB packages, {args.ssh_servers} SSH servers, batch {args.batch}")
+    print(f"{'devices':>8} {'fetch s':>8} {'wall s':>8} {'cpu s':>7} {'rss MB':>7} {'threads':>7} {'failed':>6} "
+          f"{'dl/s':>6} {'sftp/s':>7} {'ssh/s':>6} {'conn p50':>8} {'MB/s p50':>8} {'inst p50':>8}")
+    for size in args.sizes:
+        http_port = free_port()
+        ssh_ports = [free_port() for _ in range(args.ssh_servers)]
+        server = multiprocessing.Process(target=standins.serve, daemon=True,
+                                         args=(http_port, ssh_ports, args.package_kb, size, args.latency_ms / 1000,
+                                               int(args.bandwidth_mbps * 1000 * 1000 / 8)))
+        server.start()
+        try:
+            for port in [http_port, *ssh_ports]:
+                wait_for_port(port)
+            options = ["--batch", str(args.batch)] + (["--script-install"] if args.script_install else [])
+            out = subprocess.run([sys.executable, __file__, *options, "--run", str(size),
+                                  ",".join(str(port) for port in [http_port, *ssh_ports])],
+                                 capture_output=True, text=True)
+        finally:
+            server.terminate()
+        if out.returncode != 0:
+            print(f"{size:>8} failed:\n{out.stderr}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['devices']:>8} {r['fetch_s']:>8} {r['wall_s']:>8} {r['cpu_s']:>7} {r['peak_rss_mb']:>7} "
+              f"{r['peak_threads']:>7} {r['failed']:>6} {r['download_per_s']!s:>6} {r['sftp_per_s']!s:>7} "
+              f"{r['ssh_per_s']!s:>6} {r['connect_p50_s']!s:>8} {r['sftp_mb_s_p50']!s:>8} {r['install_p50_s']!s:>8}")
+
+
+if __name__ == "__main__":
+    main()
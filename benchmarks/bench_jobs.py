@@ -0,0 +1,103 @@
+"""Memory and read cost of job state: JobStore against the old one-object-per-job Job.
+
+Each job gets a device reference, a few state updates and three log lines, roughly what a
+finished deployment holds. Memory is what tracemalloc sees allocated for the jobs; "read" is
+one pass over every job's progress and status, what the task list does on each refresh. The
+store is read through one snapshot, so its pass is also consistent.
+
+    python benchmarks/bench_jobs.py [--jobs 10000 50000] [--logs 3]
+"""
+import argparse
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Jobs import JobStore
+
+
+class LegacyJob:
+    """Job as it was before JobStore."""
+    def __init__(self, device):
+        self.device = device
+        self.error = False
+        self.completed = False
+        self.in_progress = False
+        self.final_update_done = False
+        self.size = 0
+        self.done = 0
+        self.progress = 0
+        self.speed = 0
+        self.skipped = None
+        self.logs = []
+        self.lock = threading.Lock()
+
+    def add_log(self, message):
+        with self.lock:
+            self.logs.append(message)
+
+
+def fill(jobs, logs):
+    for i, job in enumerate(jobs):
+        job.in_progress = True
+        job.size = job.done = 12.5 + i % 7
+        job.progress = 100.0
+        job.speed = 40.0 + i % 13
+        job.in_progress = False
+        job.completed = True
+        for line in range(logs):
+            job.add_log(f"Step {line} finished")
+
+
+def legacy_jobs(count, device, logs):
+    jobs = [LegacyJob(device) for _ in range(count)]
+    fill(jobs, logs)
+    return jobs, lambda: [(job.progress, job.error, job.completed, job.in_progress, job.skipped) for job in jobs]
+
+
+def store_jobs(count, device, logs):
+    store = JobStore()
+    jobs = [store.add(device) for _ in range(count)]
+    fill(jobs, logs)
+
+    def read():
+        snapshot = store.snapshot()
+        progress, flags, skipped = snapshot.progress, snapshot.flags, snapshot.skipped
+        return [(progress[i], flags[i], skipped.get(i)) for i in range(len(snapshot))]
+    return (store, jobs), read
+
+
+def measure(build, count, logs):
+    """Bytes per job held by the jobs and milliseconds for one read of all of them."""
+    device = object()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    jobs, read = build(count, device, logs)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    start = time.perf_counter()
+    read()
+    elapsed = time.perf_counter() - start
+    del jobs
+    return held / count, elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--logs", type=int, default=3, help="log lines per job")
+    args = parser.parse_args()
+
+    print(f"{'jobs':>7} {'engine':>8} {'bytes/job':>10} {'total MB':>9} {'read ms':>8}")
+    for count in args.jobs:
+        for name, build in (("legacy", legacy_jobs), ("store", store_jobs)):
+            per_job, read_ms = measure(build, count, args.logs)
+            print(f"{count:>7} {name:>8} {per_job:>10.0f} {per_job * count / 2 ** 20:>9.1f} {read_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Slot handoff latency: time from one job finishing to the next queued job starting.
+
+Compares WorkerPool against the old BaseManager loop (thread per job, 1 s polling).
+
+    python benchmarks/bench_pool.py [--jobs 200] [--batch 4]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Pool import WorkerPool
+
+
+def make_job(starts, ends, i, duration):
+    def job():
+        starts[i] = time.perf_counter()
+        time.sleep(duration)
+        ends[i] = time.perf_counter()
+    return job
+
+
+def handoffs(starts, ends, batch):
+    """Job i + batch can only start once one of the first i + 1 jobs has ended."""
+    gaps = []
+    for i in range(batch, len(starts)):
+        freed = sorted(ends[:i])[i - batch]
+        gaps.append(max(0.0, starts[i] - freed))
+    return gaps
+
+
+def run_pool(jobs, batch, duration):
+    starts, ends = [0.0] * jobs, [0.0] * jobs
+    pool = WorkerPool(batch)
+    begin = time.perf_counter()
+    for i in range(jobs):
+        pool.submit(make_job(starts, ends, i, duration))
+    pool.close()
+    pool.wait()
+    return time.perf_counter() - begin, handoffs(starts, ends, batch)
+
+
+def run_legacy(jobs, batch, duration):
+    """The pre-pool BaseManager.run loop."""
+    starts, ends = [0.0] * jobs, [0.0] * jobs
+    active = []
+    begin = time.perf_counter()
+    for i in range(jobs):
+        while len(active) == batch:
+            active = [t for t in active if t.is_alive()]
+            threading.Event().wait(1)
+        thread = threading.Thread(target=make_job(starts, ends, i, duration))
+        thread.start()
+        active.append(thread)
+    while active:
+        active = [t for t in active if t.is_alive()]
+        threading.Event().wait(1)
+    return time.perf_counter() - begin, handoffs(starts, ends, batch)
+
+
+def report(name, wall, gaps):
+    gaps = sorted(gaps)
+    p99 = gaps[int(len(gaps) * 0.99) - 1] if gaps else 0
+    print(f"{name:8} wall {wall:8.2f} s   handoff p50 {statistics.median(gaps) * 1e3:9.3f} ms"
+          f"   p99 {p99 * 1e3:9.3f} ms   max {gaps[-1] * 1e3:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=0.01, help="seconds per job")
+    parser.add_argument("--legacy-jobs", type=int, default=20, help="the polling loop is slow, keep this small")
+    args = parser.parse_args()
+
+    report("pool", *run_pool(args.jobs, args.batch, args.duration))
+    report("legacy", *run_legacy(args.legacy_jobs, args.batch, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Device list search: the trigram index in DeviceIndex against scanning every device.
+
+A fleet of fake devices is spread over device types, indexed once, then searched with
+queries of different lengths, the way the search box sees them while typing. The scan is
+what a search without an index costs: one substring test per device.
+
+    python benchmarks/bench_search.py [--devices 20000] [--types 150]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Devices import Device, DeviceIndex  # noqa: E402
+
+QUERIES = ["1", "10.", "10.4.1", "10.4.17.2", "edge", "edge-01", "probe 7", "zzz"]
+
+
+def make_device_types(devices, types):
+    random.seed(1)
+    device_types = {f"Probe {t} {random.choice(['Edge', 'Core', 'Gateway'])}": [] for t in range(types)}
+    names = list(device_types)
+    for i in range(devices):
+        alias = f"{random.choice(['edge', 'core', 'gw', 'srv'])}-{i:05d}"
+        device_types[random.choice(names)].append(Device(alias, f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"))
+    return device_types
+
+
+def timed(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--types", type=int, default=150)
+    args = parser.parse_args()
+
+    device_types = make_device_types(args.devices, args.types)
+    start = time.perf_counter()
+    index = DeviceIndex(device_types)
+    print(f"{args.devices} devices in {args.types} types, indexed in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'query':>12} {'matches':>8} {'scan ms':>8} {'index ms':>9}")
+    for query in QUERIES:
+        lowered = query.lower()
+        scan_ms = timed(lambda: [text for text in index.texts if lowered in text])
+        index_ms = timed(lambda: index.search(query))
+        print(f"{query!r:>12} {sum(index.matches.values()):>8} {scan_ms:>8.2f} {index_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
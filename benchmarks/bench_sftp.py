@@ -0,0 +1,193 @@
+"""SFTP upload throughput, paramiko's put() vs the deployer's tuned upload, at several RTTs.
+
+A paramiko SFTP server that discards uploads runs in a child process behind a TCP proxy
+that delays every chunk by half the RTT in each direction. Both paths upload the same
+file over the same proxied link.
+
+    python benchmarks/bench_sftp.py [--rtt 1 10 100] [--mb 64] [--buffer-kb 1024] [--channels 1 2 4]
+"""
+import argparse
+import heapq
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from SftpTransfer import open_sftp, upload  # noqa: E402
+
+
+class DiscardHandle(paramiko.SFTPHandle):
+    def __init__(self):
+        super().__init__()
+        self.size = 0
+
+    def write(self, offset, data):
+        self.size = max(self.size, offset + len(data))
+        return paramiko.SFTP_OK
+
+    def stat(self):
+        attrs = paramiko.SFTPAttributes()
+        attrs.st_size = self.size
+        attrs.st_mode = 0o100644
+        return attrs
+
+
+class DiscardSFTP(paramiko.SFTPServerInterface):
+    sizes = {}
+
+    def open(self, path, flags, attr):
+        handle = DiscardHandle()
+        self.sizes[path] = handle
+        return handle
+
+    def stat(self, path):
+        if path not in self.sizes:
+            return paramiko.SFTP_NO_SUCH_FILE
+        return self.sizes[path].stat()
+
+    lstat = stat
+
+
+class AnyPassword(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+def serve_sftp(listener, host_key):
+    while True:
+        sock, _ = listener.accept()
+        transport = paramiko.Transport(sock)  # 2 MiB channel window, as OpenSSH
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, DiscardSFTP)
+        transport.start_server(server=AnyPassword())
+
+
+def pump(src, dst, delay):
+    """Forward src to dst, each chunk leaving `delay` seconds after it arrived, in order."""
+    queue = []
+    cond = threading.Condition()
+    sequence = 0
+
+    def sender():
+        while True:
+            with cond:
+                while not queue:
+                    cond.wait()
+                due, _, data = queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    cond.wait(wait)
+                    continue
+                heapq.heappop(queue)
+            try:
+                if not data:
+                    dst.shutdown(socket.SHUT_WR)
+                    return
+                dst.sendall(data)
+            except OSError:
+                return
+
+    threading.Thread(target=sender, daemon=True).start()
+    while True:
+        try:
+            data = src.recv(256 * 1024)
+        except OSError:
+            data = b""
+        with cond:
+            heapq.heappush(queue, (time.monotonic() + delay, sequence, data))
+            sequence += 1
+            cond.notify()
+        if not data:
+            return
+
+
+def serve_proxy(listener, target_port, rtt_ms):
+    delay = rtt_ms / 2000
+    while True:
+        client, _ = listener.accept()
+        upstream = socket.create_connection(("127.0.0.1", target_port))
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=pump, args=(client, upstream, delay), daemon=True).start()
+        threading.Thread(target=pump, args=(upstream, client, delay), daemon=True).start()
+
+
+def serve(ports, rtts):
+    """SFTP server plus one proxy per RTT. Meant as a multiprocessing target."""
+    server = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=serve_sftp, args=(server, paramiko.RSAKey.generate(2048)), daemon=True).start()
+    for rtt in rtts:
+        proxy = socket.create_server(("127.0.0.1", 0))
+        threading.Thread(target=serve_proxy, args=(proxy, server.getsockname()[1], rtt), daemon=True).start()
+        ports[rtt] = proxy.getsockname()[1]
+    threading.Event().wait()
+
+
+def connect(port):
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect("127.0.0.1", port, "bench", "bench", allow_agent=False, look_for_keys=False)
+    return ssh
+
+
+def measure(port, path, channels, buffer_size):
+    """MB/s of one upload; channels=0 means paramiko's put()."""
+    ssh = connect(port)
+    try:
+        start = time.perf_counter()
+        if channels:
+            sftp = open_sftp(ssh.get_transport())
+            upload(sftp, path, "/upload", buffer_size, channels=channels)
+        else:
+            sftp = ssh.open_sftp()
+            sftp.put(path, "/upload")
+        elapsed = time.perf_counter() - start
+        sftp.close()
+    finally:
+        ssh.close()
+    return os.path.getsize(path) / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt", type=int, nargs="+", default=[1, 10, 100], help="round trip times in ms")
+    parser.add_argument("--mb", type=int, default=64, help="size of the uploaded file")
+    parser.add_argument("--buffer-kb", type=int, default=1024, help="tuned upload read buffer")
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 2, 4], help="tuned upload SFTP sessions")
+    args = parser.parse_args()
+
+    ports = multiprocessing.Manager().dict()
+    server = multiprocessing.Process(target=serve, args=(ports, args.rtt), daemon=True)
+    server.start()
+    while len(ports) < len(args.rtt):
+        time.sleep(0.1)
+
+    with tempfile.NamedTemporaryFile() as package:
+        package.write(os.urandom(args.mb * 1024 * 1024))
+        package.flush()
+        columns = [0] + args.channels
+        print(f"{'rtt ms':>7} " + " ".join(f"{'put()' if c == 0 else f'tuned x{c}':>10}" for c in columns) + "   (MB/s)")
+        try:
+            for rtt in args.rtt:
+                speeds = [measure(ports[rtt], package.name, channels, args.buffer_kb * 1024) for channels in columns]
+                print(f"{rtt:>7} " + " ".join(f"{speed:>10.1f}" for speed in speeds))
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Cold start of the GUI: where import time goes and how long until the first frame shows.
+
+Each run starts a fresh interpreter. The import profile comes from python -X importtime:
+the time spent in each top-level package's own modules, whoever imported them. Time to
+first frame is from launching the interpreter to the first idle of the event loop after
+MainFrame.Show(). The run also lists which of LAZY were already loaded by then; there
+should be none, they belong to fetch, deploy, the task list and the device popup.
+
+Exits 1 when the median time to first frame is over --budget-ms or a lazy module was
+loaded at startup, so it can guard the startup budget in CI.
+
+    python benchmarks/bench_startup.py [--runs 5] [--budget-ms 1500] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY = ["paramiko", "requests", "urllib3", "wx.dataview", "wx.adv", "wx.grid", "Threads", "InsiteClient", "TaskList",
+        "DevicePopup"]
+
+FIRST_FRAME = """
+import sys
+import wx
+import Main
+app = wx.App()
+frame = Main.MainFrame(None, title="Magnum Analytics Probe Deployer", size=(700, 600))
+frame.Show()
+
+def shown():
+    print(__import__("json").dumps({"loaded": sorted(sys.modules)}), flush=True)
+    frame.Destroy()
+    app.ExitMainLoop()
+
+wx.CallAfter(shown)
+app.MainLoop()
+"""
+
+
+def import_profile(module):
+    """Microseconds spent in each top-level package's modules while importing module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr.strip().splitlines()[-1])
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            own, _, name = line[len("import time:"):].split("|")
+            own = int(own)
+        except ValueError:
+            continue  # Header line
+        top = name.strip().split(".")[0]
+        packages[top] = packages.get(top, 0) + own
+    return packages
+
+
+def first_frame():
+    """Milliseconds from launching the interpreter to the first frame, and the modules loaded by then."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", FIRST_FRAME], cwd=ROOT, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise SystemExit(result.stderr.strip().splitlines()[-1])
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])["loaded"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="Main", help="module whose import is profiled")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-frame", action="store_true", help="only profile imports, no display needed")
+    args = parser.parse_args()
+
+    profile = import_profile(args.module)
+    total = sum(profile.values())
+    print(f"import {args.module}: {total / 1000:.0f} ms")
+    for name, micros in sorted(profile.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<24} {micros / 1000:7.1f} ms")
+    if args.no_frame:
+        return 0
+
+    times = []
+    loaded = []
+    for _ in range(args.runs):
+        elapsed, loaded = first_frame()
+        times.append(elapsed)
+    median = statistics.median(times)
+    eager = [name for name in LAZY if name in loaded]
+    print(f"first frame: median {median:.0f} ms, min {min(times):.0f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+    if eager:
+        print(f"loaded at startup but should be lazy: {', '.join(eager)}")
+    return 1 if median > args.budget_ms or eager else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""UI-thread time of one task list refresh: the virtual model against the old per-row loop.
+
+A deployment's jobs are faked in a JobStore and, between ticks, a share of them is written
+the way running workers would. The old loop is the pre-virtual refresh_tasks over plain Job
+objects, calling a stand-in SetValue five times per changed row. The virtual refresh takes a
+snapshot, finds the changed rows and renders the cells of one screen of rows, which is what
+the control asks for when it repaints. wx's own drawing is left out of both, so the old
+loop's real cost is higher by whatever its SetValue calls cost.
+
+    python benchmarks/bench_tasklist.py [--rows 10000] [--active 0.02] [--ticks 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_jobs import LegacyJob  # noqa: E402
+from Devices import Device  # noqa: E402
+from Jobs import JobStore  # noqa: E402
+from TaskRows import COLUMNS, TaskRows, job_status  # noqa: E402
+
+SCREEN_ROWS = 30
+
+
+def make_devices(count):
+    devices = []
+    for i in range(count):
+        device = Device(f"Device {i}", f"10.0.{i // 250}.{i % 250 + 1}")
+        device.probe_type, device.file_type = random.choice([("ubuntu", "TAR"), ("centos", "TAR"), ("debian", "DEB")])
+        devices.append(device)
+    return devices
+
+
+def make_deployment(devices, new_job):
+    pairs = {}
+    deployment = SimpleNamespace(download_jobs=[], sftp_jobs=[], ssh_jobs=[])
+    for device in devices:
+        deployment.sftp_jobs.append(new_job(device))
+        deployment.ssh_jobs.append(new_job(device))
+        if (device.probe_type, device.file_type) not in pairs:
+            pairs[(device.probe_type, device.file_type)] = True
+            deployment.download_jobs.append(new_job(device))
+    return deployment
+
+
+def work(jobs, share):
+    """Progress a random share of the jobs, finishing some, as the workers would between ticks."""
+    for job in random.sample(jobs, max(1, int(len(jobs) * share))):
+        if job.progress >= 90:
+            job.in_progress = False
+            job.completed = True
+            job.progress = 100
+        else:
+            job.in_progress = True
+            job.size = 25.0
+            job.done = job.progress / 4
+            job.progress = min(100, job.progress + 10)
+            job.speed = 40.0
+
+
+class LegacyView:
+    """refresh_tasks as it was before the virtual model, minus wx."""
+    def __init__(self, deployment):
+        self.deploy_thread = deployment
+        self.calls = 0
+        self.final = set()
+
+    def SetValue(self, value, row, col):
+        self.calls += 1
+
+    def update_task(self, index, size, progress, status, speed):
+        size_str = f"{size} MB" if speed is not None else "N/A"
+        speed_str = f"{round(speed, 1)} MB/s" if speed is not None else "N/A"
+        self.SetValue(size_str, index, 1)
+        self.SetValue(int(progress), index, 2)
+        self.SetValue(f"{round(progress, 1)} %", index, 3)
+        self.SetValue(status, index, 4)
+        self.SetValue(speed_str, index, 5)
+
+    def refresh_tasks(self):
+        index = 0
+        for jobs, active, measured in ((self.deploy_thread.download_jobs, "Downloading", True),
+                                       (self.deploy_thread.sftp_jobs, "Transferring", True),
+                                       (self.deploy_thread.ssh_jobs, "In progress", False)):
+            for job in jobs:
+                if job.progress == 0 or id(job) in self.final:
+                    index += 1
+                    continue
+                size = "?" if job.size == 0 else str(round(job.size, 2))
+                if job.progress == 100:
+                    self.final.add(id(job))
+                status = job_status(job, active)
+                self.update_task(index, size if measured else None, job.progress, status,
+                                 job.speed if measured else None)
+                index += 1
+
+
+def virtual_refresh(rows):
+    """One tick of TaskListView.refresh_tasks plus the repaint of one screen of rows."""
+    rows.refresh()
+    for position in range(min(SCREEN_ROWS, len(rows))):
+        for column in range(len(COLUMNS)):
+            rows.value(position, column)
+
+
+def run(rows_wanted, share, ticks):
+    devices = make_devices(rows_wanted // 2)
+    random.seed(1)
+    legacy = make_deployment(devices, LegacyJob)
+    view = LegacyView(legacy)
+    legacy_jobs = legacy.sftp_jobs + legacy.ssh_jobs
+    legacy_times = []
+    for _ in range(ticks):
+        work(legacy_jobs, share)
+        start = time.perf_counter()
+        view.refresh_tasks()
+        legacy_times.append(time.perf_counter() - start)
+
+    random.seed(1)
+    store = JobStore()
+    deployment = make_deployment(devices, store.add)
+    deployment.job_store = store
+    start = time.perf_counter()
+    rows = TaskRows(deployment)
+    open_ms = (time.perf_counter() - start) * 1000
+    jobs = deployment.sftp_jobs + deployment.ssh_jobs
+    virtual_times = []
+    for _ in range(ticks):
+        work(jobs, share)
+        start = time.perf_counter()
+        virtual_refresh(rows)
+        virtual_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    rows.set_filter("In progress")
+    filter_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    rows.sort(2)
+    sort_ms = (time.perf_counter() - start) * 1000
+
+    total = len(rows.jobs)
+    print(f"{total} rows, {share:.0%} of jobs written per tick, {ticks} ticks")
+    print(f"  old refresh      median {statistics.median(legacy_times) * 1000:7.2f} ms"
+          f"   max {max(legacy_times) * 1000:7.2f} ms   SetValue calls {view.calls / ticks:8.0f}/tick")
+    print(f"  virtual refresh  median {statistics.median(virtual_times) * 1000:7.2f} ms"
+          f"   max {max(virtual_times) * 1000:7.2f} ms")
+    print(f"  virtual open {open_ms:.1f} ms, filter {filter_ms:.1f} ms, sort {sort_ms:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--active", type=float, default=0.02, help="share of jobs written per tick")
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+    run(args.rows, args.active, args.ticks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""Local stand-ins for an Insite server and for the probe devices, for benchmarks only.
+
+One HTTPS server answers the Insite login, device identity and probe endpoints, and one or
+more SSH servers play every device: they accept any password, discard SFTP uploads and
+emulate the root shell the installer drives. Each device is told apart by its username.
+Everything runs on one asyncio loop, normally in a child process so it does not skew the
+deployer's own measurements.
+
+A network can be simulated: every HTTP request, SSH login and shell or exec command waits
+LATENCY seconds before answering, and package downloads and SFTP uploads are held to
+BANDWIDTH bytes per second each.
+"""
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shlex
+import ssl
+import tempfile
+
+import asyncssh
+from aiohttp import web
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+LATENCY = 0.0  # Seconds added to every answer
+BANDWIDTH = 0  # Bytes per second per download or upload, 0 for unlimited
+DEVICE_TYPES = ["Edge Gateway", "Core Router", "Encoder"]
+
+
+async def delay():
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+
+
+async def throttle(state, size):
+    """Hold a stream to BANDWIDTH: state["ready"] is when it may send again."""
+    if not BANDWIDTH:
+        return
+    now = asyncio.get_running_loop().time()
+    state["ready"] = max(now, state.get("ready", now)) + size / BANDWIDTH
+    await asyncio.sleep(state["ready"] - now)
+
+
+def make_certificate(directory):
+    """Write a self-signed localhost certificate and key, return their paths."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def device_identity(devices):
+    """The device identity document of a fleet of devices named Device 0, Device 1..."""
+    return {"devices": [{"identification": {"alias": f"Device {i}",
+                                            "control-ips": [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"],
+                                            "device-type": DEVICE_TYPES[i % len(DEVICE_TYPES)]}}
+                        for i in range(devices)]}
+
+
+def insite_app(package, devices=0):
+    etag = f'"{hashlib.sha256(package).hexdigest()[:16]}"'
+    identity = json.dumps(device_identity(devices)).encode()
+    identity_etag = f'"{hashlib.sha256(identity).hexdigest()[:16]}"'
+
+    async def login(request):
+        await delay()
+        response = web.json_response({"status": "ok"})
+        response.set_cookie("session", "standin")
+        return response
+
+    async def identities(request):
+        await delay()
+        if request.headers.get("If-None-Match") == identity_etag:
+            return web.Response(status=304, headers={"ETag": identity_etag})
+        return web.Response(body=identity, content_type="application/json", headers={"ETag": identity_etag})
+
+    async def probes(request):
+        await delay()
+        payload = await request.json()
+        return web.json_response({"path": f"{payload['type']}-{payload['archive-type']}.pkg"})
+
+    async def send(request, status, body, headers):
+        if not BANDWIDTH:
+            return web.Response(status=status, body=body, headers=headers, content_type="application/octet-stream")
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_type = "application/octet-stream"
+        response.content_length = len(body)
+        await response.prepare(request)
+        state = {}
+        for offset in range(0, len(body), 65536):
+            chunk = body[offset:offset + 65536]
+            await throttle(state, len(chunk))
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def download(request):
+        await delay()
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        ranges = request.headers.get("Range", "")
+        if ranges.startswith("bytes=") and request.headers.get("If-Range", etag) == etag:
+            first, _, last = ranges[len("bytes="):].partition("-")
+            first, last = int(first), int(last) if last else len(package) - 1
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(package)}"
+            return await send(request, 206, package[first:last + 1], headers)
+        return await send(request, 200, package, headers)
+
+    app = web.Application()
+    app.router.add_post("/api/-/login", login)
+    app.router.add_get("/api/-/settings/device-identity", identities)
+    app.router.add_post("/api/-/model/probes", probes)
+    app.router.add_get("/probe/download/{path}", download)
+    return app
+
+
+class Sink:
+    """Uploaded file that only remembers its size and, if written front to back, its sha256."""
+    def __init__(self):
+        self.size = 0
+        self.position = 0
+        self.digest = hashlib.sha256()
+        self.stream = {}  # Bandwidth state of the upload
+
+    def seek(self, offset):
+        self.position = offset
+
+    def write(self, data):
+        if self.digest is not None and self.position == self.size:
+            self.digest.update(data)
+        else:
+            self.digest = None
+        self.position += len(data)
+        self.size = max(self.size, self.position)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DiscardSFTPServer(asyncssh.SFTPServer):
+    """Accepts uploads without storing them; stat() reports the size written so that
+    clients confirming the upload (paramiko does by default) are satisfied."""
+    sizes = {}
+
+    def open(self, path, pflags, attrs):
+        if path not in self.sizes or pflags & asyncssh.FXF_TRUNC:
+            self.sizes[path] = Sink()
+        return self.sizes[path]
+
+    def stat(self, path):
+        if path not in self.sizes:
+            raise asyncssh.SFTPNoSuchFile(path.decode(errors="replace"))
+        return asyncssh.SFTPAttrs(size=self.sizes[path].size, permissions=0o100644)
+
+    def lstat(self, path):
+        return self.stat(path)
+
+    async def write(self, file_obj, offset, data):
+        await throttle(file_obj.stream, len(data))
+        file_obj.seek(offset)
+        return file_obj.write(data)
+
+    def fstat(self, file_obj):
+        return asyncssh.SFTPAttrs(size=file_obj.size, permissions=0o100644)
+
+    def fsetstat(self, file_obj, attrs):
+        pass
+
+    def remove(self, path):
+        self.sizes.pop(path, None)
+
+
+class AnyPasswordServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    async def validate_password(self, username, password):
+        await delay()
+        return True
+
+
+def sha256sum(command):
+    path = shlex.split(command)[1]
+    sink = DiscardSFTPServer.sizes.get(path.encode())
+    if sink is None or sink.digest is None:
+        return "", f"sha256sum: {path}: No such file or directory\n", 1
+    return f"{sink.digest.hexdigest()}  {path}\n", "", 0
+
+
+installed = {}  # username -> package sha256 the installer recorded on the "device"
+running = set()  # Usernames whose probe the installer set up
+INSTALLER_QUESTIONS = ("Select the probe mode (1: standalone, 2: managed) [1]: ",
+                       "Install insite-probe as a service and enable it? [y/n]: ")
+
+
+def relay(command):
+    """`dd if=SRC ... | ssh ... USER@HOST 'cat > DEST && sha256sum DEST'` run on a seed: the
+    copy is made between two of our sinks. Returns stdout, stderr and the exit status."""
+    words = shlex.split(command)
+    src = next(word for word in words if word.startswith("if="))[len("if="):]
+    dest = shlex.split(words[-1])[2]
+    sink = DiscardSFTPServer.sizes.get(src.encode())
+    if sink is None:
+        return "", f"dd: failed to open '{src}': No such file or directory\n", 1
+    DiscardSFTPServer.sizes[dest.encode()] = sink
+    return f"{sink.digest.hexdigest()}  {dest}\n", f"{sink.size} bytes copied, 0.1 s\n", 0
+
+
+def exec_request(process):
+    """The deployer's one-off commands: sha256sum of an upload, the installed-probe fingerprint
+    and relayed copies, directly or through a seed's ssh. Returns stdout, stderr and the exit status."""
+    command = process.command
+    if command.startswith("sh -c 'trap "):  # A seed's command, wrapped to remove its askpass script
+        command = shlex.split(command)[2].split("; ", 2)[2]
+    if "status=progress |" in command:
+        return relay(command)
+    username = process.get_extra_info("username")
+    if " ssh " in f" {command}":  # Hop from a seed to a neighbour
+        username = next(word for word in shlex.split(command) if "@" in word).split("@")[0]
+    if command.startswith("sha256sum "):
+        return sha256sum(command)
+    if "is-active insite-probe" in command:
+        digest = installed.get(username)
+        return (f"{digest}\n\nactive\n", "", 0) if digest else ("\ninactive\n", "", 3)
+    return "", "", 127
+
+
+async def install_script(process):
+    """`sudo -p PROMPT sh -c ...` or `su -c ...` wrapping the single-script install: asks for the
+    password, then reports every step as done, recording the marker like the shell does."""
+    command = process.command
+    if command.startswith("su "):
+        process.stdout.write("Password: ")
+    else:
+        process.stdout.write(shlex.split(command)[2])
+    await process.stdin.readline()
+    script = base64.b64decode(re.search(r"echo (\S+) \| base64 -d", command).group(1)).decode()
+    token = re.search(r'echo "(\S+) \$status', script).group(1)
+    username = process.get_extra_info("username")
+    for line in script.splitlines():
+        if line.startswith("step "):
+            step = shlex.split(line)[1]
+            words = step.split()
+            package = {"mv": words[1], "dpkg": f"/home/{username}/{words[-1]}"}.get(words[0])
+            if package and package.encode() not in DiscardSFTPServer.sizes:
+                process.stdout.write(f"{token} 1 1 {step}\r\n")  # The package never arrived
+                process.exit(1)
+                return
+            if step.startswith("mkdir -p ") and "echo " in step:
+                installed[username] = step.split("echo ", 1)[1].split()[0]
+            process.stdout.write(f"{token} 0 1 {step}\r\n")
+    process.exit(0)
+
+
+async def installer(process, command):
+    """./install: asks INSTALLER_QUESTIONS, reading the answers from stdin or from the printf
+    piped into it, and leaves the probe running when they are 1 and y."""
+    piped = shlex.split(command.split("|")[0])[1].encode().decode("unicode_escape").splitlines() if "|" in command else []
+    answers = []
+    for question in INSTALLER_QUESTIONS:
+        process.stdout.write(question)
+        answer = piped.pop(0) if piped else (await process.stdin.readline()).strip()
+        process.stdout.write(f"{answer}\n")
+        answers.append(answer)
+    if answers == ["1", "y"]:
+        running.add(process.get_extra_info("username"))
+        process.stdout.write("insite-probe installed\n")
+    else:
+        process.stdout.write("Installation aborted\n")
+
+
+async def shell(process):
+    """Enough of a login shell for the interactive installer: prompts, sudo, PS1, cd, mv, tar,
+    dpkg, ./install, systemctl and the installed-package marker. The package must have been
+    uploaded and moved into place for tar to extract it, and the probe only runs once the
+    installer got its answers. Exec requests go to exec_request() or install_script()."""
+    if process.command and "base64 -d" in process.command:
+        await install_script(process)
+        return
+    if process.command:
+        await delay()
+        output, errors, status = exec_request(process)
+        process.stdout.write(output)
+        process.stderr.write(errors)
+        process.exit(status)
+        return
+    username = process.get_extra_info("username")
+    cwd = f"/home/{username}"
+    moved = {}  # Path -> upload moved there with mv
+    extracted = set()  # Directories a package was extracted in
+    prompt = "$ "
+    process.stdout.write(prompt)
+    while True:
+        line = await process.stdin.readline()
+        if not line:
+            break
+        command = line.strip()
+        words = command.split()
+        if command in ("sudo -s", "su"):
+            process.stdout.write("Password: " if command == "su" else "[sudo] password for user: ")
+            await process.stdin.readline()
+            prompt = "# "
+        elif "PS1=" in command:
+            prompt = shlex.split(command.split("PS1=", 1)[1])[0]
+        elif command == "rm -rf /opt/evertz/insite/probe":
+            running.discard(username)
+            moved = {path: upload for path, upload in moved.items() if not path.startswith(command.split()[-1])}
+        elif words[:1] == ["cd"] and len(words) == 2:
+            cwd = posixpath.normpath(posixpath.join(cwd, words[1]))
+        elif words[:1] == ["mv"] and len(words) == 3:
+            source = posixpath.join(cwd, words[1])
+            upload = DiscardSFTPServer.sizes.pop(source.encode(), None) or moved.pop(source, None)
+            if upload is None:
+                process.stdout.write(f"mv: cannot stat '{words[1]}': No such file or directory\n")
+            else:
+                moved[posixpath.join(cwd, words[2])] = upload
+        elif words[:1] == ["tar"]:
+            if posixpath.join(cwd, words[-1]) in moved:
+                extracted.add(cwd)
+                process.stdout.write("insite-probe/\ninsite-probe/setup/\ninsite-probe/setup/install\n")
+            else:
+                process.stdout.write(f"tar: {words[-1]}: Cannot open: No such file or directory\n")
+        elif command == "./install" or command.endswith("| ./install"):
+            if posixpath.dirname(posixpath.dirname(cwd)) in extracted and cwd.endswith("/insite-probe/setup"):
+                await installer(process, command)
+            else:
+                process.stdout.write("sh: ./install: No such file or directory\n")
+        elif words[:2] == ["dpkg", "-i"]:
+            path = posixpath.join(cwd, words[-1])
+            if path.encode() in DiscardSFTPServer.sizes or path in moved:
+                running.add(username)
+            else:
+                process.stdout.write(f"dpkg: error: cannot access archive '{words[-1]}': No such file or directory\n")
+        elif command.endswith("status insite-probe"):
+            state = "active (running)" if username in running else "inactive (dead)"
+            process.stdout.write(f"insite-probe.service\n   Active: {state}\n")
+        elif " > " in command and command.startswith("mkdir -p ") and "echo " in command:
+            installed[username] = command.split("echo ", 1)[1].split()[0]
+        elif command == "exit":
+            break
+        await delay()
+        process.stdout.write(prompt)
+    process.exit(0)
+
+
+async def start(http_port, ssh_ports, package_kb, devices=0):
+    directory = tempfile.mkdtemp(prefix="standins-")
+    cert_path, key_path = make_certificate(directory)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+
+    runner = web.AppRunner(insite_app(os.urandom(package_kb * 1024), devices), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", http_port, ssl_context=context, backlog=4096).start()
+
+    host_key = asyncssh.generate_private_key("ssh-ed25519")
+    for ssh_port in ssh_ports:
+        await asyncssh.create_server(AnyPasswordServer, "127.0.0.1", ssh_port, server_host_keys=[host_key],
+                                     process_factory=shell, sftp_factory=DiscardSFTPServer,
+                                     line_editor=False, backlog=4096)
+
+
+def serve(http_port, ssh_port, package_kb=256, devices=0, latency=0.0, bandwidth=0):
+    """Run the stand-ins forever. Meant as a multiprocessing target. ssh_port may be a list
+    of ports, one SSH server each; devices is the size of the device identity document."""
+    global LATENCY, BANDWIDTH
+    LATENCY, BANDWIDTH = latency, bandwidth
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start(http_port, ssh_port if isinstance(ssh_port, list) else [ssh_port], package_kb,
+                                  devices))
+    loop.run_forever()
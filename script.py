@@ -4,7 +4,7 @@ import json
 import paramiko
 from scp import SCPClient
 import os
-import time
+from Shell import PROMPT_TIMEOUT, Shell
 
 
 def download_file(base_url, payload, local_path):
@@ -87,37 +87,18 @@ def ssh_and_run_commands(host, port, username, password):
     channel.get_pty(term='vt100', width=300, height=24)
     channel.invoke_shell()
 
-    def read_until(channel, expected, timeout=None):
-        """Read the given channel until the expected text shows up or the timeout
-           (in seconds) expires. If timeout is None, it will wait forever. If
-           expected is None it will simply read for the given timeout."""
-        start = time.time()
-        reply = bytearray()
-        while channel.recv_ready() or channel.exit_status_ready() is False:
-            if channel.recv_ready():
-                reply.extend(channel.recv(8192))
-                # Is our expected response in the reply?
-                pos = reply.find(expected) if expected else -1
-                if pos > -1:
-                    break
-            else:
-                time.sleep(0.1)
-            elapsed = abs(time.time() - start)
-            if timeout and elapsed > timeout:
-                break
-        return reply.decode('utf-8')
-
-    channel.send('sudo -s\n')
-    read_until(channel, b'[sudo] password for', 5)
-    channel.send(password + '\n')
-    read_until(channel, b'#', 5)
+    shell = Shell(channel)
+
+    shell.send('sudo -s')
+    shell.read_until(b'[sudo] password for', PROMPT_TIMEOUT)
+    shell.send(password)
+    shell.read_until(b'#', PROMPT_TIMEOUT)
+    shell.start()
 
     # Now you are in a root shell, you can run commands as root
-    channel.send('mkdir -p /opt/evertz/insite/probe\n')
-    read_until(channel, b'#', 5)
+    shell.run('mkdir -p /opt/evertz/insite/probe')
 
-    #channel.send(f'mv {remote_temp_path} {remote_final_path}\n')
-    #read_until(channel, b'#', 5)
+    #shell.run(f'mv {remote_temp_path} {remote_final_path}')
 
     commands = [
         'cd /opt/evertz/insite/probe',
@@ -129,22 +110,19 @@ def ssh_and_run_commands(host, port, username, password):
 
     for command in commands:
         print(f"Command: {command}")
-        channel.send(command + '\n')
-        out = read_until(channel, b'#', 5)
+        out, elapsed = shell.run(command)
         print(f"Output: {out}")
+        print(f"Took {elapsed * 1000:.0f} ms")
 
     # Check the status of the insite-probe service
-    channel.send('systemctl status insite-probe\n')
-    output = read_until(channel, b'#', 5)
+    output, _ = shell.run('systemctl --no-pager status insite-probe')
     print(output)
 
     if 'active (running)' not in output:
-        channel.send('systemctl start insite-probe\n')
-        read_until(channel, b'#', 5)
+        shell.run('systemctl start insite-probe')
         print('Probe started.')
 
-    channel.send('systemctl status insite-probe\n')
-    output = read_until(channel, b'#', 5)
+    output, _ = shell.run('systemctl --no-pager status insite-probe')
     print(output)
 
     transport.close()